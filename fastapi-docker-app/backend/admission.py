@@ -0,0 +1,184 @@
+import os
+import math
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from tracing import bind_context
+from percentiles import percentile
+
+# Worker threads and waiting slots per dependency; requests beyond workers + queue limit are rejected with 503
+SNOWFLAKE_WORKERS = int(os.getenv("SNOWFLAKE_WORKERS", "4"))
+SNOWFLAKE_QUEUE_LIMIT = int(os.getenv("SNOWFLAKE_QUEUE_LIMIT", "16"))
+NEO4J_WORKERS = int(os.getenv("NEO4J_WORKERS", "8"))
+NEO4J_QUEUE_LIMIT = int(os.getenv("NEO4J_QUEUE_LIMIT", "32"))
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "16"))
+LLM_QUEUE_LIMIT = int(os.getenv("LLM_QUEUE_LIMIT", "64"))
+# Retry-After used until a lane has completed some work to estimate from
+OVERLOAD_RETRY_AFTER_S = int(os.getenv("OVERLOAD_RETRY_AFTER_S", "5"))
+OVERLOAD_MAX_RETRY_AFTER_S = 120
+# Items a streaming lane worker may produce ahead of a slow client before it waits for the client to catch up
+STREAM_BUFFER_ITEMS = int(os.getenv("STREAM_BUFFER_ITEMS", "64"))
+
+
+class Overloaded(Exception):
+    """
+    Raised when a dependency's executor has no free worker and its queue is full.
+    """
+
+    def __init__(self, lane, retry_after):
+        super().__init__(f"{lane} is overloaded, retry in {retry_after}s")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """
+    Thread pool for the blocking calls of one dependency, with a hard cap on queued work.
+
+    Slow Snowflake, Neo4j or LLM requests wait here instead of in Starlette's shared threadpool, so
+    cheap endpoints keep their threads. Once workers + queue_limit requests are admitted, new ones
+    are rejected immediately with a Retry-After estimated from the queue depth and recent run times.
+    """
+
+    def __init__(self, lane, workers, queue_limit, history=1000):
+        self.lane = lane
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{lane}-lane")
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._active = 0
+        self._counts = {"accepted": 0, "rejected": 0, "completed": 0, "failed": 0}
+        self._queue_wait = deque(maxlen=history)
+        self._run_time = deque(maxlen=history)
+
+    def retry_after(self):
+        # Time for the work already queued ahead to drain through the workers
+        if not self._run_time:
+            return OVERLOAD_RETRY_AFTER_S
+        average = sum(self._run_time) / len(self._run_time)
+        seconds = math.ceil((self._admitted - self.workers + 1) * average / self.workers)
+        return max(1, min(OVERLOAD_MAX_RETRY_AFTER_S, seconds))
+
+    def _admit(self):
+        with self._lock:
+            if self._admitted >= self.workers + self.queue_limit:
+                self._counts["rejected"] += 1
+                raise Overloaded(self.lane, self.retry_after())
+            self._admitted += 1
+            self._counts["accepted"] += 1
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queues fn(*args, **kwargs) on this lane and returns its Future; raises Overloaded when the lane is full.
+        """
+        self._admit()
+        queued_at = time.perf_counter()
+
+        def run():
+            started = time.perf_counter()
+            with self._lock:
+                self._active += 1
+                self._queue_wait.append(started - queued_at)
+            failed = False
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._admitted -= 1
+                    self._run_time.append(time.perf_counter() - started)
+                    self._counts["failed" if failed else "completed"] += 1
+
+        try:
+            # The request's trace context follows the work onto the lane's thread
+            return self._executor.submit(bind_context(run))
+        except RuntimeError:
+            with self._lock:
+                self._admitted -= 1
+            raise
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs fn on this lane from an async endpoint without holding a threadpool thread while it waits.
+        """
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stream(self, iterator_factory):
+        """
+        Runs a blocking generator on this lane and returns an async iterator over its items.
+
+        Admission happens here, before the response starts, so a full lane still answers 503. At most
+        STREAM_BUFFER_ITEMS items are buffered ahead of the client, and once the client disconnects (the
+        async iterator is closed) the generator is closed at its next item and the worker is released.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        slots = threading.Semaphore(STREAM_BUFFER_ITEMS)
+        cancelled = threading.Event()
+        done = object()
+
+        def produce():
+            iterator = iterator_factory()
+            try:
+                for item in iterator:
+                    while not slots.acquire(timeout=0.1):
+                        if cancelled.is_set():
+                            return
+                    if cancelled.is_set():
+                        return
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            finally:
+                if hasattr(iterator, "close"):
+                    iterator.close()
+                if not cancelled.is_set():
+                    loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        self.submit(produce)
+
+        async def items():
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is done:
+                        return
+                    slots.release()
+                    yield item
+            finally:
+                cancelled.set()
+
+        return items()
+
+    def stats(self):
+        with self._lock:
+            queue_wait = list(self._queue_wait)
+            run_time = list(self._run_time)
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "active": self._active,
+                "queued": self._admitted - self._active,
+                **self._counts,
+                "queue_wait_ms": {
+                    "p50": round(percentile(queue_wait, 0.5) * 1000, 1) if queue_wait else None,
+                    "p95": round(percentile(queue_wait, 0.95) * 1000, 1) if queue_wait else None,
+                },
+                "run_time_ms": {
+                    "p50": round(percentile(run_time, 0.5) * 1000, 1) if run_time else None,
+                    "p95": round(percentile(run_time, 0.95) * 1000, 1) if run_time else None,
+                },
+            }
+
+
+snowflake_lane = BoundedExecutor("snowflake", SNOWFLAKE_WORKERS, SNOWFLAKE_QUEUE_LIMIT)
+neo4j_lane = BoundedExecutor("neo4j", NEO4J_WORKERS, NEO4J_QUEUE_LIMIT)
+llm_lane = BoundedExecutor("llm", LLM_WORKERS, LLM_QUEUE_LIMIT)
+
+
+def admission_stats():
+    return {lane.lane: lane.stats() for lane in (snowflake_lane, neo4j_lane, llm_lane)}
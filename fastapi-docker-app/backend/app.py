@@ -1,25 +1,103 @@
 # app.py
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 import models
 from models import InsurancePlan
 import schemas
-from schemas import InsurancePlan, PatientID
+from schemas import InsurancePlan, PatientID, BatchRecommendationRequest, AdviseRequest, RankingMode
 from database import Base, engine, SessionLocal
-from typing import List
-import pandas as pd
-from neo4j_utils import neo4j_driver
+from typing import Optional
+from neo4j_utils import neo4j_driver, GRAPH_BACKEND, GRAPH_MODEL, graph_write_buffer, close_neo4j_driver
 from rules import apply_selected_rules, clean_value, get_plan_distribution,get_plans_by_type_from_neo4j, get_plan_ids_from_neo4j
-from snowflake_utils import get_snowflake_connection, normalize_snowflake_data
-from prompt import execute_cortex_query
+from rules import ensure_graph_indexes, upsert_patient, link_considered_plans, cohort_key, plan_graph_version, link_patient_to_cohort, mark_cohort_materialized, get_cohort_rule_results, preload_rule_statistics
+from snowflake_utils import get_snowflake_connection, normalize_snowflake_data, snowflake_pool
+from prompt import execute_cortex_query, execute_cortex_batch, build_llm_prompt, PROMPT_TEMPLATE_VERSION as CORTEX_PROMPT_VERSION
 import re
+import time
+import asyncio
 from datetime import date
 import json
-from openai_prompts import call_chatgpt_structured
+from openai_prompts import call_chatgpt_structured, stream_chatgpt_structured, build_chatgpt_prompt, call_chatgpt_map_reduce, OPENAI_MODELS, MAP_REDUCE_MIN_PLANS, PROMPT_TEMPLATE_VERSION as OPENAI_PROMPT_VERSION
+from recommendation_cache import recommendation_cache, recommendation_cache_key
+from segment_cache import segment_cache, segment_cache_key
+from plan_ranker import shortlist_plans
+from prompt_encoder import fit_plans_to_budget
+from llm_output import RecommendedPlanStreamParser, normalize_recommendation, normalize_plan
+from model_fanout import fanout_recommendations, fanout_stats
+from jobs import job_queue, FINISHED_STATUSES
+from openai_client import openai_client
+from llm_metrics import llm_metrics
 from cleanup import clean_value, ATTRIBUTE_CLEANUP_CONFIG
-models.Base.metadata.create_all(bind=engine)
+from admission import Overloaded, snowflake_lane, neo4j_lane, llm_lane, admission_stats
+from warmup import warmup
+from response_encoding import FastJSONResponse, encoded_response, encoding_stats
+from tracing import TRACING_ENABLED, request_trace
+from contextlib import asynccontextmanager
+from sqlalchemy import text
+def create_schemas():
+    # Runs at startup rather than on import, so importing the app (workers, tools, tests) touches no database
+    models.Base.metadata.create_all(bind=engine)
+    try:
+        ensure_graph_indexes(neo4j_driver)
+    except Exception as e:
+        print(f"⚠️ Could not create Neo4j indexes: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    create_schemas()
+    # Resumed here rather than on import, so only serving workers (not tools or tests importing the app) touch jobs
+    job_queue.resume()
+    # Warm-up runs in the background; /ready reports 503 until it has finished
+    warmup.start()
+    yield
+    # Flushes buffered graph writes; any that cannot be flushed fail rather than leaving requests waiting
+    close_neo4j_driver()
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# Every request gets a trace (continuing an incoming W3C traceparent); Postgres, Snowflake, Cypher and LLM calls
+# record spans into it (tracing.py), and Server-Timing sums them per dependency for the UI and browser dev tools
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    if not TRACING_ENABLED:
+        return await call_next(request)
+    start = time.perf_counter()
+    with request_trace(f"{request.method} {request.url.path}", request.headers.get("traceparent"),
+                       **{"http.method": request.method, "http.target": request.url.path}) as (trace, root):
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            root.name = f"{request.method} {route.path}"
+            root.set("http.route", route.path)
+        root.set("http.status_code", response.status_code)
+        response.headers["Server-Timing"] = trace.server_timing((time.perf_counter() - start) * 1000)
+    return response
+
+# Endpoints that wait on Snowflake, Neo4j or an LLM are async and run their blocking body on that dependency's
+# bounded lane (admission.py), so a burst of slow requests cannot exhaust the threadpool the cheap endpoints use.
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "lane": exc.lane},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.get("/encoding-stats/")
+def encoding_stats_endpoint():
+    """
+    Returns payload size, compressed size, encode time and format/encoding counts of each plan endpoint.
+    """
+    return encoding_stats.report()
 
-app = FastAPI()
+@app.get("/admission-stats/")
+def admission_stats_endpoint():
+    """
+    Returns workers, queue depth, rejections and queue wait / run time percentiles of each dependency lane.
+    """
+    return admission_stats()
 
 # Dependency to get DB session
 def get_db():
@@ -49,8 +127,14 @@ def read_patient(patient_id: int, db: Session = Depends(get_db)):
 
 
 
-@app.get("/insurance-plans/", response_model=List[InsurancePlan])
-def read_insurance_plans(skip: int = 0, limit: int = 10):
+# Plan endpoints accept ?fields=PlanId,PlanType,... to return only those plan attributes, drop null attributes
+# unless exclude_none=false, and negotiate MessagePack and zstd/gzip through encoded_response (response_encoding.py)
+@app.get("/insurance-plans/")
+async def read_insurance_plans(request: Request, skip: int = 0, limit: int = 10, fields: Optional[str] = None, exclude_none: bool = True):
+    plans = await snowflake_lane.run(fetch_insurance_plans, skip, limit)
+    return encoded_response(request, plans, "insurance-plans", fields, exclude_none)
+
+def fetch_insurance_plans(skip: int, limit: int):
     conn = get_snowflake_connection()
     cursor = conn.cursor()
 
@@ -148,9 +232,13 @@ def filter_plans(patient_data: dict) -> dict:
 
 
 @app.post("/filter-plans/")
-def filter_plans_endpoint(patient_id: PatientID, db: Session = Depends(get_db)):
+async def filter_plans_endpoint(request: Request, patient_id: PatientID, fields: Optional[str] = None, exclude_none: bool = True, db: Session = Depends(get_db)):
     if isinstance(patient_id, PatientID):  # Check if it's wrapped in a custom type
         patient_id = patient_id.patient_id
+    result = await snowflake_lane.run(filter_plans_for_patient, patient_id, db)
+    return encoded_response(request, result, "filter-plans", fields, exclude_none)
+
+def filter_plans_for_patient(patient_id: int, db: Session) -> dict:
     patient = db.query(models.Patient).filter(models.Patient.id == patient_id).first()
     print(f"Received patient_id: {patient_id}, Type: {type(patient_id)}")
 
@@ -184,18 +272,122 @@ def filter_plans_endpoint(patient_id: PatientID, db: Session = Depends(get_db)):
         "plans": plans[:10],
     }
 
+def apply_rules_to_plans(patient_data: dict, plans: list, cohort_id: str = None) -> dict:
+    """
+    Writes the plans filtered in Snowflake to the graph and applies the patient's rules.
+    With a cohort_id the CONSIDERS and rule edges are written once on the Cohort node instead of the patient.
+    """
+    if not plans:
+        raise HTTPException(status_code=404, detail="No plans found for the given criteria")
+
+    # Insert patient and filtered plans into the graph
+    graph_start = time.perf_counter()
+    if cohort_id is None:
+        upsert_patient(neo4j_driver, patient_data)
+
+    print("\n🔍 Plans Received in process_plans:")
+
+    plans_data = []
+    for plan in plans:
+        try:
+            if isinstance(plan, InsurancePlan):
+                plan_data = {
+                    key: clean_value(getattr(plan, key, None), ATTRIBUTE_CLEANUP_CONFIG.get(key, str))
+                    if key.lower() != "planid" else str(getattr(plan, key, None)) 
+                    for key in plan.__dict__
+                    if not key.startswith("_")
+                }
+            elif isinstance(plan, dict):
+                plan_data = {
+                    key: clean_value(plan.get(key, None), ATTRIBUTE_CLEANUP_CONFIG.get(key, str))
+                    if key.lower() != "planid" else str(plan.get(key, None))
+                    for key in plan.keys()
+                }
+            else:
+                raise Exception("Unexpected data type in plans")
+
+            plan_id = getattr(plan, 'PlanId', None) if isinstance(plan, InsurancePlan) else plan.get('PlanId')
+            plans_data.append((plan_id, plan_data))
+
+        except Exception as e:
+
+            raise HTTPException(status_code=500, detail=f"Error processing plan: {str(e)}")
+
+    try:
+        if cohort_id is None:
+            link_considered_plans(neo4j_driver, patient_data["id"], plans_data)
+        else:
+            link_considered_plans(neo4j_driver, cohort_id, plans_data, label="Cohort")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing plan: {str(e)}")
+
+    if cohort_id is None:
+        preferred_plans = apply_selected_rules(neo4j_driver, patient_data)
+    else:
+        preferred_plans = apply_selected_rules(neo4j_driver, patient_data, subject_id=cohort_id, label="Cohort")
+        mark_cohort_materialized(neo4j_driver, cohort_id)
+    print(f"⏱ Graph writes and rules took {time.perf_counter() - graph_start:.3f}s ({GRAPH_BACKEND} backend)")
+
+    return preferred_plans
+
 @app.post("/process-plans/")
-def process_plans(patient_id: PatientID, db: Session = Depends(get_db)):
+async def process_plans(request: Request, patient_id: PatientID, fields: Optional[str] = None, exclude_none: bool = True, db: Session = Depends(get_db)):
+    # Only the Snowflake filter runs on the scarce Snowflake lane, and cohort hits skip it entirely;
+    # the patient lookup, cohort check, graph writes and rules run on the Neo4j lane
     if isinstance(patient_id, PatientID):
         patient_id = patient_id.patient_id
 
+    def join(patient_id: int, db: Session):
+        patient_data = load_patient_data(patient_id, db)
+        return patient_data, join_cohort(patient_data)
+
+    patient_data, (cohort_id, cohort_ready) = await neo4j_lane.run(join, patient_id, db)
+    plans = None if cohort_ready else (await snowflake_lane.run(filter_plans, patient_data))["plans"]
+    result = await neo4j_lane.run(rank_patient_plans, patient_data, cohort_id, plans)
+    return encoded_response(request, result, "process-plans", fields, exclude_none)
+
+def no_stage(name: str):
+    pass
+
+class StageTimer:
+    """
+    stage callback that records how long each stage took, for responses that report per-stage timings.
+    """
+
+    def __init__(self):
+        self.timings_ms = {}
+        self._current = None
+        self._start = None
+
+    def __call__(self, name: str):
+        self.finish()
+        self._current, self._start = name, time.perf_counter()
+
+    def finish(self) -> dict:
+        if self._current is not None:
+            self.timings_ms[self._current] = round((time.perf_counter() - self._start) * 1000, 1)
+            self._current = None
+        return self.timings_ms
+
+def process_plans_for_patient(patient_id: int, db: Session, stage=no_stage) -> dict:
+    """
+    Filters plans, applies the rules and returns the patient's top preferred plans.
+    stage(name) is called at each stage boundary so background jobs can report progress and be cancelled.
+    """
+    stage("load_patient")
+    return process_patient_plans(load_patient_data(patient_id, db), stage)
+
+def load_patient_data(patient_id: int, db: Session) -> dict:
+    """
+    Loads the patient's profile as the dictionary the graph and ranking steps take; 404 if it does not exist.
+    """
     # Fetch patient data
     patient = db.query(models.Patient).filter(models.Patient.id == patient_id).first()
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
     # Convert patient object to dictionary
-    patient_data = {
+    return {
         "id": patient.id, 
         "name": patient.name,
         "age": patient.age,
@@ -212,92 +404,46 @@ def process_plans(patient_id: PatientID, db: Session = Depends(get_db)):
         "is_married": patient.is_married,
     }
 
-    # Filter plans using SQL
-    plans = filter_plans(patient_data)["plans"]
+def join_cohort(patient_data: dict) -> tuple:
+    """
+    With the cohort graph model, writes the patient and links it to its cohort.
 
-    if not plans:
-        raise HTTPException(status_code=404, detail="No plans found for the given criteria")
+    Returns:
+    - Tuple of (cohort_id, whether the cohort's edges already exist); (None, False) with the patient model.
+    """
+    if GRAPH_MODEL != "cohort":
+        return None, False
+    upsert_patient(neo4j_driver, patient_data)
+    cohort_id, cohort_criteria = cohort_key(patient_data, plan_graph_version(neo4j_driver))
+    return cohort_id, link_patient_to_cohort(neo4j_driver, patient_data["id"], cohort_id, cohort_criteria)
 
-    # Insert patient and filtered plans into Neo4j
-    with neo4j_driver.session() as session:
-        session.run(
-            """
-            MERGE (p:Patient {id: $id})
-            SET p.name = $name,
-                p.age = $age,
-                p.gender = $gender,
-                p.state = $state,
-                p.occupation = $occupation,
-                p.smoking_status = $smoking_status,
-                p.physical_activity_level = $physical_activity_level,
-                p.medical_conditions = $medical_conditions,
-                p.travel_coverage_needed = $travel_coverage_needed,
-                p.family_coverage = $family_coverage,
-                p.budget_category = $budget_category,
-                p.has_offspring = $has_offspring,
-                p.is_married = $is_married
-            """,
-            id=patient_data["id"],
-            name=patient_data["name"],
-            age=patient_data["age"],
-            gender=patient_data["gender"],
-            state=patient_data["state"],
-            occupation=patient_data["occupation"],
-            smoking_status=patient_data["smoking_status"],
-            physical_activity_level=patient_data["physical_activity_level"],
-            medical_conditions=patient_data["medical_conditions"],
-            travel_coverage_needed=patient_data["travel_coverage_needed"],
-            family_coverage=patient_data["family_coverage"],
-            budget_category=patient_data["budget_category"],
-            has_offspring=patient_data["has_offspring"],
-            is_married=patient_data["is_married"],
-        )
+def process_patient_plans(patient_data: dict, stage=no_stage) -> dict:
+    """
+    Graph and ranking part of process_plans_for_patient, for callers that already hold the patient's data.
+    """
+    stage("graph_rules")
+    cohort_id, cohort_ready = join_cohort(patient_data)
+    plans = None if cohort_ready else filter_plans(patient_data)["plans"]
+    return rank_patient_plans(patient_data, cohort_id, plans, stage)
 
-        print("\n🔍 Plans Received in process_plans:")
-
-        for plan in plans:
-            try:
-                if isinstance(plan, InsurancePlan):
-                    plan_data = {
-                        key: clean_value(getattr(plan, key, None), ATTRIBUTE_CLEANUP_CONFIG.get(key, str))
-                        if key.lower() != "planid" else str(getattr(plan, key, None)) 
-                        for key in plan.__dict__
-                        if not key.startswith("_")
-                    }
-                elif isinstance(plan, dict):
-                    plan_data = {
-                        key: clean_value(plan.get(key, None), ATTRIBUTE_CLEANUP_CONFIG.get(key, str))
-                        if key.lower() != "planid" else str(plan.get(key, None))
-                        for key in plan.keys()
-                    }
-                else:
-                    raise Exception("Unexpected data type in plans")
-
-                # Insert into Neo4j
-                session.run(
-                    """
-                    MERGE (plan:Plan {PlanId: $id})
-                    SET plan += $plan_data
-                    MERGE (p:Patient {id: $patient_id})
-                    MERGE (p)-[:CONSIDERS]->(plan)
-                    """,
-                    id=getattr(plan, 'PlanId', None) if isinstance(plan, InsurancePlan) else plan.get('PlanId'),
-                    plan_data=plan_data,
-                    patient_id=patient_id
-                )
-
-            except Exception as e:
-
-                raise HTTPException(status_code=500, detail=f"Error processing plan: {str(e)}")
-            
-    preferred_plans = apply_selected_rules(neo4j_driver, patient_data)
+def rank_patient_plans(patient_data: dict, cohort_id: Optional[str], plans: Optional[list], stage=no_stage) -> dict:
+    """
+    Applies the rules to the filtered plans, or reads a ready cohort's results when plans is None, and
+    returns the patient's top preferred plans.
+    """
+    if plans is None:
+        # The cohort already holds the CONSIDERS and rule edges, so Snowflake filtering and the rules are skipped
+        preferred_plans = get_cohort_rule_results(neo4j_driver, cohort_id)
+    else:
+        preferred_plans = apply_rules_to_plans(patient_data, plans, cohort_id)
 
     if not preferred_plans:
         raise HTTPException(status_code=404, detail="No preferred plans found for the patient in Neo4j")
 
+    stage("rank_plans")
     # Extract patient info (same across all rule results)
     first_rule = next(iter(preferred_plans.values()))
-    patient_info = first_rule["patient"]
+    patient_info = first_rule["patient"] if cohort_id is None else patient_data
 
     # ✅ Deduplicate plans and count rule matches
     from collections import defaultdict
@@ -327,11 +473,23 @@ def process_plans(patient_id: PatientID, db: Session = Depends(get_db)):
         "preferred_plans": top_plans
     }
 
+@app.get("/graph-write-stats/")
+def graph_write_stats():
+    """
+    Returns flush batch sizes and latencies of the Neo4j group-commit buffer.
+    """
+    if graph_write_buffer is None:
+        return {"enabled": False}
+    return graph_write_buffer.stats()
+
 @app.get("/plan-distribution/")
-def plan_distribution(patient_id: int, db: Session = Depends(get_db)):
+async def plan_distribution(patient_id: int, db: Session = Depends(get_db)):
     """
     This endpoint returns the distribution of plans for a specific patient based on the number of rules they satisfy.
     """
+    return await neo4j_lane.run(load_plan_distribution, patient_id, db)
+
+def load_plan_distribution(patient_id: int, db: Session) -> dict:
     try:
         # Fetch the patient data first
         patient = db.query(models.Patient).filter(models.Patient.id == patient_id).first()
@@ -357,11 +515,15 @@ def plan_distribution(patient_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error retrieving plan distribution: {str(e)}")
 
 @app.get("/get-plans-by-type/{patient_id}/{plan_type}")
-def get_plans_by_type(patient_id: int, plan_type: str, db: Session = Depends(get_db)):
+async def get_plans_by_type(request: Request, patient_id: int, plan_type: str, fields: Optional[str] = None, exclude_none: bool = True, db: Session = Depends(get_db)):
     """
     This endpoint filters and returns all plans of a specific type for a given patient based on their selected plan type,
     but only considering the plans that satisfy the most rules.
     """
+    result = await neo4j_lane.run(load_plans_by_type, patient_id, plan_type, db)
+    return encoded_response(request, result, "get-plans-by-type", fields, exclude_none)
+
+def load_plans_by_type(patient_id: int, plan_type: str, db: Session) -> dict:
     try:
         # Fetch the patient data first
         patient = db.query(models.Patient).filter(models.Patient.id == patient_id).first()
@@ -387,10 +549,11 @@ def get_plans_by_type(patient_id: int, plan_type: str, db: Session = Depends(get
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving plans by type: {str(e)}")
 
-@app.post("/recommend-insurance/")
-def recommend_insurance(patient_id: int, plan_type: str, model_name: str, db: Session = Depends(get_db)) -> dict:
+def prepare_recommendation(patient_id: int, plan_type: str, model_name: str, db: Session, ranking_mode: str = "single") -> dict:
     """
-    Fetches patient data and recommends insurance plans using Snowflake Cortex.
+    Loads the patient, the shortlisted candidate plans and the cache key shared by the recommendation endpoints.
+    ranking_mode "map_reduce" (or "auto" with more than MAP_REDUCE_MIN_PLANS candidates) keeps every candidate
+    for map-reduce ranking instead of shortlisting; the resolved mode is returned as "ranking_mode".
     """
     # Fetch patient details
     patient = db.query(models.Patient).filter(models.Patient.id == patient_id).first()
@@ -399,18 +562,555 @@ def recommend_insurance(patient_id: int, plan_type: str, model_name: str, db: Se
 
     _, _, highest_rule_count = get_plan_distribution(neo4j_driver, patient_id)
 
-    plan_ids = get_plan_ids_from_neo4j(neo4j_driver, patient_id, plan_type, highest_rule_count)
+    plans = get_plans_by_type_from_neo4j(neo4j_driver, patient_id, plan_type, highest_rule_count)
 
-    if not plan_ids:
+    if not plans:
         raise HTTPException(status_code=404, detail="No plans found for the given type")
     
     patient_data = {column.name: getattr(patient, column.name) for column in models.Patient.__table__.columns}
-    plans=get_plans_by_type_from_neo4j(neo4j_driver, patient_id, plan_type, highest_rule_count)
+    return build_recommendation_request(patient_data, plans, plan_type, model_name, ranking_mode)
+
+def build_recommendation_request(patient_data: dict, plans: list, plan_type: str, model_name: str, ranking_mode: str = "single") -> dict:
+    """
+    Shortlists the candidate plans and builds the cache keys; the part of prepare_recommendation after loading.
+    """
+    is_openai_model = model_name.lower() in OPENAI_MODELS
+    if ranking_mode == "auto":
+        ranking_mode = "map_reduce" if is_openai_model and len(plans) > MAP_REDUCE_MIN_PLANS else "single"
+    if ranking_mode == "map_reduce" and not is_openai_model:
+        raise HTTPException(status_code=400, detail="Map-reduce ranking is only available for OpenAI models")
+
+    if ranking_mode == "map_reduce":
+        shortlist_stats = {"candidates": len(plans)}
+    else:
+        # Only the top-K plans by cost go to the LLM, which bounds prompt size and latency
+        plans, shortlist_stats = shortlist_plans(plans, patient_data, model_name)
+        # Then only the ones that fit the prompt's token budget, so plan_ids and the cache key match what the model sees
+        plans, shortlist_stats["over_token_budget"] = fit_plans_to_budget(plans, patient_data, model_name)
+        shortlist_stats["shortlisted"] = len(plans)
+    plan_ids = [plan["PlanId"] for plan in plans]
+
+    template_version = OPENAI_PROMPT_VERSION if is_openai_model else CORTEX_PROMPT_VERSION
+    if ranking_mode == "map_reduce":
+        template_version += "-map-reduce"
+
+    return {
+        "patient_data": patient_data,
+        "plans": plans,
+        "plan_ids": plan_ids,
+        "is_openai_model": is_openai_model,
+        "cache_key": recommendation_cache_key(patient_data, plan_ids, model_name, template_version),
+        "segment_key": segment_cache_key(patient_data, plan_type, model_name, template_version),
+        "prompt_stats": dict(shortlist_stats),
+        "ranking_mode": ranking_mode,
+    }
+
+def lookup_cached_recommendation(request: dict, patient_id: int, model_name: str):
+    """
+    Returns (recommendation, cache name) from the exact-profile cache or, failing that, the segment cache.
+    """
+    if recommendation_cache is not None:
+        cached = recommendation_cache.get(request["cache_key"])
+        if cached is not None:
+            print(f"⚡ Recommendation cache hit for patient {patient_id} ({model_name})")
+            return normalize_recommendation(cached, request["plan_ids"]), "exact"
+    if segment_cache is not None:
+        cached = segment_cache.get(request["segment_key"], request["patient_data"], request["plan_ids"])
+        if cached is not None:
+            print(f"⚡ Segment cache hit for patient {patient_id} ({model_name})")
+            return normalize_recommendation(cached, request["plan_ids"]), "segment"
+    return None, None
+
+def cache_recommendation(request: dict, model_name: str, response: dict):
+    # Only keep normalized output with at least one valid plan
+    if not response.get("recommended_plans") or "error" in response:
+        return
+    if recommendation_cache is not None:
+        recommendation_cache.set(request["cache_key"], model_name, response)
+    if segment_cache is not None:
+        segment_cache.set(request["segment_key"], model_name, response, request["patient_data"])
+
+@app.post("/recommend-insurance/")
+async def recommend_insurance(patient_id: int, plan_type: str, model_name: str, bypass_cache: bool = False, ranking_mode: RankingMode = "single", db: Session = Depends(get_db)) -> dict:
+    """
+    Fetches patient data and recommends insurance plans using Snowflake Cortex.
+    Both providers' output is parsed and validated here and returned as {"recommended_plans": [...], "summary": ...}.
+    Recommendations are cached per (patient profile, candidate plans, model, prompt version);
+    bypass_cache forces a fresh LLM call and refreshes the cached entry.
+    ranking_mode is "single" (one prompt over the shortlist), "map_reduce" (chunked ranking of every candidate,
+    OpenAI models only) or "auto" (map-reduce for large candidate sets).
+    """
+    return await llm_lane.run(recommend_for_patient, patient_id, plan_type, model_name, bypass_cache, db, ranking_mode=ranking_mode)
+
+def recommend_for_patient(patient_id: int, plan_type: str, model_name: str, bypass_cache: bool, db: Session, stage=no_stage, ranking_mode: str = "single") -> dict:
+    """
+    Shared body of /recommend-insurance/ and the recommendation job; stage works as in process_plans_for_patient.
+    """
+    stage("prepare")
+    request = prepare_recommendation(patient_id, plan_type, model_name, db, ranking_mode)
+    return run_recommendation(request, patient_id, model_name, bypass_cache, stage)
 
-    if model_name.lower() in ["gpt-4o", "gpt-4o-mini", "o1-mini-2024-09-12","o3-mini-2025-01-31"]:
-        response = call_chatgpt_structured(patient_data, plans, model_name)
+def run_recommendation(request: dict, patient_id: int, model_name: str, bypass_cache: bool, stage=no_stage) -> dict:
+    """
+    Serves a prepared recommendation request from the caches or the model, and caches fresh answers.
+    """
+    if not bypass_cache:
+        cached, cache_name = lookup_cached_recommendation(request, patient_id, model_name)
+        if cached is not None:
+            return {"recommendations": cached, "cached": True, "cache": cache_name}
+
+    stage("llm")
+    prompt_stats = request["prompt_stats"]
+    if request["ranking_mode"] == "map_reduce":
+        response = call_chatgpt_map_reduce(request["patient_data"], request["plans"], model_name, stats=prompt_stats)
+    elif request["is_openai_model"]:
+        response = call_chatgpt_structured(request["patient_data"], request["plans"], model_name, stats=prompt_stats)
     else:
-        response = execute_cortex_query(patient_data, plan_ids, model_name)
-    print(f"🔹 Raw LLM Output: {response}")
-    return {"recommendations": response}
+        response = execute_cortex_query(request["patient_data"], request["plan_ids"], model_name, stats=prompt_stats)
+    response = normalize_recommendation(response, request["plan_ids"])
+
+    stage("store")
+    cache_recommendation(request, model_name, response)
+    return {"recommendations": response, "cached": False, "prompt_stats": prompt_stats}
 
+@app.post("/recommend-insurance/fanout")
+async def recommend_insurance_fanout(patient_id: int, plan_type: str, model_name: str, mode: str = "first", models: str = None, db: Session = Depends(get_db)) -> dict:
+    """
+    Sends the recommendation prompt to model_name and the fan-out models concurrently.
+    mode="first" returns the first schema-valid answer, mode="all" returns every model's answer for comparison.
+    models optionally overrides FANOUT_MODELS with a comma-separated list. Fan-out answers are not cached.
+    """
+    if mode not in ("first", "all"):
+        raise HTTPException(status_code=400, detail="mode must be 'first' or 'all'")
+    return await llm_lane.run(fanout_for_patient, patient_id, plan_type, model_name, mode, models, db)
+
+def fanout_for_patient(patient_id: int, plan_type: str, model_name: str, mode: str, models: str, db: Session) -> dict:
+    request = prepare_recommendation(patient_id, plan_type, model_name, db)
+    extra_models = [m.strip() for m in models.split(",") if m.strip()] if models else None
+    result = fanout_recommendations(
+        request["patient_data"], request["plans"], request["plan_ids"], model_name, extra_models, mode
+    )
+
+    if mode == "first" and result["winner"] is None:
+        raise HTTPException(status_code=502, detail={"error": "No model returned a valid recommendation", "models": result["models"]})
+    result["prompt_stats"] = request["prompt_stats"]
+    return result
+
+@app.get("/fanout-stats/")
+def fanout_stats_endpoint():
+    """
+    Returns per-model win rates and latency percentiles of fan-out requests.
+    """
+    return fanout_stats.snapshot()
+
+@app.get("/llm-metrics/")
+def llm_metrics_summary(window_hours: float = 24, model_name: str = None):
+    """
+    Per-model LLM call counts by outcome, latency percentiles, token totals and estimated cost over the last window_hours.
+    """
+    if llm_metrics is None:
+        return {"enabled": False}
+    return llm_metrics.summary(window_hours, model_name)
+
+@app.get("/segment-cache-stats/")
+def segment_cache_stats():
+    """
+    Returns hit rate, entry count and staleness settings of the segment-level recommendation cache.
+    """
+    if segment_cache is None:
+        return {"enabled": False}
+    return segment_cache.stats()
+
+@app.get("/openai-client-stats/")
+def openai_client_stats():
+    """
+    Returns per-model call, retry and error counts with queue wait vs model time percentiles of the shared OpenAI client.
+    """
+    return openai_client.stats()
+
+def sse_event(event: str, data) -> str:
+    """
+    Formats one server-sent event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/recommend-insurance/stream")
+async def recommend_insurance_stream(patient_id: int, plan_type: str, model_name: str, bypass_cache: bool = False, db: Session = Depends(get_db)):
+    """
+    Server-sent-events variant of /recommend-insurance/.
+
+    Emits "token" events with raw model output as it is generated (OpenAI models), a "plan" event for
+    each recommended plan as soon as it is complete, and a final "done" event carrying the same body as
+    /recommend-insurance/. SQL COMPLETE does not stream, so Cortex models send their output once it is ready.
+    """
+    def prepare():
+        request = prepare_recommendation(patient_id, plan_type, model_name, db)
+        if bypass_cache:
+            return request, (None, None)
+        return request, lookup_cached_recommendation(request, patient_id, model_name)
+
+    request, (cached, cache_name) = await neo4j_lane.run(prepare)
+
+    def events():
+        start = time.perf_counter()
+        parser = RecommendedPlanStreamParser()
+        prompt_stats = request["prompt_stats"]
+
+        if cached is not None:
+            for plan in cached.get("recommended_plans", []):
+                yield sse_event("plan", plan)
+            yield sse_event("done", {"recommendations": cached, "cached": True, "cache": cache_name})
+            return
+
+        first_plan_ms = None
+        try:
+            if request["is_openai_model"]:
+                for delta in stream_chatgpt_structured(request["patient_data"], request["plans"], model_name, stats=prompt_stats):
+                    yield sse_event("token", {"text": delta})
+                    for plan in filter(None, (normalize_plan(plan, request["plan_ids"]) for plan in parser.feed(delta))):
+                        if first_plan_ms is None:
+                            first_plan_ms = round((time.perf_counter() - start) * 1000, 1)
+                        yield sse_event("plan", plan)
+                response = parser.text
+            else:
+                response = execute_cortex_query(request["patient_data"], request["plan_ids"], model_name, stats=prompt_stats)
+                for plan in normalize_recommendation(response, request["plan_ids"]).get("recommended_plans", []):
+                    if first_plan_ms is None:
+                        first_plan_ms = round((time.perf_counter() - start) * 1000, 1)
+                    yield sse_event("plan", plan)
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+            return
+
+        prompt_stats["first_plan_ms"] = first_plan_ms
+        prompt_stats["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        print(f"🔹 Streamed LLM Output: {response}")
+        response = normalize_recommendation(response, request["plan_ids"])
+        cache_recommendation(request, model_name, response)
+        yield sse_event("done", {"recommendations": response, "cached": False, "prompt_stats": prompt_stats})
+
+    return StreamingResponse(llm_lane.stream(events), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/advise/")
+async def advise(advise_request: AdviseRequest, db: Session = Depends(get_db)) -> dict:
+    """
+    One-shot version of the Streamlit flow: creates the patient (or reuses patient_id), processes plans, computes
+    the plan distribution, selects the plans of one type and, when model_name is given, recommends among them.
+    A new patient is only stored once Snowflake has plans for its profile (and the requested plan type), so
+    requests that end in "No plans found" leave no patient behind.
+
+    Stages hand the patient, rule results, distribution and plan list to each other in memory instead of
+    re-reading the patient from Postgres and re-querying the graph per step. The response carries every
+    intermediate view and the duration of each stage. If the LLM lane is full, the plan views are still
+    returned and "recommendation" holds the overload error.
+    """
+    timer = StageTimer()
+    advice = await snowflake_lane.run(advise_plans, advise_request, db, timer)
+
+    advice["recommendation"] = None
+    if advise_request.model_name:
+        try:
+            advice["recommendation"] = await llm_lane.run(
+                run_recommendation, advice.pop("recommendation_request"), advice["patient"]["id"],
+                advise_request.model_name, advise_request.bypass_cache, timer,
+            )
+        except Overloaded as e:
+            advice["recommendation"] = {"error": str(e), "retry_after": e.retry_after}
+    advice.pop("recommendation_request", None)
+    advice["timings_ms"] = timer.finish()
+    return advice
+
+def advise_plans(advise_request: AdviseRequest, db: Session, stage=no_stage) -> dict:
+    """
+    Plan stages of /advise/: patient creation, rules, distribution and plans of the selected type,
+    plus the prepared recommendation request when a model was asked for.
+    """
+    if advise_request.patient_id is not None:
+        stage("load_patient")
+        patient_data = load_patient_data(advise_request.patient_id, db)
+        processed = process_patient_plans(patient_data, stage)
+    else:
+        stage("filter_plans")
+        filtered = filter_plans(advise_request.profile.dict())["plans"]
+        if not filtered:
+            raise HTTPException(status_code=404, detail="No plans found for the given criteria")
+        plan_types = {plan.get("PlanType") if isinstance(plan, dict) else getattr(plan, "PlanType", None) for plan in filtered}
+        if advise_request.plan_type is not None and advise_request.plan_type not in plan_types:
+            raise HTTPException(status_code=404, detail="No plans found for the given type")
+
+        stage("create_patient")
+        db_patient = models.Patient(**advise_request.profile.dict())
+        db.add(db_patient)
+        db.commit()
+        db.refresh(db_patient)
+        patient_data = {column.name: getattr(db_patient, column.name) for column in models.Patient.__table__.columns}
+
+        stage("graph_rules")
+        cohort_id, cohort_ready = join_cohort(patient_data)
+        processed = rank_patient_plans(patient_data, cohort_id, None if cohort_ready else filtered, stage)
+
+    stage("plan_distribution")
+    distribution, plan_type_distribution, highest_rule_count = get_plan_distribution(neo4j_driver, patient_data["id"])
+    plan_type = advise_request.plan_type
+    if plan_type is None:
+        if not plan_type_distribution:
+            raise HTTPException(status_code=404, detail="No plans found for the patient")
+        plan_type = max(plan_type_distribution, key=plan_type_distribution.get)
+
+    stage("plans_by_type")
+    plans = get_plans_by_type_from_neo4j(neo4j_driver, patient_data["id"], plan_type, highest_rule_count)
+
+    advice = {
+        "patient": patient_data,
+        "processed_plans": {
+            "preferred_plans_count": processed["preferred_plans_count"],
+            "preferred_plans": processed["preferred_plans"],
+        },
+        "plan_distribution": {
+            "plan_distribution": distribution,
+            "plan_type_distribution": plan_type_distribution,
+            "highest_rule_count": highest_rule_count,
+        },
+        "selected_plan_type": plan_type,
+        "plans": plans,
+    }
+
+    if advise_request.model_name:
+        if not plans:
+            raise HTTPException(status_code=404, detail="No plans found for the given type")
+        # Same shortlist and cache keys as /recommend-insurance/, built from the plans already loaded
+        stage("prepare")
+        advice["recommendation_request"] = build_recommendation_request(
+            patient_data, plans, plan_type, advise_request.model_name, advise_request.ranking_mode
+        )
+    return advice
+
+def run_process_plans_job(params: dict, job) -> dict:
+    db = SessionLocal()
+    try:
+        return process_plans_for_patient(params["patient_id"], db, stage=job.stage)
+    finally:
+        db.close()
+
+def run_recommendation_job(params: dict, job) -> dict:
+    db = SessionLocal()
+    try:
+        return recommend_for_patient(
+            params["patient_id"], params["plan_type"], params["model_name"], params["bypass_cache"], db,
+            stage=job.stage, ranking_mode=params.get("ranking_mode", "single"),
+        )
+    finally:
+        db.close()
+
+def recommend_for_patients_batch(patient_ids: list, model_name: str, plan_type: str, bypass_cache: bool, db: Session, stage=no_stage) -> dict:
+    """
+    Recommends plans for many patients with one batched Cortex COMPLETE statement.
+    Cached recommendations are reused unless bypass_cache; per-patient failures are reported without failing the batch.
+    """
+    if model_name.lower() in OPENAI_MODELS:
+        raise HTTPException(status_code=400, detail="Batch scoring is only available for Cortex models")
+
+    stage("prepare")
+    results, pending = {}, {}
+    for patient_id in patient_ids:
+        try:
+            patient_plan_type = plan_type
+            if patient_plan_type is None:
+                _, plan_type_distribution, _ = get_plan_distribution(neo4j_driver, patient_id)
+                if not plan_type_distribution:
+                    raise HTTPException(status_code=404, detail="No plans found for the patient")
+                patient_plan_type = max(plan_type_distribution, key=plan_type_distribution.get)
+            request = prepare_recommendation(patient_id, patient_plan_type, model_name, db)
+        except HTTPException as e:
+            results[str(patient_id)] = {"recommendations": {"error": e.detail}, "cached": False}
+            continue
+
+        cached, cache_name = lookup_cached_recommendation(request, patient_id, model_name) if not bypass_cache else (None, None)
+        if cached is not None:
+            results[str(patient_id)] = {"recommendations": cached, "cached": True, "cache": cache_name, "plan_type": patient_plan_type}
+        else:
+            pending[str(patient_id)] = dict(request, plan_type=patient_plan_type)
+
+    stage("cortex_batch")
+    batch_stats = {}
+    responses = execute_cortex_batch(
+        [{"key": key, "patient_data": request["patient_data"], "plan_ids": request["plan_ids"]} for key, request in pending.items()],
+        model_name,
+        stats=batch_stats,
+    )
+
+    stage("store")
+    for key, request in pending.items():
+        response = normalize_recommendation(responses.get(key, {"error": "No response from Cortex"}), request["plan_ids"])
+        cache_recommendation(request, model_name, response)
+        results[key] = {"recommendations": response, "cached": False, "plan_type": request["plan_type"]}
+
+    return {"model_name": model_name, "results": results, "batch_stats": batch_stats}
+
+def run_batch_recommendation_job(params: dict, job) -> dict:
+    db = SessionLocal()
+    try:
+        return recommend_for_patients_batch(
+            params["patient_ids"], params["model_name"], params.get("plan_type"), params.get("bypass_cache", False), db, stage=job.stage
+        )
+    finally:
+        db.close()
+
+job_queue.register("process_plans", run_process_plans_job)
+job_queue.register("recommend_insurance", run_recommendation_job)
+job_queue.register("recommend_insurance_batch", run_batch_recommendation_job)
+
+# Synthetic patient and plans for the warm-up pass through the pipeline; nothing is written or sent to a model
+WARMUP_PATIENT = {
+    "id": 0, "name": "Warm-up", "age": 52, "gender": "Female", "state": "TX", "occupation": "teacher",
+    "smoking_status": False, "physical_activity_level": "moderate", "medical_conditions": ["Diabetes"],
+    "travel_coverage_needed": False, "family_coverage": True, "budget_category": "Silver",
+    "has_offspring": True, "is_married": True,
+}
+WARMUP_PLANS = [
+    {
+        "PlanId": f"WARMUP-{i}", "PlanType": "PPO", "MetalLevel": "Silver", "PlanMarketingName": f"Warm-up plan {i}",
+        "IssuerMarketPlaceMarketingName": "Warm-up issuer", "TEHBDedInnTier1Individual": f"${1000 + 500 * i}",
+        "TEHBInnTier1IndividualMOOP": f"${6000 + 250 * i}", "TEHBDedInnTier1Coinsurance": f"{10 + 5 * i}%",
+    }
+    for i in range(3)
+]
+
+def warm_postgres():
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    return {"pool": engine.pool.status()}
+
+def warm_snowflake():
+    if snowflake_pool is None:
+        return {"pooled": False}
+    return {"idle_connections": snowflake_pool.warm()}
+
+def warm_neo4j():
+    if GRAPH_BACKEND == "memory":
+        return {"backend": "memory"}
+    neo4j_driver.verify_connectivity()
+    ensure_graph_indexes(neo4j_driver)
+    with neo4j_driver.session() as session:
+        indexes = [(record["name"], record["state"]) for record in session.run("SHOW INDEXES YIELD name, state")]
+    not_online = [name for name, state in indexes if state != "ONLINE"]
+    if any(state == "FAILED" for _, state in indexes):
+        raise RuntimeError(f"Neo4j indexes failed: {not_online}")
+    return {"indexes": len(indexes), "not_online": not_online}
+
+def warm_llm_clients():
+    openai_client.client  # builds the HTTP pool and client on first access
+    return {"openai_max_concurrency": openai_client.max_concurrency}
+
+def warm_pipeline():
+    # Rule selection, shortlist scoring, cache keys, both prompt builders and output validation
+    started = time.perf_counter()
+    request = build_recommendation_request(dict(WARMUP_PATIENT), list(WARMUP_PLANS), "PPO", OPENAI_MODELS[1])
+    cohort_key(WARMUP_PATIENT)
+    build_chatgpt_prompt(request["patient_data"], request["plans"], OPENAI_MODELS[1])
+    build_llm_prompt(request["patient_data"], request["plans"], "mistral-large2")
+    answer = {"recommended_plans": [dict(rank=rank, PlanId=plan["PlanId"]) for rank, plan in enumerate(request["plans"], 1)]}
+    normalize_recommendation(json.dumps(answer)[:-10], request["plan_ids"])  # truncated on purpose to exercise the repair path
+    return {"pipeline_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+warmup.register("postgres", warm_postgres)
+warmup.register("snowflake_pool", warm_snowflake)
+warmup.register("neo4j", warm_neo4j)
+warmup.register("llm_clients", warm_llm_clients)
+warmup.register("rule_statistics", lambda: preload_rule_statistics(neo4j_driver))
+warmup.register("synthetic_request", warm_pipeline)
+
+@app.get("/health")
+def health():
+    """
+    Liveness: the process is up and serving, warm or not.
+    """
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    """
+    Readiness: 200 once the startup warm-up has finished, 503 (with the warm-up report) before that
+    or when a step failed and WARMUP_FAIL_OPEN is off.
+    """
+    report = warmup.report()
+    if not report["ready"]:
+        return JSONResponse(status_code=503, content=report, headers={"Retry-After": "5"})
+    return report
+
+@app.post("/jobs/process-plans/")
+def submit_process_plans_job(patient_id: PatientID) -> dict:
+    """
+    Queues /process-plans/ work in the background and returns a job id to poll.
+    """
+    job_id = job_queue.submit("process_plans", {"patient_id": patient_id.patient_id})
+    return {"job_id": job_id, "status": "queued"}
+
+@app.post("/jobs/recommend-insurance/")
+def submit_recommendation_job(patient_id: int, plan_type: str, model_name: str, bypass_cache: bool = False, ranking_mode: RankingMode = "single") -> dict:
+    """
+    Queues /recommend-insurance/ work in the background and returns a job id to poll.
+    """
+    job_id = job_queue.submit("recommend_insurance", {
+        "patient_id": patient_id,
+        "plan_type": plan_type,
+        "model_name": model_name,
+        "bypass_cache": bypass_cache,
+        "ranking_mode": ranking_mode,
+    })
+    return {"job_id": job_id, "status": "queued"}
+
+@app.post("/jobs/recommend-insurance/batch")
+def submit_batch_recommendation_job(batch: BatchRecommendationRequest) -> dict:
+    """
+    Queues batch scoring of many patients with a Cortex model (one COMPLETE statement) and returns a job id.
+    The job result maps each patient id to its recommendation.
+    """
+    if batch.model_name.lower() in OPENAI_MODELS:
+        raise HTTPException(status_code=400, detail="Batch scoring is only available for Cortex models")
+    job_id = job_queue.submit("recommend_insurance_batch", batch.dict())
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str) -> dict:
+    """
+    Returns a job's status, current stage, per-stage timings and, once finished, its result or error.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-sent events with the job state on every status or stage change, ending once the job finishes.
+    Polling sleeps on the event loop and reads the job store in the threadpool, so open streams hold no thread.
+    """
+    if await run_in_threadpool(job_queue.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        last = None
+        while True:
+            job = await run_in_threadpool(job_queue.get, job_id)
+            if job is None:
+                return
+            current = (job["status"], job["stage"])
+            if current != last:
+                last = current
+                yield sse_event("job", job)
+            if job["status"] in FINISHED_STATUSES:
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str) -> dict:
+    """
+    Cancels a queued job, or asks a running job to stop at its next stage.
+    """
+    if not job_queue.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_queue.get(job_id)
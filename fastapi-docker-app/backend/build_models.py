@@ -0,0 +1,115 @@
+# build_models.py
+"""
+Builds generated_model.py, the InsurancePlan SQLAlchemy model, from the cleaned plan dataset.
+
+This used to happen inside models.py at import time. It is now an explicit build step, so starting the
+API never reads the dataset. The generated file records a checksum of its (column, type) schema and is
+only rewritten when the dataset's schema changes:
+    python build_models.py                      # regenerate if the schema changed
+    python build_models.py --check              # exit 1 if generated_model.py is stale (CI)
+    python build_models.py --csv other.csv --force
+"""
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CSV_PATH = os.path.join(BACKEND_DIR, "cleaned_plans_data.csv")
+GENERATED_MODEL_PATH = os.path.join(BACKEND_DIR, "generated_model.py")
+
+COLUMN_TYPES = {
+    "int64": "Integer",
+    "float64": "Float",
+    "bool": "Boolean",
+    "datetime64[ns]": "Date",
+    "object": "String",
+}
+CHECKSUM_PATTERN = re.compile(r"^# schema-checksum: ([0-9a-f]{64})$", re.MULTILINE)
+COLUMN_PATTERN = re.compile(r"^    (\w+) = Column\((\w+)\)$", re.MULTILINE)
+
+
+def dataset_columns(csv_path):
+    """
+    (column, SQLAlchemy type) pairs inferred from the dataset, without the id column.
+    """
+    import pandas as pd  # only the build step needs pandas
+
+    df = pd.read_csv(csv_path)
+    return [
+        (column_name, COLUMN_TYPES.get(str(dtype), "String"))
+        for column_name, dtype in zip(df.columns, df.dtypes)
+        if column_name.lower() != "id"
+    ]
+
+
+def schema_checksum(columns):
+    return hashlib.sha256(json.dumps(columns).encode("utf-8")).hexdigest()
+
+
+def generated_checksum(path=GENERATED_MODEL_PATH):
+    """
+    Checksum recorded in the generated model, or None if the file is missing or has none.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        match = CHECKSUM_PATTERN.search(f.read())
+    return match.group(1) if match else None
+
+
+def generated_columns(path=GENERATED_MODEL_PATH):
+    """
+    (column, type) pairs declared in an existing generated model, without the id column.
+    """
+    with open(path) as f:
+        return [(name, column_type) for name, column_type in COLUMN_PATTERN.findall(f.read()) if name.lower() != "id"]
+
+
+def render_model(columns, checksum):
+    lines = [
+        "# Generated by build_models.py from the cleaned plan dataset; do not edit by hand.",
+        f"# schema-checksum: {checksum}",
+        "from sqlalchemy import Column, Integer, String, Float, Boolean, Date",
+        "from database import Base",
+        "",
+        "class InsurancePlan(Base):",
+        '    __tablename__ = "insurance_plans"',
+        '    __table_args__ = {"extend_existing": True}',
+        "    id = Column(Integer, primary_key=True, index=True)",
+    ]
+    lines.extend(f"    {column_name} = Column({column_type})" for column_name, column_type in columns)
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the InsurancePlan model from the plan dataset.")
+    parser.add_argument("--csv", default=DEFAULT_CSV_PATH)
+    parser.add_argument("--output", default=GENERATED_MODEL_PATH)
+    parser.add_argument("--check", action="store_true", help="only report whether the model is up to date")
+    parser.add_argument("--force", action="store_true", help="rewrite even if the checksum matches")
+    args = parser.parse_args()
+
+    columns = dataset_columns(args.csv)
+    checksum = schema_checksum(columns)
+    current = generated_checksum(args.output)
+
+    if args.check:
+        if current != checksum:
+            print(f"❌ {args.output} is stale (schema checksum {current} != {checksum}); run build_models.py")
+            sys.exit(1)
+        print(f"✅ {args.output} matches the dataset schema ({len(columns)} columns)")
+        return
+
+    if current == checksum and not args.force:
+        print(f"✅ {args.output} is up to date ({len(columns)} columns)")
+        return
+    with open(args.output, "w") as f:
+        f.write(render_model(columns, checksum))
+    print(f"📝 Wrote {args.output} ({len(columns)} columns, schema checksum {checksum[:12]})")
+
+
+if __name__ == "__main__":
+    main()
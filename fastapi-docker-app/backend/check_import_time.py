@@ -0,0 +1,62 @@
+# check_import_time.py
+"""
+Import-time budget check: imports a module (app by default) in a fresh interpreter with -X importtime,
+prints the slowest imports and exits 1 when the total is over budget, so a heavy import or dataset read
+creeping back into the startup path fails CI:
+    python check_import_time.py                         # app, IMPORT_TIME_BUDGET_MS (default 3000)
+    python check_import_time.py --module schemas --budget-ms 500 --top 15
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "3000"))
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure_imports(module):
+    """
+    Imports module in a subprocess and returns [(name, self_us, cumulative_us, depth), ...].
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail when importing the API takes longer than the budget.")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_TIME_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=10, help="number of slowest top-level imports to list")
+    args = parser.parse_args()
+
+    imports = measure_imports(args.module)
+    total_ms = next(cumulative for name, _, cumulative, _ in imports if name == args.module) / 1000
+    # Direct dependencies of the module are one level below it
+    direct = sorted((i for i in imports if i[3] == 1), key=lambda i: i[2], reverse=True)
+
+    print(f"{'import':<40}{'cumulative ms':>15}")
+    for name, _, cumulative_us, _ in direct[:args.top]:
+        print(f"{name:<40}{cumulative_us / 1000:>15.1f}")
+
+    if total_ms > args.budget_ms:
+        print(f"❌ import {args.module} took {total_ms:.0f}ms, over the {args.budget_ms:.0f}ms budget")
+        sys.exit(1)
+    print(f"✅ import {args.module} took {total_ms:.0f}ms (budget {args.budget_ms:.0f}ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -61,4 +61,7 @@ ATTRIBUTE_CLEANUP_CONFIG = {
     "TEHBDedInnTier1Individual": float,
     "TEHBDedInnTier1Coinsurance": float,
     "TEHBInnTier1IndividualMOOP": float,
-}
\ No newline at end of file
+}
+
+# Rule attributes stored as native floats in Neo4j (see ensure_graph_indexes)
+NUMERIC_PLAN_ATTRIBUTES = [attr for attr, expected_type in ATTRIBUTE_CLEANUP_CONFIG.items() if expected_type == float]
@@ -1,4 +1,5 @@
-
+# Generated by build_models.py from the cleaned plan dataset; do not edit by hand.
+# schema-checksum: 3738eb8fee86a67bce05850c7bdb95a7e93e9eaa105a4ffbd19846a9a1778fbc
 from sqlalchemy import Column, Integer, String, Float, Boolean, Date
 from database import Base
 
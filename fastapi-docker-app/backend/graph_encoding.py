@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+
+# "typed" stores one relationship per rule (DIABETES, MATERNITY, ...) next to CONSIDERS,
+# "bitmask" stores a single CONSIDERS edge per (subject, plan) with rule_mask / rule_count properties
+RULE_EDGE_ENCODING = os.getenv("RULE_EDGE_ENCODING", "typed").lower()
+
+# Bit per rule relationship; new rules need a bit here before they can be stored as a bitmask
+RULE_BITS = {
+    "DIABETES": 1,
+    "MATERNITY": 2,
+    "OLDER_ADULTS": 4,
+    "FAMILY_COVERAGE": 8,
+    "DEFAULT": 16,
+}
+
+
+def rule_names_from_mask(mask):
+    """
+    Decodes a rule bitmask back into the relationship names of the typed encoding.
+    """
+    return [name for name, bit in RULE_BITS.items() if mask & bit]
+
+
+def plan_content_hash(plan_data):
+    """
+    Checksum of a plan's cleaned properties, stored on the Plan node so writers can tell real changes apart.
+    """
+    payload = json.dumps(plan_data, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def plan_merge_clause(source="$"):
+    """
+    Cypher that merges `plan` from {source}id / {source}plan_data / {source}content_hash ("$" for query
+    parameters, "row." inside an UNWIND). The PlanCatalog node's version is bumped whenever a plan is new or
+    its content differs from what the graph holds, so graph_plan_version follows property updates as well as
+    added plans without scanning them.
+    """
+    return f"""
+            MERGE (plan:Plan {{PlanId: {source}id}})
+            FOREACH (_ IN CASE WHEN plan.content_hash IS NULL OR plan.content_hash <> {source}content_hash
+                               THEN [1] ELSE [] END |
+                MERGE (catalog:PlanCatalog {{id: 'plans'}})
+                ON CREATE SET catalog.version = 0
+                SET catalog.version = catalog.version + 1)
+            SET plan += {source}plan_data, plan.content_hash = {source}content_hash
+            """
+
+
+def considers_clause():
+    """
+    Cypher that links `p` to `plan` as a considered plan in the configured encoding.
+    """
+    if RULE_EDGE_ENCODING == "bitmask":
+        return """
+            MERGE (p)-[c:CONSIDERS]->(plan)
+            ON CREATE SET c.rule_mask = 0, c.rule_count = 0
+            SET c.considered = true
+            """
+    return "MERGE (p)-[:CONSIDERS]->(plan)"
+
+
+def rule_edge_clause(relationship):
+    """
+    Cypher that records rule `relationship` between `p` and `plan` in the configured encoding.
+    Bitmask updates are idempotent: the bit and count only change the first time a rule matches.
+    """
+    if RULE_EDGE_ENCODING == "bitmask":
+        bit = RULE_BITS[relationship]
+        return f"""
+            MERGE (p)-[c:CONSIDERS]->(plan)
+            ON CREATE SET c.considered = false, c.rule_mask = 0, c.rule_count = 0
+            WITH p, plan, c, c.rule_mask % {bit * 2} >= {bit} AS has_rule
+            SET c.rule_mask = c.rule_mask + CASE WHEN has_rule THEN 0 ELSE {bit} END,
+                c.rule_count = c.rule_count + CASE WHEN has_rule THEN 0 ELSE 1 END
+            """
+    return f"MERGE (p)-[:{relationship}]->(plan)"
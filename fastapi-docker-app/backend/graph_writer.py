@@ -0,0 +1,188 @@
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from graph_encoding import considers_clause, rule_edge_clause, plan_content_hash, plan_merge_clause
+from percentiles import percentile
+
+_STOP = object()
+
+
+class GraphWriteBuffer:
+    """
+    Write-behind buffer that groups Neo4j writes from concurrent requests into shared transactions.
+
+    Writes are queued as (kind, row) pairs and flushed by a background thread as one transaction of
+    UNWIND statements once max_batch writes are waiting or max_delay seconds have passed since the
+    first one. Each submit returns a Future that resolves once its transaction has committed, or fails
+    when the transaction fails or the buffer is closed before the write was flushed.
+    """
+
+    def __init__(self, driver, max_batch=1000, max_delay=0.02, history=1000):
+        self.driver = driver
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._batch_sizes = deque(maxlen=history)
+        self._latencies = deque(maxlen=history)
+        self._flushes = 0
+        self._writes = 0
+        self._errors = 0
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="graph-write-buffer", daemon=True)
+        self._thread.start()
+
+    def submit_patient(self, patient_data):
+        return self._submit("patient", dict(patient_data))
+
+    def submit_considers(self, subject_id, plan_id, plan_data, label="Patient"):
+        return self._submit(("considers", label), {
+            "subject_id": subject_id, "id": plan_id, "plan_data": plan_data, "content_hash": plan_content_hash(plan_data),
+        })
+
+    def submit_rule_edge(self, relationship, subject_id, plan_id, label="Patient"):
+        return self._submit(("rule", label, relationship), {"subject_id": subject_id, "plan_id": plan_id})
+
+    def stats(self):
+        with self._stats_lock:
+            sizes = list(self._batch_sizes)
+            latencies = list(self._latencies)
+            return {
+                "enabled": True,
+                "max_batch": self.max_batch,
+                "max_delay_ms": self.max_delay * 1000,
+                "queued": self._queue.qsize(),
+                "flushes": self._flushes,
+                "writes": self._writes,
+                "errors": self._errors,
+                "batch_size": {
+                    "avg": sum(sizes) / len(sizes) if sizes else None,
+                    "p50": percentile(sizes, 0.5),
+                    "p95": percentile(sizes, 0.95),
+                    "max": max(sizes) if sizes else None,
+                },
+                "flush_latency_ms": {
+                    "avg": sum(latencies) / len(latencies) * 1000 if latencies else None,
+                    "p50": percentile(latencies, 0.5) * 1000 if latencies else None,
+                    "p95": percentile(latencies, 0.95) * 1000 if latencies else None,
+                    "max": max(latencies) * 1000 if latencies else None,
+                },
+            }
+
+    def close(self, timeout=None):
+        """
+        Flushes everything queued before the call and stops the background thread. Writes submitted afterwards,
+        or still queued when the thread does not stop within timeout seconds, fail instead of waiting forever.
+        """
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._fail_pending(RuntimeError("Graph write buffer closed before the write was flushed"))
+
+    def _submit(self, kind, row):
+        future = Future()
+        with self._close_lock:
+            if self._closed:
+                future.set_exception(RuntimeError("Graph write buffer is closed"))
+                return future
+            self._queue.put((kind, row, future))
+        return future
+
+    def _fail_pending(self, error):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP:
+                item[2].set_exception(error)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+
+            batch = [first]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        grouped = defaultdict(list)
+        for kind, row, _ in batch:
+            grouped[kind].append(row)
+
+        start = time.perf_counter()
+        try:
+            with self.driver.session() as session:
+                session.execute_write(self._write_groups, grouped)
+        except Exception as e:
+            print(f"⚠️ Grouped Neo4j write of {len(batch)} rows failed: {e}")
+            with self._stats_lock:
+                self._errors += 1
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self._flushes += 1
+            self._writes += len(batch)
+            self._batch_sizes.append(len(batch))
+            self._latencies.append(elapsed)
+        for _, _, future in batch:
+            future.set_result(None)
+
+    @staticmethod
+    def _write_groups(tx, grouped):
+        # Patients and plans first so rule edges in the same batch can MATCH them
+        if grouped.get("patient"):
+            tx.run(
+                """
+                UNWIND $rows AS row
+                MERGE (p:Patient {id: row.id})
+                SET p += row
+                """,
+                rows=grouped["patient"],
+            )
+        for kind, rows in grouped.items():
+            if isinstance(kind, tuple) and kind[0] == "considers":
+                tx.run(
+                    f"""
+                    UNWIND $rows AS row
+                    {plan_merge_clause("row.")}
+                    MERGE (p:{kind[1]} {{id: row.subject_id}})
+                    {considers_clause()}
+                    """,
+                    rows=rows,
+                )
+        for kind, rows in grouped.items():
+            if isinstance(kind, tuple) and kind[0] == "rule":
+                tx.run(
+                    f"""
+                    UNWIND $rows AS row
+                    MATCH (p:{kind[1]} {{id: row.subject_id}}), (plan:Plan {{PlanId: row.plan_id}})
+                    {rule_edge_clause(kind[2])}
+                    """,
+                    rows=rows,
+                )
@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from local_store import get_sqlite_connection
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Finished jobs older than this are deleted when new jobs are submitted
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(24 * 3600)))
+
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+def process_id():
+    # Several workers (uvicorn --workers, --reload) share the jobs database; each job records the process that owns it.
+    # Read on every call rather than at import, so workers forked from a preloaded app get their own id
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def owner_alive(owner):
+    """
+    False only for an owner known to be gone: a process of this host that no longer exists, or a job from
+    before owners were recorded. Processes on other hosts (containers sharing the volume) are assumed alive.
+    """
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    if int(pid) == os.getpid():
+        # Our pid on a job we never ran: a previous process with the same pid (container restart)
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """
+    Handed to job handlers so they can report stages and honour cancellation between them.
+    """
+
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+
+    def stage(self, name):
+        """
+        Marks the start of a stage; raises JobCancelled if cancellation was requested.
+        """
+        if self.queue.cancel_requested(self.job_id):
+            raise JobCancelled()
+        self.queue.start_stage(self.job_id, name)
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue executed by a bounded thread pool.
+
+    Jobs run independently of the HTTP request that submitted them, so a client can disconnect and
+    poll for the result later. Handlers are registered per job kind and receive (params, JobContext).
+    Job state, per-stage timings and results are persisted, so status survives a restart; jobs that
+    were running when their process stopped are marked failed and queued jobs are resumed. Every job is
+    owned by one process (process_id()), so workers sharing the database never fail or run each other's jobs.
+    """
+
+    def __init__(self, workers=JOB_WORKERS):
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job-worker")
+        self._conn = get_sqlite_connection("jobs")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                stages TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._conn.commit()
+
+    def register(self, kind, handler):
+        self._handlers[kind] = handler
+
+    def resume(self):
+        """
+        Call once at startup, after all handlers are registered: fails jobs whose process died while running them
+        and adopts the queued jobs it left behind. Jobs of live processes sharing the database are left alone.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, status, owner FROM jobs WHERE status IN ('running', 'queued') ORDER BY created_at"
+            ).fetchall()
+            orphaned = [(job_id, status, owner) for job_id, status, owner in rows if not owner_alive(owner)]
+            failed, adopted = 0, []
+            for job_id, status, owner in orphaned:
+                # Compare-and-set on the owner, so when several workers start together only one takes each job
+                if status == "running":
+                    cursor = self._conn.execute(
+                        """
+                        UPDATE jobs SET status = 'failed', error = 'Interrupted by a server restart', finished_at = ?
+                        WHERE id = ? AND status = 'running' AND owner IS ?
+                        """,
+                        (time.time(), job_id, owner),
+                    )
+                    failed += cursor.rowcount
+                else:
+                    cursor = self._conn.execute(
+                        "UPDATE jobs SET owner = ? WHERE id = ? AND status = 'queued' AND owner IS ?",
+                        (process_id(), job_id, owner),
+                    )
+                    if cursor.rowcount:
+                        adopted.append(job_id)
+            self._conn.commit()
+        for job_id in adopted:
+            self._executor.submit(self._run, job_id)
+        if failed:
+            print(f"⚠️ Marked {failed} jobs interrupted by a restart as failed")
+        if adopted:
+            print(f"🔁 Resumed {len(adopted)} queued jobs")
+
+    def submit(self, kind, params):
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed', 'cancelled') AND finished_at < ?",
+                (now - JOB_RETENTION_SECONDS,),
+            )
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, params, status, stages, owner, created_at) VALUES (?, ?, ?, 'queued', '[]', ?, ?)",
+                (job_id, kind, json.dumps(params, default=str), process_id(), now),
+            )
+            self._conn.commit()
+        self._executor.submit(self._run, job_id)
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT id, kind, params, status, stage, stages, result, error, cancel_requested,
+                       created_at, started_at, finished_at
+                FROM jobs WHERE id = ?
+                """,
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "kind": row[1],
+            "params": json.loads(row[2]),
+            "status": row[3],
+            "stage": row[4],
+            "stages": json.loads(row[5]),
+            "result": json.loads(row[6]) if row[6] is not None else None,
+            "error": row[7],
+            "cancel_requested": bool(row[8]),
+            "created_at": row[9],
+            "started_at": row[10],
+            "finished_at": row[11],
+        }
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued job immediately; a running job stops at its next stage boundary.
+        Returns False if the job does not exist.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id),
+            )
+            if cursor.rowcount == 0:
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,)
+                )
+            self._conn.commit()
+            exists = self._conn.execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return exists is not None
+
+    def cancel_requested(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def start_stage(self, job_id, name):
+        now = time.time()
+        with self._lock:
+            stages = json.loads(self._conn.execute("SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+            if stages and stages[-1]["finished_at"] is None:
+                stages[-1]["finished_at"] = now
+            stages.append({"name": name, "started_at": now, "finished_at": None})
+            self._conn.execute("UPDATE jobs SET stage = ?, stages = ? WHERE id = ?", (name, json.dumps(stages), job_id))
+            self._conn.commit()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        now = time.time()
+        with self._lock:
+            stages = json.loads(self._conn.execute("SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+            if stages and stages[-1]["finished_at"] is None:
+                stages[-1]["finished_at"] = now
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, stages = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, json.dumps(stages), json.dumps(result, default=str) if result is not None else None, error, now, job_id),
+            )
+            self._conn.commit()
+
+    def _run(self, job_id):
+        with self._lock:
+            # Claim the job unless it was cancelled while queued or another process adopted it
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ? AND status = 'queued' AND owner = ?",
+                (time.time(), job_id, process_id()),
+            )
+            self._conn.commit()
+            if cursor.rowcount == 0:
+                return
+            kind, params = self._conn.execute("SELECT kind, params FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+        start = time.perf_counter()
+        try:
+            result = self._handlers[kind](json.loads(params), JobContext(self, job_id))
+        except JobCancelled:
+            self._finish(job_id, "cancelled")
+            print(f"🛑 Job {job_id} ({kind}) cancelled")
+            return
+        except Exception as e:
+            # HTTPExceptions raised by the shared endpoint code carry their message in .detail
+            self._finish(job_id, "failed", error=str(getattr(e, "detail", e)))
+            print(f"⚠️ Job {job_id} ({kind}) failed: {getattr(e, 'detail', e)}")
+            return
+        self._finish(job_id, "succeeded", result=result)
+        print(f"✅ Job {job_id} ({kind}) finished in {time.perf_counter() - start:.2f}s")
+
+
+job_queue = JobQueue()
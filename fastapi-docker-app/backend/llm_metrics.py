@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import defaultdict
+from local_store import get_sqlite_connection
+from percentiles import percentile
+
+LLM_METRICS_ENABLED = os.getenv("LLM_METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_METRICS_RETENTION_DAYS = int(os.getenv("LLM_METRICS_RETENTION_DAYS", "30"))
+
+logger = logging.getLogger(__name__)
+
+# Estimated USD per 1M tokens as (prompt, cached prompt, completion); Cortex prices are credit costs converted
+# at list price. Override or extend with LLM_PRICING_JSON='{"model": [prompt, cached, completion]}'.
+MODEL_PRICING = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "o1-mini-2024-09-12": (1.10, 0.55, 4.40),
+    "o3-mini-2025-01-31": (1.10, 0.55, 4.40),
+    "claude-3-5-sonnet": (3.00, 3.00, 15.00),
+    "llama3.1-405b": (3.00, 3.00, 3.00),
+    "mistral-large2": (2.00, 2.00, 6.00),
+}
+MODEL_PRICING.update({model: tuple(prices) for model, prices in json.loads(os.getenv("LLM_PRICING_JSON", "{}")).items()})
+
+OUTCOMES = ("parsed", "invalid", "error")
+
+
+def estimate_cost(model_name, prompt_tokens, cached_tokens, completion_tokens):
+    """
+    Estimated USD cost of one call, or None for models without a price.
+    """
+    prices = MODEL_PRICING.get(model_name)
+    if prices is None or prompt_tokens is None:
+        return None
+    cached_tokens = cached_tokens or 0
+    return (
+        (prompt_tokens - cached_tokens) * prices[0]
+        + cached_tokens * prices[1]
+        + (completion_tokens or 0) * prices[2]
+    ) / 1_000_000
+
+
+class LLMMetricsStore:
+    """
+    SQLite log of every LLM call (model, operation, tokens, latency, outcome, estimated cost) with per-model aggregates.
+    """
+
+    def __init__(self, retention_days=LLM_METRICS_RETENTION_DAYS):
+        self.retention_seconds = retention_days * 24 * 3600
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._conn = get_sqlite_connection("llm_metrics")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_calls (
+                ts REAL NOT NULL,
+                model TEXT NOT NULL,
+                provider TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                outcome TEXT NOT NULL,
+                latency_ms REAL NOT NULL,
+                prompt_tokens INTEGER,
+                cached_tokens INTEGER,
+                completion_tokens INTEGER,
+                cost_usd REAL,
+                error TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_calls_model_ts ON llm_calls (model, ts)")
+        self._conn.commit()
+
+    def record(self, model_name, provider, operation, outcome, latency_seconds, usage=None, error=None):
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens")
+        cached_tokens = usage.get("cached_prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+        cost = estimate_cost(model_name, prompt_tokens, cached_tokens, completion_tokens)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO llm_calls (ts, model, provider, operation, outcome, latency_ms, prompt_tokens, cached_tokens,
+                                       completion_tokens, cost_usd, error)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (now, model_name, provider, operation, outcome, latency_seconds * 1000, prompt_tokens, cached_tokens,
+                 completion_tokens, cost, error),
+            )
+            self._inserts += 1
+            if self._inserts % 500 == 0:
+                self._conn.execute("DELETE FROM llm_calls WHERE ts < ?", (now - self.retention_seconds,))
+            self._conn.commit()
+        logger.debug("%s %s: %.2fs, %s prompt (%s cached) / %s completion tokens, %s", model_name, operation,
+                     latency_seconds, prompt_tokens, cached_tokens or 0, completion_tokens, outcome)
+
+    def summary(self, window_hours=24, model_name=None):
+        """
+        Per-model call counts by outcome, latency percentiles, token totals and estimated cost over the window.
+        """
+        query = "SELECT model, outcome, latency_ms, prompt_tokens, cached_tokens, completion_tokens, cost_usd FROM llm_calls WHERE ts >= ?"
+        params = [time.time() - window_hours * 3600]
+        if model_name:
+            query += " AND model = ?"
+            params.append(model_name)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+
+        grouped = defaultdict(list)
+        for row in rows:
+            grouped[row[0]].append(row)
+
+        models = {}
+        for model, calls in grouped.items():
+            latencies = [call[2] for call in calls]
+            costs = [call[6] for call in calls if call[6] is not None]
+            prompt_tokens = sum(call[3] or 0 for call in calls)
+            cached_tokens = sum(call[4] or 0 for call in calls)
+            models[model] = {
+                "calls": len(calls),
+                "outcomes": {outcome: sum(1 for call in calls if call[1] == outcome) for outcome in OUTCOMES},
+                "latency_ms": {
+                    "p50": round(percentile(latencies, 0.5), 1),
+                    "p90": round(percentile(latencies, 0.9), 1),
+                    "p95": round(percentile(latencies, 0.95), 1),
+                    "p99": round(percentile(latencies, 0.99), 1),
+                    "max": round(max(latencies), 1),
+                },
+                "tokens": {
+                    "prompt": prompt_tokens,
+                    "cached_prompt": cached_tokens,
+                    "completion": sum(call[5] or 0 for call in calls),
+                    "cached_ratio": cached_tokens / prompt_tokens if prompt_tokens else None,
+                },
+                "estimated_cost_usd": {
+                    "total": round(sum(costs), 6) if costs else None,
+                    "per_call": round(sum(costs) / len(costs), 6) if costs else None,
+                },
+            }
+        return {"window_hours": window_hours, "calls": len(rows), "models": models}
+
+
+llm_metrics = LLMMetricsStore() if LLM_METRICS_ENABLED else None
+
+
+def record_llm_call(model_name, provider, operation, outcome, latency_seconds, usage=None, error=None):
+    """
+    Records one LLM call when metrics are enabled; never lets a metrics failure break the call itself.
+    """
+    if llm_metrics is None:
+        return
+    try:
+        llm_metrics.record(model_name, provider, operation, outcome, latency_seconds, usage, error)
+    except Exception as e:
+        logger.warning("Could not record LLM metrics: %s", e)
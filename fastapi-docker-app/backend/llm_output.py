@@ -0,0 +1,295 @@
+import re
+import json
+from pydantic import TypeAdapter, ValidationError
+from schemas import RecommendedPlan, RecommendationResult
+
+
+class RecommendedPlanStreamParser:
+    """
+    Incremental parser for streamed recommendation JSON.
+
+    Text is fed in arbitrary chunks as the model produces it; each entry of the "recommended_plans"
+    array is returned as a dict as soon as its closing brace arrives, so callers can show plan 1
+    while plans 2 and 3 are still being generated. The full text is kept for the final response.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._position = 0
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+
+    def feed(self, chunk: str) -> list:
+        """
+        Adds a chunk of model output and returns the plans completed by it.
+        """
+        self.text += chunk
+        completed = []
+        if self._done:
+            return completed
+
+        if not self._in_array:
+            key = self.text.find('"recommended_plans"')
+            if key == -1:
+                return completed
+            bracket = self.text.find("[", key)
+            if bracket == -1:
+                return completed
+            self._in_array = True
+            self._position = bracket + 1
+
+        while self._position < len(self.text):
+            char = self.text[self._position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                if self._depth == 0:
+                    self._object_start = self._position
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0 and self._object_start is not None:
+                    try:
+                        completed.append(json.loads(self.text[self._object_start:self._position + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self._object_start = None
+            elif char == "]" and self._depth == 0:
+                self._done = True
+                self._position += 1
+                break
+            self._position += 1
+
+        return completed
+
+
+def repair_truncated_json(text: str):
+    """
+    Parses JSON that was cut off mid-generation (max tokens, dropped stream) by closing the open brackets.
+    An incomplete trailing value is dropped, including a string cut before its closing quote (a half-written
+    PlanId must not survive as a shorter id), together with its key; if that still does not parse, the text is
+    cut back to the last complete object or array, so a half-written plan is lost but the plans before it are kept.
+
+    Returns:
+    - The parsed object, or None if nothing usable could be recovered.
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    text = text[start:]
+    closers, in_string, escaped = [], False, False
+    string_start = None
+    last_complete = None  # (end index, closers still open) after the last closed container
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+            string_start = index
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        elif char in "}]" and closers:
+            closers.pop()
+            if not closers:
+                # Complete document followed by prose; nothing to repair
+                try:
+                    return json.loads(text[:index + 1])
+                except json.JSONDecodeError:
+                    return None
+            last_complete = (index + 1, list(closers))
+
+    candidates = []
+    # An unterminated string is incomplete whether it is a key or a value, so it is cut off rather than closed
+    tail = (text[:string_start] if in_string else text).rstrip()
+    # Drop a dangling separator or object key ("...", "summary": or {"PlanId":)
+    tail = re.sub(r'(,\s*"(?:[^"\\]|\\.)*"\s*:?|(?<=\{)\s*"(?:[^"\\]|\\.)*"\s*:?|,|:)\s*$', "", tail) if closers and closers[-1] == "}" else tail.rstrip(",")
+    candidates.append(tail + "".join(reversed(closers)))
+    if last_complete is not None:
+        candidates.append(text[:last_complete[0]] + "".join(reversed(last_complete[1])))
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def _parse_json_object(text: str, repair: bool = False):
+    # Models sometimes wrap the JSON in prose or code fences; keep the outermost object
+    start, end = text.find("{"), text.rfind("}") + 1
+    if start != -1 and end > start:
+        try:
+            return json.loads(text[start:end])
+        except json.JSONDecodeError:
+            pass
+    return repair_truncated_json(text) if repair else None
+
+
+def find_recommendation_document(response, repair: bool = False):
+    """
+    Finds the object holding the recommended_plans list in an OpenAI or Cortex response.
+
+    Accepts the OpenAI message content string, a parsed Cortex COMPLETE result (structured_output or
+    choices) or the {"error", "raw_output"} dict returned when strict parsing failed. With repair=True,
+    truncated JSON text is repaired before giving up.
+
+    Returns:
+    - The dictionary with the "recommended_plans" list (and "summary", when present), or None.
+    """
+    if isinstance(response, str):
+        response = _parse_json_object(response, repair)
+    if not isinstance(response, dict):
+        return None
+
+    if isinstance(response.get("recommended_plans"), list):
+        return response
+    if response.get("raw_output"):
+        return find_recommendation_document(response["raw_output"], repair)
+    for output in response.get("structured_output") or []:
+        document = find_recommendation_document(output.get("raw_message") if isinstance(output, dict) else output, repair)
+        if document is not None:
+            return document
+    for choice in response.get("choices") or []:
+        if isinstance(choice, dict):
+            document = find_recommendation_document(choice.get("messages") or choice.get("message"), repair)
+            if document is not None:
+                return document
+    return None
+
+
+def extract_recommended_plans(response):
+    """
+    Finds the recommended_plans list in an OpenAI or Cortex response (see find_recommendation_document).
+
+    Returns:
+    - The list of plan dictionaries, or None if the response holds no usable recommendation.
+    """
+    document = find_recommendation_document(response)
+    return document["recommended_plans"] if document is not None else None
+
+
+def is_valid_recommendation(response) -> bool:
+    """
+    True when the response carries at least one ranked plan with a PlanId, as the output schema requires.
+    """
+    plans = extract_recommended_plans(response)
+    return bool(plans) and all(isinstance(plan, dict) and plan.get("PlanId") and "rank" in plan for plan in plans)
+
+
+INVALID_OUTPUT_ERROR = "Model output did not contain a valid recommendation"
+
+# Compiled once at import; every plan from either provider is validated through it
+_PLAN_ADAPTER = TypeAdapter(RecommendedPlan)
+
+# Cortex models do not follow the field names as strictly as OpenAI structured output does
+_FIELD_ALIASES = {name.lower().replace("_", ""): name for name in RecommendedPlan.model_fields}
+_FIELD_ALIASES.update({
+    "planid": "PlanId",
+    "issuermarketplacemarketingname": "IssuerName",
+    "issuer": "IssuerName",
+    "planname": "PlanMarketingName",
+    "score": "TotalScore",
+    "moop": "MaxOutOfPocket",
+})
+
+
+def _validate_plan(plan, plan_ids=None):
+    if not isinstance(plan, dict):
+        return None
+    fields = {_FIELD_ALIASES.get(str(key).lower().replace("_", ""), key): value for key, value in plan.items()}
+    try:
+        validated = _PLAN_ADAPTER.validate_python(fields)
+    except ValidationError:
+        return None
+    # A plan the model was not given (hallucinated, or an id cut short and repaired) is not a recommendation
+    if plan_ids is not None and validated.PlanId not in plan_ids:
+        return None
+    return validated
+
+
+def _candidate_ids(plan_ids):
+    return None if plan_ids is None else {str(plan_id) for plan_id in plan_ids}
+
+
+def normalize_plan(plan, plan_ids=None):
+    """
+    Validates one plan dictionary against RecommendedPlan, mapping loosely named fields to the schema names.
+
+    Parameters:
+    - plan: plan dictionary from the model
+    - plan_ids: candidate PlanIds sent to the model; plans with any other PlanId are rejected (None skips the check)
+
+    Returns:
+    - The validated plan as a dictionary without empty fields, or None if it is not a valid plan.
+    """
+    validated = _validate_plan(plan, _candidate_ids(plan_ids))
+    return validated.model_dump(exclude_none=True) if validated is not None else None
+
+
+def normalize_recommendation(response, plan_ids=None) -> dict:
+    """
+    Parses and validates an OpenAI or Cortex response once, so API clients receive plain JSON.
+
+    Strict parsing is tried first and truncated output is repaired only when that fails. Plans that do not
+    validate, or whose PlanId is not among the candidate plan_ids when given, are dropped, the rest are ordered
+    by rank. Already-normalized payloads pass through unchanged,
+    so cached values can be normalized again safely.
+
+    Returns:
+    - {"recommended_plans": [...], "summary": str | None, "repaired": bool, "dropped_plans": int}
+    - Provider error dictionaries ({"error": ...} without output) unchanged.
+    - {"recommended_plans": [], "summary": None, "error": ..., "raw_output": ...} when no recommendation
+      could be recovered (an "error" key is also set when every plan failed validation).
+    """
+    if isinstance(response, dict) and response.get("error") and (
+        "raw_output" not in response or "recommended_plans" in response
+    ):
+        return response
+
+    repaired = False
+    document = find_recommendation_document(response)
+    if document is None:
+        document = find_recommendation_document(response, repair=True)
+        repaired = document is not None
+    if document is None:
+        raw_output = response.get("raw_output", response) if isinstance(response, dict) else response
+        return {
+            "recommended_plans": [],
+            "summary": None,
+            "error": INVALID_OUTPUT_ERROR,
+            "raw_output": raw_output if isinstance(raw_output, str) else json.dumps(raw_output, default=str),
+        }
+
+    candidate_ids = _candidate_ids(plan_ids)
+    plans = [_validate_plan(plan, candidate_ids) for plan in document["recommended_plans"]]
+    valid_plans = sorted((plan for plan in plans if plan is not None), key=lambda plan: plan.rank)
+    summary = document.get("summary")
+    # Plans are already validated models, so building the result does not validate them again
+    result = RecommendationResult(
+        recommended_plans=valid_plans,
+        summary=summary if summary is None or isinstance(summary, str) else json.dumps(summary),
+    ).model_dump()
+    result["recommended_plans"] = [
+        {key: value for key, value in plan.items() if value is not None} for plan in result["recommended_plans"]
+    ]
+    result["repaired"] = repaired or bool(document.get("repaired"))
+    result["dropped_plans"] = len(plans) - len(valid_plans) + (document.get("dropped_plans") or 0)
+    if not valid_plans:
+        result["error"] = INVALID_OUTPUT_ERROR
+    return result
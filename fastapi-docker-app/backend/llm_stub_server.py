@@ -0,0 +1,181 @@
+# llm_stub_server.py
+"""
+Local stand-in for the LLM providers, for load testing without spending API quota.
+
+Serves the subset of the OpenAI Chat Completions API that openai_prompts uses (structured output, streaming,
+usage with cached tokens) and a Cortex COMPLETE endpoint used by prompt.py when CORTEX_STUB_URL is set.
+Answers are schema-valid insurance_recommendation JSON built from the plan table in the prompt.
+
+Run:
+    uvicorn llm_stub_server:app --port 8100
+and start the backend with OPENAI_BASE_URL=http://localhost:8100/v1 and CORTEX_STUB_URL=http://localhost:8100.
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Latency is lognormal around the median; time to first token and streaming pace are separate
+STUB_LATENCY_MEDIAN_MS = float(os.getenv("STUB_LATENCY_MEDIAN_MS", "3000"))
+STUB_LATENCY_SIGMA = float(os.getenv("STUB_LATENCY_SIGMA", "0.5"))
+STUB_FIRST_TOKEN_MS = float(os.getenv("STUB_FIRST_TOKEN_MS", "400"))
+STUB_TOKENS_PER_SECOND = float(os.getenv("STUB_TOKENS_PER_SECOND", "80"))
+# Fractions of requests answered with 429, 500 or truncated/invalid JSON
+STUB_RATE_LIMIT_RATE = float(os.getenv("STUB_RATE_LIMIT_RATE", "0"))
+STUB_SERVER_ERROR_RATE = float(os.getenv("STUB_SERVER_ERROR_RATE", "0"))
+STUB_INVALID_OUTPUT_RATE = float(os.getenv("STUB_INVALID_OUTPUT_RATE", "0"))
+
+app = FastAPI()
+
+
+def _prompt_text(messages):
+    return "\n".join(str(message.get("content", "")) for message in messages)
+
+
+def _candidate_plans(prompt_text):
+    """
+    Reads the '|' plan table from the prompt: the header row starts with PlanId, one row per plan follows.
+    """
+    lines = prompt_text.splitlines()
+    for index, line in enumerate(lines):
+        if line.startswith("PlanId|") or line == "PlanId":
+            header = line.split("|")
+            plans = []
+            for row in lines[index + 1:]:
+                values = row.split("|")
+                if len(values) != len(header):
+                    break
+                plans.append(dict(zip(header, values)))
+            return plans
+    return []
+
+
+def _recommendation(prompt_text):
+    plans = _candidate_plans(prompt_text) or [{"PlanId": f"STUB-{i}"} for i in range(1, 4)]
+    random.shuffle(plans)
+    recommended = []
+    for rank, plan in enumerate(plans[:3], start=1):
+        recommended.append({
+            "rank": rank,
+            "PlanId": plan.get("PlanId", ""),
+            "PlanMarketingName": plan.get("PlanMarketingName") or f"Stub plan {plan.get('PlanId', rank)}",
+            "IssuerName": plan.get("IssuerMarketPlaceMarketingName") or "Stub issuer",
+            "MetalLevel": plan.get("MetalLevel") or "Silver",
+            "Deductible": plan.get("TEHBDedInnTier1Individual") or "",
+            "MaxOutOfPocket": plan.get("TEHBInnTier1IndividualMOOP") or "",
+            "TotalScore": 30 - rank * 3,
+            "ScoreExplanation": "Stub score: deductible and out-of-pocket maximum weighted for the patient profile.",
+            "Justification": "Stub justification generated by the local load-test server.",
+        })
+    text = json.dumps({"recommended_plans": recommended, "summary": "Stub comparison of the top-ranked plans."})
+    if random.random() < STUB_INVALID_OUTPUT_RATE:
+        text = text[: len(text) // 2]
+    return text
+
+
+def _usage(prompt_text, completion_text):
+    prompt_tokens = len(prompt_text) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(completion_text) // 4,
+        "total_tokens": prompt_tokens + len(completion_text) // 4,
+        # Mimics provider prompt caching of the static prefix (1024-token minimum, 128-token steps)
+        "prompt_tokens_details": {"cached_tokens": max(0, (prompt_tokens - 400) // 128 * 128) if prompt_tokens > 1424 else 0},
+    }
+
+
+def _latency_seconds():
+    return STUB_LATENCY_MEDIAN_MS / 1000 * random.lognormvariate(0, STUB_LATENCY_SIGMA)
+
+
+def _injected_error():
+    roll = random.random()
+    if roll < STUB_RATE_LIMIT_RATE:
+        return JSONResponse(status_code=429, content={"error": {"message": "Stub rate limit", "type": "rate_limit_error"}})
+    if roll < STUB_RATE_LIMIT_RATE + STUB_SERVER_ERROR_RATE:
+        return JSONResponse(status_code=500, content={"error": {"message": "Stub server error", "type": "server_error"}})
+    return None
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    error = _injected_error()
+    if error is not None:
+        await asyncio.sleep(STUB_FIRST_TOKEN_MS / 1000)
+        return error
+
+    prompt_text = _prompt_text(body.get("messages", []))
+    content = _recommendation(prompt_text)
+    usage = _usage(prompt_text, content)
+    completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+    model = body.get("model", "stub")
+
+    if not body.get("stream"):
+        await asyncio.sleep(_latency_seconds())
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": usage,
+        }
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    async def chunks():
+        def chunk(delta, finish_reason=None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+
+        await asyncio.sleep(STUB_FIRST_TOKEN_MS / 1000)
+        yield f"data: {json.dumps(chunk({'role': 'assistant', 'content': ''}))}\n\n"
+        # ~4 characters per token, sent a few tokens at a time
+        step = 16
+        for start in range(0, len(content), step):
+            await asyncio.sleep(step / 4 / STUB_TOKENS_PER_SECOND)
+            yield f"data: {json.dumps(chunk({'content': content[start:start + step]}))}\n\n"
+        yield f"data: {json.dumps(chunk({}, 'stop'))}\n\n"
+        if include_usage:
+            yield f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model, 'choices': [], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(chunks(), media_type="text/event-stream")
+
+
+@app.post("/cortex/complete")
+async def cortex_complete(request: Request):
+    """
+    Stand-in for SNOWFLAKE.CORTEX.COMPLETE(model, PARSE_JSON(prompt)): takes {"model", "prompt"} and returns the
+    JSON text COMPLETE would, with the answer in choices[0].messages and a usage block.
+    """
+    body = await request.json()
+    error = _injected_error()
+    if error is not None:
+        return error
+
+    prompt = body.get("prompt") or {}
+    if isinstance(prompt, str):
+        prompt = json.loads(prompt)
+    prompt_text = _prompt_text(prompt.get("messages", []))
+    content = _recommendation(prompt_text)
+    usage = _usage(prompt_text, content)
+    await asyncio.sleep(_latency_seconds())
+    return {
+        "output": json.dumps({
+            "choices": [{"messages": content}],
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "usage": {key: usage[key] for key in ("prompt_tokens", "completion_tokens", "total_tokens")},
+        })
+    }
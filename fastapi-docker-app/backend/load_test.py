@@ -0,0 +1,130 @@
+# load_test.py
+"""
+End-to-end load harness: each virtual patient goes through
+POST /patients/ → POST /process-plans/ → GET /plan-distribution/ → POST /recommend-insurance/
+and the script reports p50/p95/p99 latency and errors per stage.
+
+Point the backend at llm_stub_server.py (OPENAI_BASE_URL / CORTEX_STUB_URL) to test without API quota:
+    python load_test.py --base-url http://localhost:8000 --patients 200 --concurrency 20 --model gpt-4o-mini
+"""
+import time
+import random
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from percentiles import percentile
+
+STATES = ["AK", "AL", "AR", "AZ", "FL", "GA", "IL", "IN", "MI", "MO", "NC", "OH", "OK", "SC", "TN", "TX", "UT", "WI"]
+CONDITIONS = ["Asthma", "Heart Disease", "Diabetes", "Depression", "Low Back Pain", "Pregnancy", "Weight Loss Programs"]
+OCCUPATIONS = ["teacher", "software engineer", "construction worker", "truck driver", "nurse", "accountant", "electrician"]
+STAGES = ["create_patient", "process_plans", "plan_distribution", "recommend", "end_to_end"]
+
+
+def random_patient(rng):
+    return {
+        "name": f"Load Test {rng.randrange(10**6)}",
+        "age": rng.randint(18, 80),
+        "gender": rng.choice(["Male", "Female"]),
+        "state": rng.choice(STATES),
+        "occupation": rng.choice(OCCUPATIONS),
+        "smoking_status": rng.choice(["Yes", "No"]),
+        "physical_activity_level": rng.choice(["sedentary", "moderate", "active"]),
+        "medical_conditions": rng.sample(CONDITIONS, rng.choice([0, 0, 1, 2])),
+        "travel_coverage_needed": rng.random() < 0.2,
+        "family_coverage": rng.random() < 0.3,
+        "budget_category": rng.choice(["Bronze", "Silver", "Gold", "Platinum"]),
+        "has_offspring": rng.random() < 0.3,
+        "is_married": rng.random() < 0.5,
+    }
+
+
+class LoadTest:
+    def __init__(self, base_url, model_name, bypass_cache, timeout):
+        self.client = httpx.Client(base_url=base_url, timeout=timeout, limits=httpx.Limits(max_connections=1000))
+        self.model_name = model_name
+        self.bypass_cache = bypass_cache
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def timed(self, stage, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.record(stage, time.perf_counter() - start, type(e).__name__)
+            return None
+        self.record(stage, time.perf_counter() - start, None if response.status_code == 200 else str(response.status_code))
+        return response if response.status_code == 200 else None
+
+    def record(self, stage, seconds, error):
+        with self._lock:
+            if error is None:
+                self.latencies[stage].append(seconds)
+            else:
+                self.errors[stage][error] += 1
+
+    def run_patient(self, seed):
+        rng = random.Random(seed)
+        start = time.perf_counter()
+        response = self.timed("create_patient", "POST", "/patients/", json=random_patient(rng))
+        if response is None:
+            return
+        patient_id = response.json()["id"]
+
+        if self.timed("process_plans", "POST", "/process-plans/", json={"patient_id": patient_id}) is None:
+            return
+        response = self.timed("plan_distribution", "GET", "/plan-distribution/", params={"patient_id": patient_id})
+        if response is None:
+            return
+        plan_types = response.json().get("plan_type_distribution") or {}
+        if not plan_types:
+            self.record("recommend", 0, "no_plan_types")
+            return
+
+        response = self.timed("recommend", "POST", "/recommend-insurance/", params={
+            "patient_id": patient_id,
+            "plan_type": max(plan_types, key=plan_types.get),
+            "model_name": self.model_name,
+            "bypass_cache": self.bypass_cache,
+        })
+        if response is not None:
+            self.record("end_to_end", time.perf_counter() - start, None)
+
+    def report(self, wall_seconds, patients):
+        print(f"\n{patients} patients in {wall_seconds:.1f}s ({patients / wall_seconds:.2f} patients/s)\n")
+        print(f"{'stage':<18}{'ok':>6}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for stage in STAGES:
+            values = self.latencies.get(stage, [])
+            errors = sum(self.errors[stage].values())
+            cells = [percentile(values, f) for f in (0.5, 0.95, 0.99)] + [max(values) if values else None]
+            print(f"{stage:<18}{len(values):>6}{errors:>6}" + "".join(
+                f"{value * 1000:>10.0f}" if value is not None else f"{'-':>10}" for value in cells
+            ))
+        for stage, errors in self.errors.items():
+            if errors:
+                print(f"  {stage} errors: {dict(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the patient → process-plans → recommend pipeline.")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--use-cache", action="store_true", help="allow cached recommendations (bypassed by default)")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    load_test = LoadTest(args.base_url, args.model, not args.use_cache, args.timeout)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(load_test.run_patient, range(args.seed, args.seed + args.patients)))
+    load_test.report(time.perf_counter() - start, args.patients)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import os
+import sqlite3
+
+# Directory for the SQLite files backing local caches and metrics
+LOCAL_STATE_DIR = os.getenv("LOCAL_STATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".state"))
+
+
+def get_sqlite_connection(name: str) -> sqlite3.Connection:
+    """
+    Opens (and creates if needed) the SQLite database `<LOCAL_STATE_DIR>/<name>.db`.
+    The connection may be shared across threads; callers serialize access with their own lock.
+    """
+    os.makedirs(LOCAL_STATE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(LOCAL_STATE_DIR, f"{name}.db"), timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
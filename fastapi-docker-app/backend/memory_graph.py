@@ -0,0 +1,178 @@
+import threading
+from collections import defaultdict
+
+
+def numeric_value(value):
+    """
+    Rule attributes are native floats; like the Cypher comparisons, anything non-numeric never matches.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def percentile_cont_median(values):
+    """
+    Mirrors Cypher's percentileCont(x, 0.5): linear interpolation between the two middle values.
+    """
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    middle = (len(values) - 1) / 2
+    lower = int(middle)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (middle - lower)
+
+
+class InMemoryGraph:
+    """
+    Embedded graph backend for single-node deployments and tests.
+
+    Implements only the graph operations the rule engine uses (patient upsert, CONSIDERS links,
+    rule edges, cohort links, rule-count and plan-type queries) on plain adjacency dictionaries,
+    with the same semantics as the Cypher in rules.py. Rule edges start from a subject node,
+    which is a Patient or, with the cohort graph model, a Cohort.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.nodes = {"Patient": {}, "Cohort": {}}
+        self.plans = {}
+        self.plans_by_type = defaultdict(set)
+        # (label, subject_id) -> plan_id -> set of relationship types
+        self.edges = defaultdict(lambda: defaultdict(set))
+        self.patient_cohorts = {}
+        # Bumped whenever a merged plan is new or its properties change, like the PlanCatalog node in Neo4j
+        self._plan_version = 0
+
+    def upsert_patient(self, patient_data):
+        with self._lock:
+            patient = self.nodes["Patient"].setdefault(patient_data["id"], {"id": patient_data["id"]})
+            self._set_properties(patient, patient_data)
+
+    def link_considered_plan(self, subject_id, plan_id, plan_data, label="Patient"):
+        with self._lock:
+            before = dict(self.plans[plan_id]) if plan_id in self.plans else None
+            plan = self.plans.setdefault(plan_id, {"PlanId": plan_id})
+            self.plans_by_type[plan.get("PlanType")].discard(plan_id)
+            self._set_properties(plan, plan_data)
+            if plan != before:
+                self._plan_version += 1
+            self.plans_by_type[plan.get("PlanType")].add(plan_id)
+            self.nodes[label].setdefault(subject_id, {"id": subject_id})
+            self.edges[(label, subject_id)][plan_id].add("CONSIDERS")
+
+    def link_patient_to_cohort(self, patient_id, cohort_id, criteria, catalog_version):
+        """
+        Moves the patient into the cohort, creating it if needed, and returns whether its edges already exist.
+        """
+        with self._lock:
+            if patient_id not in self.nodes["Patient"]:
+                return None
+            cohort = self.nodes["Cohort"].get(cohort_id)
+            if cohort is None:
+                cohort = {"id": cohort_id, "catalog_version": catalog_version, "materialized": False}
+                self._set_properties(cohort, criteria)
+                self.nodes["Cohort"][cohort_id] = cohort
+            self.patient_cohorts[patient_id] = cohort_id
+            return cohort["materialized"]
+
+    def mark_cohort_materialized(self, cohort_id):
+        with self._lock:
+            self.nodes["Cohort"][cohort_id]["materialized"] = True
+
+    def cohort_of(self, patient_id):
+        with self._lock:
+            return self.patient_cohorts.get(patient_id)
+
+    def plan_version(self):
+        with self._lock:
+            return self._plan_version
+
+    def plan_types(self):
+        with self._lock:
+            return [plan_type for plan_type, plan_ids in self.plans_by_type.items() if plan_type and plan_ids]
+
+    def rule_medians(self, plan_type, attribute_list):
+        """
+        Per-plan-type medians over plans that have every attribute set, like the rule stats query.
+        """
+        with self._lock:
+            candidates = [
+                self.plans[plan_id] for plan_id in self.plans_by_type.get(plan_type, ())
+                if all(self.plans[plan_id].get(attr) is not None for attr in attribute_list)
+            ]
+            medians = {}
+            for attr in attribute_list:
+                median = percentile_cont_median(numeric_value(plan.get(attr)) for plan in candidates)
+                if median is not None:
+                    medians[attr] = median
+            return medians
+
+    def apply_rule(self, rule_name, subject_id, plan_type, medians, label="Patient"):
+        """
+        Links the subject to every plan of the type at or below all medians and returns the matched plans.
+        """
+        relationship = rule_name.replace(" ", "_").upper()
+        with self._lock:
+            if subject_id not in self.nodes[label]:
+                return []
+            matched = []
+            for plan_id in self.plans_by_type.get(plan_type, ()):
+                plan = self.plans[plan_id]
+                values = {attr: numeric_value(plan.get(attr)) for attr in medians}
+                if all(value is not None and value <= medians[attr] for attr, value in values.items()):
+                    self.edges[(label, subject_id)][plan_id].add(relationship)
+                    matched.append(dict(plan))
+            return matched
+
+    def get_node(self, subject_id, label="Patient"):
+        with self._lock:
+            node = self.nodes[label].get(subject_id)
+            return dict(node) if node is not None else None
+
+    def subject_plan_edges(self, subject_id, label="Patient"):
+        """
+        One (plan_id, plan_type, relationship) row per outgoing subject edge, like the distribution query.
+        """
+        with self._lock:
+            return [
+                (plan_id, self.plans[plan_id].get("PlanType"), relationship)
+                for plan_id, relationships in self.edges.get((label, subject_id), {}).items()
+                for relationship in relationships
+            ]
+
+    def subject_rule_plans(self, subject_id, label="Patient"):
+        """
+        One (relationship, plan) pair per rule edge of the subject.
+        """
+        with self._lock:
+            return [
+                (relationship, dict(self.plans[plan_id]))
+                for plan_id, relationships in self.edges.get((label, subject_id), {}).items()
+                for relationship in relationships
+                if relationship != "CONSIDERS"
+            ]
+
+    def plans_with_relationship_count(self, subject_id, plan_type, relationship_count, label="Patient"):
+        """
+        Plans of the type whose total number of subject edges (CONSIDERS included) equals the count.
+        """
+        with self._lock:
+            return [
+                dict(self.plans[plan_id])
+                for plan_id, relationships in self.edges.get((label, subject_id), {}).items()
+                if self.plans[plan_id].get("PlanType") == plan_type and len(relationships) == relationship_count
+            ]
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _set_properties(node, properties):
+        # SET n += $props removes properties that are set to null
+        for key, value in properties.items():
+            if value is None:
+                node.pop(key, None)
+            else:
+                node[key] = value
@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from tracing import bind_context
+from percentiles import percentile
+from openai_prompts import call_chatgpt_structured, OPENAI_MODELS
+from prompt import execute_cortex_query
+from llm_output import normalize_recommendation
+
+# Models that receive the prompt alongside the requested one
+FANOUT_MODELS = [m.strip() for m in os.getenv("FANOUT_MODELS", "gpt-4o-mini,claude-3-5-sonnet,mistral-large2").split(",") if m.strip()]
+# The requested model gets this head start before the others are started (0 sends to all at once)
+FANOUT_HEDGE_DELAY_MS = float(os.getenv("FANOUT_HEDGE_DELAY_MS", "2000"))
+FANOUT_TIMEOUT_S = float(os.getenv("FANOUT_TIMEOUT_S", "120"))
+
+
+class FanoutStats:
+    """
+    Per-model call counts, wins and latencies of fan-out requests, kept in memory.
+    """
+
+    def __init__(self, history=1000):
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(lambda: deque(maxlen=history))
+        self._counts = defaultdict(lambda: {"calls": 0, "valid": 0, "invalid": 0, "errors": 0, "wins": 0})
+        self._requests = 0
+        self._request_latencies = deque(maxlen=history)
+
+    def record_call(self, model, latency, outcome):
+        with self._lock:
+            self._counts[model]["calls"] += 1
+            self._counts[model][outcome] += 1
+            self._latencies[model].append(latency)
+
+    def record_request(self, winner, latency):
+        with self._lock:
+            self._requests += 1
+            self._request_latencies.append(latency)
+            if winner is not None:
+                self._counts[winner]["wins"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            models = {}
+            for model, counts in self._counts.items():
+                latencies = list(self._latencies[model])
+                models[model] = {
+                    **counts,
+                    "win_rate": counts["wins"] / self._requests if self._requests else None,
+                    "latency_ms": {
+                        "p50": _ms(percentile(latencies, 0.5)),
+                        "p95": _ms(percentile(latencies, 0.95)),
+                        "p99": _ms(percentile(latencies, 0.99)),
+                        "max": _ms(max(latencies) if latencies else None),
+                    },
+                }
+            latencies = list(self._request_latencies)
+            return {
+                "requests": self._requests,
+                "latency_ms": {
+                    "p50": _ms(percentile(latencies, 0.5)),
+                    "p95": _ms(percentile(latencies, 0.95)),
+                    "p99": _ms(percentile(latencies, 0.99)),
+                },
+                "models": models,
+            }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+fanout_stats = FanoutStats()
+
+
+def _call_model(model_name, patient_data, plans, plan_ids):
+    """
+    Sends the recommendation prompt to one model and returns (response, latency, outcome).
+    """
+    start = time.perf_counter()
+    try:
+        if model_name.lower() in OPENAI_MODELS:
+            response = call_chatgpt_structured(patient_data, plans, model_name, stats={})
+        else:
+            response = execute_cortex_query(patient_data, plan_ids, model_name, stats={})
+    except Exception as e:
+        response = {"error": str(e)}
+    if isinstance(response, dict) and "error" in response and "raw_output" not in response:
+        outcome = "errors"
+    else:
+        response = normalize_recommendation(response, plan_ids)
+        outcome = "valid" if response["recommended_plans"] and "error" not in response else "invalid"
+    latency = time.perf_counter() - start
+    fanout_stats.record_call(model_name, latency, outcome)
+    return response, latency, outcome
+
+
+def fanout_recommendations(patient_data: dict, plans: list, plan_ids: list, primary_model: str, models: list = None, mode: str = "first") -> dict:
+    """
+    Sends the same recommendation prompt to several OpenAI and Cortex models concurrently.
+
+    Parameters:
+    - primary_model: The requested model. In "first" mode it is started FANOUT_HEDGE_DELAY_MS before the rest,
+      so the other models are only paid for when it is slow or returns an unusable answer.
+    - models: Additional models (defaults to FANOUT_MODELS).
+    - mode: "first" returns the first schema-valid answer and ignores the rest; "all" waits for every model.
+
+    Returns:
+    - Dictionary with the winning model and response ("first") or every model's response ("all"),
+      plus per-model latencies and outcomes.
+    """
+    models = list(dict.fromkeys([primary_model] + list(models if models is not None else FANOUT_MODELS)))
+    start = time.perf_counter()
+    deadline = start + FANOUT_TIMEOUT_S
+    executor = ThreadPoolExecutor(max_workers=len(models), thread_name_prefix="llm-fanout")
+    futures = {}
+
+    def launch(model_names):
+        for name in model_names:
+            futures[executor.submit(bind_context(_call_model), name, patient_data, plans, plan_ids)] = name
+
+    results = {}
+    winner = None
+    try:
+        if mode == "first" and FANOUT_HEDGE_DELAY_MS > 0 and len(models) > 1:
+            launch(models[:1])
+            wait(list(futures), timeout=FANOUT_HEDGE_DELAY_MS / 1000)
+            hedged = [future for future in futures if future.done()]
+            if not (hedged and hedged[0].result()[2] == "valid"):
+                launch(models[1:])
+        else:
+            launch(models)
+
+        pending = set(futures)
+        while pending:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                response, latency, outcome = future.result()
+                results[futures[future]] = {"response": response, "latency_ms": _ms(latency), "outcome": outcome}
+                if winner is None and outcome == "valid":
+                    winner = futures[future]
+            if mode == "first" and winner is not None:
+                break
+    finally:
+        # Slower calls keep running in the background but their answers are ignored
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    fanout_stats.record_request(winner, elapsed)
+    print(f"🏁 Fan-out over {models}: winner {winner} after {elapsed:.2f}s ({mode} mode)")
+
+    started = set(futures.values())
+    summary = {
+        "mode": mode,
+        "winner": winner,
+        "total_ms": _ms(elapsed),
+        "models": {
+            name: {key: value for key, value in results[name].items() if key != "response"} if name in results
+            else {"outcome": "pending" if name in started else "not_started"}
+            for name in models
+        },
+    }
+    if mode == "all":
+        summary["responses"] = {name: result["response"] for name, result in results.items()}
+    else:
+        summary["recommendations"] = results[winner]["response"] if winner is not None else None
+    return summary
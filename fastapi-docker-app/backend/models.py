@@ -2,8 +2,6 @@
 from sqlalchemy import Column, Integer, String, Float, Boolean, Date, Enum, ARRAY
 from database import Base
 from sqlalchemy.ext.declarative import declarative_base
-import pandas as pd
-import os
 import enum
 
 Base = declarative_base()
@@ -40,54 +38,5 @@ class Patient(Base):
     has_offspring = Column(Boolean)  # New Field
     is_married = Column(Boolean) 
 
-csv_path = os.path.join(os.path.dirname(__file__), "cleaned_plans_data.csv")
-
-if not os.path.exists("generated_model.py"):
-    def generate_columns(dataframe):
-        column_map = {
-            "int64": Integer,
-            "float64": Float,
-            "bool": Boolean,
-            "datetime64[ns]": Date,
-            "object": String,
-        }
-
-        columns = {
-            "__tablename__": "insurance_plans",
-            "id": Column(Integer, primary_key=True, index=True)
-        }
-
-        for column_name, dtype in zip(dataframe.columns, dataframe.dtypes):
-            if column_name.lower() != "id":  # Skip ID column if it exists
-                sqlalchemy_type = column_map.get(str(dtype), String)
-                columns[column_name] = Column(sqlalchemy_type)
-
-        return type("InsurancePlan", (Base,), columns)
-
-    # Load the cleaned DataFrame
-    df = pd.read_csv(csv_path)  # Path to your dataset
-    InsurancePlan = generate_columns(df)
-
-    # Save the generated model to a file
-    with open("generated_model.py", "w") as f:
-        f.write(f"""
-from sqlalchemy import Column, Integer, String, Float, Boolean, Date
-from database import Base
-
-class InsurancePlan(Base):
-    __tablename__ = "insurance_plans"
-    id = Column(Integer, primary_key=True, index=True)
-""")
-        for column_name, dtype in zip(df.columns, df.dtypes):
-            if column_name.lower() != "id":
-                column_type = {
-                    "int64": "Integer",
-                    "float64": "Float",
-                    "bool": "Boolean",
-                    "datetime64[ns]": "Date",
-                    "object": "String",
-                }.get(str(dtype), "String")
-                f.write(f"    {column_name} = Column({column_type})\n")
-
-# Import the generated model
+# Import the generated model (built from the plan dataset by build_models.py, so nothing reads the dataset here)
 from generated_model import InsurancePlan
\ No newline at end of file
@@ -1,14 +1,108 @@
-from neo4j import GraphDatabase
 import os
+from tracing import span, truncate_statement
 
-# Load Neo4j credentials from environment variables
-NEO4J_URI = os.getenv("NEO4J_URI", "bolt://neo4j:7687")
-NEO4J_AUTH = os.getenv("NEO4J_AUTH", "neo4j/neo4jpassword").split("/")
-NEO4J_USER, NEO4J_PASSWORD = NEO4J_AUTH
+# "neo4j" talks to the Neo4j server over Bolt, "memory" keeps the graph in-process
+GRAPH_BACKEND = os.getenv("GRAPH_BACKEND", "neo4j").lower()
 
-# Initialize Neo4j driver
-neo4j_driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+
+def _traced_run(target, query, parameters=None, **kwargs):
+    # Covers sending the statement and receiving its header; records streamed afterwards are not included
+    with span("neo4j", "neo4j.run", **{"db.system": "neo4j", "db.statement": truncate_statement(query)}):
+        return target.run(query, parameters, **kwargs)
+
+
+class TracedTransaction:
+    def __init__(self, tx):
+        self._tx = tx
+
+    def run(self, query, parameters=None, **kwargs):
+        return _traced_run(self._tx, query, parameters, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._tx, name)
+
+
+class TracedSession:
+    """
+    Neo4j session whose Cypher statements, including those run inside managed transactions, are traced.
+    """
+
+    def __init__(self, session):
+        self._session = session
+
+    def __enter__(self):
+        self._session.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._session.__exit__(*exc_info)
+
+    def run(self, query, parameters=None, **kwargs):
+        return _traced_run(self._session, query, parameters, **kwargs)
+
+    def execute_read(self, work, *args, **kwargs):
+        return self._session.execute_read(lambda tx, *a, **k: work(TracedTransaction(tx), *a, **k), *args, **kwargs)
+
+    def execute_write(self, work, *args, **kwargs):
+        return self._session.execute_write(lambda tx, *a, **k: work(TracedTransaction(tx), *a, **k), *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+class TracedDriver:
+    def __init__(self, driver):
+        self._driver = driver
+
+    def session(self, *args, **kwargs):
+        return TracedSession(self._driver.session(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
+
+
+if GRAPH_BACKEND == "memory":
+    from memory_graph import InMemoryGraph
+
+    neo4j_driver = InMemoryGraph()
+else:
+    from neo4j import GraphDatabase
+
+    # Load Neo4j credentials from environment variables
+    NEO4J_URI = os.getenv("NEO4J_URI", "bolt://neo4j:7687")
+    NEO4J_AUTH = os.getenv("NEO4J_AUTH", "neo4j/neo4jpassword").split("/")
+    NEO4J_USER, NEO4J_PASSWORD = NEO4J_AUTH
+
+    # Initialize Neo4j driver
+    neo4j_driver = TracedDriver(GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD)))
+
+# "patient" writes rule edges per patient, "cohort" shares them through Cohort nodes keyed by
+# (filter criteria, rule set, catalog version) that patients link to
+GRAPH_MODEL = os.getenv("GRAPH_MODEL", "patient").lower()
+PLAN_CATALOG_VERSION = os.getenv("PLAN_CATALOG_VERSION", "1")
+# Cohorts skip the Snowflake filter, so plans added there only reach a cohort's criteria once it expires
+# (0 keeps cohorts until the graph or catalog version changes)
+COHORT_TTL_SECONDS = int(os.getenv("COHORT_TTL_SECONDS", "3600"))
+
+# Optional write-behind buffer that group-commits patient, CONSIDERS and rule-edge writes across requests
+NEO4J_GROUP_COMMIT = os.getenv("NEO4J_GROUP_COMMIT", "false").lower() in ("1", "true", "yes")
+NEO4J_GROUP_COMMIT_MAX_BATCH = int(os.getenv("NEO4J_GROUP_COMMIT_MAX_BATCH", "1000"))
+NEO4J_GROUP_COMMIT_MAX_DELAY_MS = float(os.getenv("NEO4J_GROUP_COMMIT_MAX_DELAY_MS", "20"))
+# Longest a request waits for its buffered writes to commit (and shutdown waits for the last flush)
+NEO4J_GROUP_COMMIT_TIMEOUT_S = float(os.getenv("NEO4J_GROUP_COMMIT_TIMEOUT_S", "30"))
+
+graph_write_buffer = None
+if NEO4J_GROUP_COMMIT and GRAPH_BACKEND != "memory":
+    from graph_writer import GraphWriteBuffer
+
+    graph_write_buffer = GraphWriteBuffer(
+        neo4j_driver,
+        max_batch=NEO4J_GROUP_COMMIT_MAX_BATCH,
+        max_delay=NEO4J_GROUP_COMMIT_MAX_DELAY_MS / 1000,
+    )
 
 # Close the driver when the application stops
 def close_neo4j_driver():
-    neo4j_driver.close()
\ No newline at end of file
+    if graph_write_buffer is not None:
+        graph_write_buffer.close(timeout=NEO4J_GROUP_COMMIT_TIMEOUT_S)
+    neo4j_driver.close()
@@ -0,0 +1,171 @@
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager
+from collections import defaultdict, deque
+import httpx
+from tracing import span
+from percentiles import percentile
+
+# Seconds allowed per model call; reasoning models take much longer to finish a ranking
+OPENAI_MODEL_TIMEOUTS = {
+    "gpt-4o": 90,
+    "gpt-4o-mini": 60,
+    "o1-mini-2024-09-12": 180,
+    "o3-mini-2025-01-31": 180,
+}
+DEFAULT_OPENAI_TIMEOUT_S = float(os.getenv("DEFAULT_OPENAI_TIMEOUT_S", "120"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+OPENAI_BACKOFF_BASE_S = float(os.getenv("OPENAI_BACKOFF_BASE_S", "0.5"))
+OPENAI_BACKOFF_MAX_S = float(os.getenv("OPENAI_BACKOFF_MAX_S", "20"))
+OPENAI_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_KEEPALIVE_CONNECTIONS", "20"))
+
+
+def _is_retryable(error):
+    import openai  # imported on first failure or first client, not at startup
+
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class OpenAIClientManager:
+    """
+    Process-wide OpenAI client.
+
+    One client over a keep-alive httpx pool is shared by every request, so connections and TLS sessions are
+    reused. Calls get a per-model timeout, are retried with full-jitter exponential backoff on 429/5xx and
+    connection errors, and are limited to OPENAI_MAX_CONCURRENCY in flight. Time spent waiting for a slot
+    and time spent in the model are recorded separately per model.
+    """
+
+    def __init__(self, max_concurrency=OPENAI_MAX_CONCURRENCY, history=1000):
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self._stats_lock = threading.Lock()
+        self._queue_wait = defaultdict(lambda: deque(maxlen=history))
+        self._model_time = defaultdict(lambda: deque(maxlen=history))
+        self._counts = defaultdict(lambda: {"calls": 0, "retries": 0, "errors": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0})
+        self._in_flight = 0
+
+    @property
+    def client(self):
+        # Created on first use so the app can start without OpenAI credentials
+        with self._client_lock:
+            if self._client is None:
+                http_client = httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=self.max_concurrency * 2,
+                        max_keepalive_connections=OPENAI_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=60,
+                    ),
+                )
+                from openai import OpenAI  # slow to import; kept off the startup path
+
+                # Retries are handled here so they share the backoff policy and the metrics
+                self._client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client, max_retries=0)
+            return self._client
+
+    def chat_completion(self, **kwargs):
+        """
+        client.chat.completions.create with the shared pool, timeout, retries and concurrency limit.
+        """
+        model = kwargs.get("model")
+        with span("llm", "openai.chat", **{"llm.provider": "openai", "llm.model": model}) as s, self._slot(model):
+            response = self._create_with_retries(model, kwargs)
+            usage = getattr(response, "usage", None)
+            s.set("llm.prompt_tokens", getattr(usage, "prompt_tokens", None))
+            s.set("llm.completion_tokens", getattr(usage, "completion_tokens", None))
+            return response
+
+    def stream_chat_completion(self, **kwargs):
+        """
+        Streaming chat completion that yields chunks; the concurrency slot is held until the stream ends.
+        Only opening the stream is retried, never a partially consumed one.
+        """
+        model = kwargs.get("model")
+        with span("llm", "openai.chat.stream", **{"llm.provider": "openai", "llm.model": model}), self._slot(model):
+            start = time.perf_counter()
+            stream = self._create_with_retries(model, dict(kwargs, stream=True), record=False)
+            try:
+                for chunk in stream:
+                    self._record_usage(model, getattr(chunk, "usage", None))
+                    yield chunk
+            finally:
+                self._record_model_time(model, time.perf_counter() - start)
+
+    def stats(self):
+        with self._stats_lock:
+            models = {}
+            for model, counts in self._counts.items():
+                waits, times = list(self._queue_wait[model]), list(self._model_time[model])
+                models[model] = {
+                    **counts,
+                    # Share of prompt tokens served from the provider's prompt cache
+                    "prompt_cache_hit_ratio": counts["cached_prompt_tokens"] / counts["prompt_tokens"] if counts["prompt_tokens"] else None,
+                    "timeout_s": OPENAI_MODEL_TIMEOUTS.get(model, DEFAULT_OPENAI_TIMEOUT_S),
+                    "queue_wait_ms": {"p50": _ms(percentile(waits, 0.5)), "p95": _ms(percentile(waits, 0.95)), "max": _ms(max(waits) if waits else None)},
+                    "model_ms": {"p50": _ms(percentile(times, 0.5)), "p95": _ms(percentile(times, 0.95)), "max": _ms(max(times) if times else None)},
+                }
+            return {"max_concurrency": self.max_concurrency, "in_flight": self._in_flight, "models": models}
+
+    @contextmanager
+    def _slot(self, model):
+        start = time.perf_counter()
+        self._semaphore.acquire()
+        with self._stats_lock:
+            self._in_flight += 1
+            self._counts[model]["calls"] += 1
+            self._queue_wait[model].append(time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            with self._stats_lock:
+                self._in_flight -= 1
+            self._semaphore.release()
+
+    def _create_with_retries(self, model, kwargs, record=True):
+        timeout = OPENAI_MODEL_TIMEOUTS.get(model, DEFAULT_OPENAI_TIMEOUT_S)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.client.with_options(timeout=timeout).chat.completions.create(**kwargs)
+                if record:
+                    self._record_model_time(model, time.perf_counter() - start)
+                    self._record_usage(model, getattr(response, "usage", None))
+                return response
+            except Exception as e:
+                if not _is_retryable(e) or attempt >= OPENAI_MAX_RETRIES:
+                    with self._stats_lock:
+                        self._counts[model]["errors"] += 1
+                    raise
+                delay = random.uniform(0, min(OPENAI_BACKOFF_MAX_S, OPENAI_BACKOFF_BASE_S * 2 ** attempt))
+                attempt += 1
+                with self._stats_lock:
+                    self._counts[model]["retries"] += 1
+                print(f"🔁 OpenAI {model} call failed ({type(e).__name__}), retry {attempt} in {delay:.2f}s")
+                time.sleep(delay)
+
+    def _record_usage(self, model, usage):
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        with self._stats_lock:
+            self._counts[model]["prompt_tokens"] += usage.prompt_tokens or 0
+            self._counts[model]["cached_prompt_tokens"] += getattr(details, "cached_tokens", None) or 0
+
+    def _record_model_time(self, model, seconds):
+        with self._stats_lock:
+            self._model_time[model].append(seconds)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+openai_client = OpenAIClientManager()
@@ -1,12 +1,33 @@
 import os
 import json
-from openai import OpenAI
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tracing import bind_context
+from openai_client import openai_client
+from prompt_encoder import encode_plans
+from llm_output import extract_recommended_plans, is_valid_recommendation
+from llm_metrics import record_llm_call
 
 #load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Bump whenever build_chatgpt_prompt changes so cached recommendations from older prompts are not reused
+PROMPT_TEMPLATE_VERSION = "3"
+
+# Models served by OpenAI; every other model name goes to Snowflake Cortex
+OPENAI_MODELS = ["gpt-4o", "gpt-4o-mini", "o1-mini-2024-09-12", "o3-mini-2025-01-31"]
+
+# Map-reduce ranking: plans per map prompt, map prompts in flight, and candidate count that switches "auto" mode to it
+MAP_REDUCE_CHUNK_SIZE = int(os.getenv("MAP_REDUCE_CHUNK_SIZE", "15"))
+MAP_REDUCE_CONCURRENCY = int(os.getenv("MAP_REDUCE_CONCURRENCY", "4"))
+MAP_REDUCE_MIN_PLANS = int(os.getenv("MAP_REDUCE_MIN_PLANS", "30"))
+
+def build_chatgpt_prompt(patient_data: dict, plans: list, model: str = None, stats: dict = None) -> list:
+    # Static instructions, rubric and schema come first and must stay byte-identical across requests so the
+    # provider's prompt cache can reuse them; only the last two messages (patient and plans) vary
+    plans_text, encoding_stats = encode_plans(plans, patient_data, model)
+    if stats is not None:
+        stats.update(encoding_stats)
 
-def build_chatgpt_prompt(patient_data: dict, plans: list) -> list:
     messages = [
         {
             "role": "user",
@@ -19,14 +40,10 @@ def build_chatgpt_prompt(patient_data: dict, plans: list) -> list:
         {
             "role": "user",
             "content": (
-                "Below is the detailed profile of a patient seeking insurance coverage. "
+                "The detailed profile of the patient seeking insurance coverage follows the output schema below. "
                 "Carefully consider the patient's occupation, medical conditions, lifestyle, age, specific risks, and any explicitly mentioned requirements when evaluating the plans."
             )
         },
-        {
-            "role": "user",
-            "content": f"Patient Details: {patient_data}"
-        },
         {
             "role": "user",
             "content": (
@@ -67,81 +84,183 @@ def build_chatgpt_prompt(patient_data: dict, plans: list) -> list:
         },
         {
             "role": "user",
-            "content": f"Plans: {json.dumps(plans, default=str)}"
+            "content": f"Patient Details: {patient_data}"
+        },
+        {
+            "role": "user",
+            "content": (
+                "Plans (one '|' separated row per plan under the header row; attributes shared by all plans are listed once):\n"
+                f"{plans_text}"
+            )
         }
     ]
     return messages
 
-def call_chatgpt_structured(patient_data, plans, model="gpt-4"):
-    messages = build_chatgpt_prompt(patient_data, plans)
-    is_o1_mini = model in ["o1-mini-2024-09-12"]
-
-    # Define the enforced JSON Schema
-    schema = {
-        "type": "object",
-        "properties": {
-            "recommended_plans": {
-                "type": "array",
-                "items": {
-                    "type": "object",
-                    "properties": {
-                        "rank": {"type": "integer"},
-                        "PlanId": {"type": "string"},
-                        "PlanMarketingName": {"type": "string"},
-                        "IssuerName": {"type": "string"},
-                        "MetalLevel": {"type": "string"},
-                        "Deductible": {"type": "string"},
-                        "MaxOutOfPocket": {"type": "string"},
-                        "TotalScore": {"type": "integer"},
-                        "ScoreExplanation": {"type": "string"},
-                        "Justification": {"type": "string"}
-                    },
-                    "required": [
-                        "rank", "PlanId", "PlanMarketingName", "IssuerName", "MetalLevel",
-                        "Deductible", "MaxOutOfPocket", "TotalScore","ScoreExplanation" ,"Justification"
-                    ],
-                    "additionalProperties": False
-                }
-            },
-            "summary": {"type": "string"}
+# Enforced JSON Schema for structured outputs
+RECOMMENDATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "recommended_plans": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "rank": {"type": "integer"},
+                    "PlanId": {"type": "string"},
+                    "PlanMarketingName": {"type": "string"},
+                    "IssuerName": {"type": "string"},
+                    "MetalLevel": {"type": "string"},
+                    "Deductible": {"type": "string"},
+                    "MaxOutOfPocket": {"type": "string"},
+                    "TotalScore": {"type": "integer"},
+                    "ScoreExplanation": {"type": "string"},
+                    "Justification": {"type": "string"}
+                },
+                "required": [
+                    "rank", "PlanId", "PlanMarketingName", "IssuerName", "MetalLevel",
+                    "Deductible", "MaxOutOfPocket", "TotalScore","ScoreExplanation" ,"Justification"
+                ],
+                "additionalProperties": False
+            }
+        },
+        "summary": {"type": "string"}
+    },
+    "required": ["recommended_plans", "summary"],
+    "additionalProperties": False
+}
+
+def completion_kwargs(model, messages):
+    """
+    Arguments for client.chat.completions.create; o1-mini gets no temperature, response_format or system role.
+    """
+    if model in ["o1-mini-2024-09-12"]:
+        return {"model": model, "messages": messages, "max_completion_tokens": 3000}
+    # Full features enabled for GPT-4 / 4o
+    return {
+        "model": model,
+        "messages": messages,
+        #temperature=0.5,
+        "max_completion_tokens": 8000,
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "insurance_recommendation",
+                "schema": RECOMMENDATION_SCHEMA,
+                "strict": True
+            }
         },
-        "required": ["recommended_plans", "summary"],
-        "additionalProperties": False
     }
-    print(model)
 
-    try:
-        client= OpenAI()
-        if is_o1_mini:
-            # No temperature, no response_format, no system
-            print("o1 block")
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_completion_tokens=3000
-            )
-            print(" o3 Response:", response)
-        else:
-            # Full features enabled for GPT-4 / 4o
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                #temperature=0.5,
-                max_completion_tokens=8000,
-                response_format={
-                    "type": "json_schema",
-                    "json_schema": {
-                        "name": "insurance_recommendation",
-                        "schema": schema,
-                        "strict": True
-                    }
-                }
-            )
-            print(" o3 Response:", response)
-        return response.choices[0].message.content
+def usage_stats(usage) -> dict:
+    """
+    Prompt, cached and completion token counts from an OpenAI usage object; cached tokens hit the provider's prompt cache.
+    """
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "cached_prompt_tokens": getattr(details, "cached_tokens", None) or 0,
+        "completion_tokens": usage.completion_tokens,
+    }
+
+def call_chatgpt_structured(patient_data, plans, model="gpt-4", stats=None, operation="recommend"):
+    messages = build_chatgpt_prompt(patient_data, plans, model, stats)
 
+    start = time.perf_counter()
+    try:
+        response = openai_client.chat_completion(**completion_kwargs(model, messages))
     except Exception as e:
+        record_llm_call(model, "openai", operation, "error", time.perf_counter() - start, error=str(e))
         return {
             "error": str(e),
             "raw_prompt": messages
-        }
\ No newline at end of file
+        }
+
+    usage = usage_stats(response.usage)
+    if stats is not None:
+        stats.update(usage)
+    content = response.choices[0].message.content
+    outcome = "parsed" if is_valid_recommendation(content) else "invalid"
+    record_llm_call(model, "openai", operation, outcome, time.perf_counter() - start, usage)
+    return content
+
+def stream_chatgpt_structured(patient_data, plans, model="gpt-4", stats=None):
+    """
+    Streaming variant of call_chatgpt_structured: yields the completion text as the model generates it.
+    Errors are raised to the caller, which reports them on the stream.
+    """
+    messages = build_chatgpt_prompt(patient_data, plans, model, stats)
+    kwargs = dict(completion_kwargs(model, messages), stream_options={"include_usage": True})
+    start = time.perf_counter()
+    usage, content = {}, []
+    try:
+        for chunk in openai_client.stream_chat_completion(**kwargs):
+            # With include_usage the last chunk has no choices and carries the token usage
+            if chunk.usage is not None:
+                usage = usage_stats(chunk.usage)
+                if stats is not None:
+                    stats.update(usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                content.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        record_llm_call(model, "openai", "stream", "error", time.perf_counter() - start, usage, error=str(e))
+        raise
+    outcome = "parsed" if is_valid_recommendation("".join(content)) else "invalid"
+    record_llm_call(model, "openai", "stream", outcome, time.perf_counter() - start, usage)
+
+def call_chatgpt_map_reduce(patient_data, plans, model="gpt-4", stats=None):
+    """
+    Ranks a large candidate set in two stages with the same structured prompt.
+
+    Map: plans are split into chunks of MAP_REDUCE_CHUNK_SIZE, scored in parallel (MAP_REDUCE_CONCURRENCY at a time).
+    Reduce: the top plans of every chunk are re-ranked together in one small final prompt.
+    stats, if given, receives chunk counts and per-stage latencies.
+
+    Returns:
+    - The reduce call's response, in the same format as call_chatgpt_structured.
+    """
+    plans = [dict(plan) for plan in plans]
+    chunks = [plans[i:i + MAP_REDUCE_CHUNK_SIZE] for i in range(0, len(plans), MAP_REDUCE_CHUNK_SIZE)]
+    if len(chunks) <= 1:
+        return call_chatgpt_structured(patient_data, plans, model, stats)
+
+    def rank_chunk(chunk):
+        start = time.perf_counter()
+        response = call_chatgpt_structured(patient_data, chunk, model, stats={}, operation="map")
+        return response, time.perf_counter() - start
+
+    map_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=MAP_REDUCE_CONCURRENCY, thread_name_prefix="map-rank") as executor:
+        chunk_results = list(executor.map(bind_context(rank_chunk), chunks))
+    map_seconds = time.perf_counter() - map_start
+
+    plans_by_id = {str(plan.get("PlanId")): plan for plan in plans}
+    winners = []
+    for response, _ in chunk_results:
+        for recommended in extract_recommended_plans(response) or []:
+            plan = plans_by_id.get(str(recommended.get("PlanId")))
+            if plan is not None and plan not in winners:
+                winners.append(plan)
+
+    if not winners:
+        # Every map call failed; surface the first error as the single-call path would
+        return chunk_results[0][0]
+
+    reduce_start = time.perf_counter()
+    response = call_chatgpt_structured(patient_data, winners, model, stats, operation="reduce")
+    reduce_seconds = time.perf_counter() - reduce_start
+
+    if stats is not None:
+        stats.update({
+            "ranking_mode": "map_reduce",
+            "map_chunks": len(chunks),
+            "map_chunk_ms": [round(seconds * 1000, 1) for _, seconds in chunk_results],
+            "map_ms": round(map_seconds * 1000, 1),
+            "reduce_candidates": len(winners),
+            "reduce_ms": round(reduce_seconds * 1000, 1),
+        })
+    print(f"🗺 Map-reduce ranking for {model}: {len(plans)} plans in {len(chunks)} chunks → {len(winners)} finalists "
+          f"(map {map_seconds:.2f}s, reduce {reduce_seconds:.2f}s)")
+    return response
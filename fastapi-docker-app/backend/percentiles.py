@@ -0,0 +1,9 @@
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of values (fraction in [0, 1]), or None when there are no values.
+    Shared by the stats endpoints and the load test so their p50/p95/p99 figures are comparable.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
@@ -0,0 +1,104 @@
+import os
+import time
+import numpy as np
+from cleanup import clean_value
+from rules import select_rules
+from prompt_encoder import INJURY_PLAN_ATTRIBUTES, occupation_risk_class
+
+# How many pre-ranked plans each model gets to see; the prompt only asks for the top 3
+MODEL_SHORTLIST_SIZES = {
+    "gpt-4o": 25,
+    "gpt-4o-mini": 25,
+    "o1-mini-2024-09-12": 15,
+    "o3-mini-2025-01-31": 25,
+    "claude-3-5-sonnet": 15,
+    "llama3.1-405b": 20,
+    "mistral-large2": 20,
+}
+DEFAULT_SHORTLIST_SIZE = int(os.getenv("DEFAULT_SHORTLIST_SIZE", "20"))
+
+# Deductible, MOOP and coinsurance: the cost attributes shared by every rule set
+BASE_COST_ATTRIBUTES = [
+    "TEHBDedInnTier1Individual",
+    "TEHBInnTier1IndividualMOOP",
+    "TEHBDedInnTier1Coinsurance",
+]
+
+
+def cost_attributes(patient_data: dict) -> list:
+    """
+    Cost attributes the pre-ranking scores on: the base set, the patient's rule attributes
+    and injury cost sharing for high-risk occupations.
+    """
+    attributes = list(BASE_COST_ATTRIBUTES)
+    for rule in select_rules(patient_data):
+        attributes.extend(rule["attribute_list"])
+    if occupation_risk_class(patient_data.get("occupation")) == "high":
+        attributes.extend(attr for attr in INJURY_PLAN_ATTRIBUTES if not attr.endswith("Limit"))
+    return list(dict.fromkeys(attributes))
+
+
+def score_plans(plans: list, patient_data: dict) -> np.ndarray:
+    """
+    Scores plans in [0, 1] (higher is cheaper) by averaging each cost attribute's percentile rank
+    among the candidates. Missing values get a neutral 0.5 so plans are not penalized for them.
+    """
+    attributes = cost_attributes(patient_data)
+    values = np.full((len(plans), len(attributes)), np.nan)
+    for row, plan in enumerate(plans):
+        by_lower = {str(key).lower(): value for key, value in dict(plan).items()}
+        for column, attr in enumerate(attributes):
+            value = clean_value(by_lower.get(attr.lower()), float)
+            if isinstance(value, (int, float)):
+                values[row, column] = value
+
+    present = ~np.isnan(values)
+    # Rank each column's present values, equal values sharing their average rank so the scores do not
+    # depend on the candidates' order, then scale the ranks to [0, 1]
+    ranks = np.zeros_like(values)
+    for column in range(len(attributes)):
+        column_values = np.sort(values[present[:, column], column])
+        lower = np.searchsorted(column_values, values[:, column], side="left")
+        upper = np.searchsorted(column_values, values[:, column], side="right")
+        ranks[:, column] = (lower + upper - 1) / 2
+    counts = present.sum(axis=0)
+    scale = np.where(counts > 1, counts - 1, 1)
+    percentiles = np.where(present, ranks / scale, 0.5)
+    return 1.0 - percentiles.mean(axis=1) if attributes else np.zeros(len(plans))
+
+
+def plan_sort_id(plan) -> str:
+    """
+    PlanId under any column casing, the tie-break that keeps equal scores in a stable order.
+    """
+    by_lower = {str(key).lower(): value for key, value in dict(plan).items()}
+    return str(by_lower.get("planid") or "")
+
+
+def shortlist_plans(plans: list, patient_data: dict, model_name: str):
+    """
+    Keeps the top-K plans by cost score for the model, so LLM latency is bounded regardless of catalog size.
+    Plans are always returned cheapest first, even when all of them fit, because fit_plans_to_budget drops
+    from the end; ties are broken on PlanId, so the shortlist does not depend on the candidates' order.
+
+    Returns:
+    - Tuple of (shortlisted plans, stats dictionary).
+    """
+    start = time.perf_counter()
+    k = MODEL_SHORTLIST_SIZES.get(model_name, DEFAULT_SHORTLIST_SIZE)
+    plans = list(plans)
+    if plans:
+        scores = score_plans(plans, patient_data)
+        top = np.lexsort((np.array([plan_sort_id(plan) for plan in plans]), -scores))[:k]
+        shortlisted = [plans[index] for index in top]
+    else:
+        shortlisted = []
+
+    stats = {
+        "candidates": len(plans),
+        "shortlisted": len(shortlisted),
+        "shortlist_size": k,
+        "shortlist_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+    print(f"📋 Pre-ranked {len(plans)} plans down to {len(shortlisted)} for {model_name}")
+    return shortlisted, stats
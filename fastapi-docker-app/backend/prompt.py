@@ -1,68 +1,217 @@
+import os
 import json
+import logging
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from snowflake_utils import get_snowflake_connection
+from prompt_encoder import encode_plans
+from llm_output import is_valid_recommendation
+from llm_metrics import record_llm_call
+from tracing import span
 from datetime import date
-import traceback
-import textwrap
+import time
 
+# Bump whenever build_llm_prompt changes so cached recommendations from older prompts are not reused
+PROMPT_TEMPLATE_VERSION = "3"
 
-def execute_cortex_query(patient_data: dict, plan_ids, model_name: str):
+# Base URL of the local LLM stand-in (llm_stub_server.py); when set, COMPLETE calls never reach Snowflake
+CORTEX_STUB_URL = os.getenv("CORTEX_STUB_URL", "").rstrip("/")
+
+logger = logging.getLogger(__name__)
+
+def execute_cortex_query(patient_data: dict, plan_ids, model_name: str, stats: dict = None):
     plans = fetch_selected_insurance_plans(plan_ids)
     if not plans:
         return {"error": "No plans retrieved from Snowflake"}
 
-    prompt_payload = build_llm_prompt(patient_data, plans)
+    prompt_payload = build_llm_prompt(patient_data, plans, model_name, stats)
 
+    start = None
     try:
-        #prompt_json = json.dumps(prompt_payload)
-        prompt_json = json.dumps(prompt_payload, ensure_ascii=False).replace("'", "''")
-        print("🧾 Prompt JSON being sent:")
-        print(prompt_json)
+        prompt_json = json.dumps(prompt_payload, ensure_ascii=False)
+        logger.debug("Cortex prompt for %s: %d characters", model_name, len(prompt_json))
 
-        sql_query = f"""
-            SELECT SNOWFLAKE.CORTEX.COMPLETE(
-                '{model_name}',
-                PARSE_JSON('{prompt_json}')
-            ) AS recommendations;
-        """
-        
-        conn = get_snowflake_connection()
-        cursor = conn.cursor()
-        print("🧠 Executing Cortex SQL...")
-        print(textwrap.indent(sql_query, "  "))  # Indent the SQL query for better readability
-        cursor.execute(sql_query)  # No parameter binding
-        
+        start = time.perf_counter()
+        raw_output = run_cortex_complete(model_name, prompt_json)
+        if not raw_output:
+            record_llm_call(model_name, "cortex", "recommend", "error", time.perf_counter() - start, error="No response")
+            return {"error": "No response from Cortex"}
+
+        response = parse_cortex_output(raw_output)
+        usage = cortex_usage(response)
+        if stats is not None:
+            stats.update(usage)
+        outcome = "parsed" if is_valid_recommendation(response) else "invalid"
+        record_llm_call(model_name, "cortex", "recommend", outcome, time.perf_counter() - start, usage)
+        return response
+
+    except Exception as e:
+        if start is not None:
+            record_llm_call(model_name, "cortex", "recommend", "error", time.perf_counter() - start, error=str(e))
+        return {"error": f"Error executing Cortex: {str(e)}"}
+
+
+def run_cortex_complete(model_name: str, prompt_json: str):
+    """
+    Runs one Cortex COMPLETE and returns its raw text output, or None if no row came back.
+    With CORTEX_STUB_URL set the prompt goes to the local stand-in server (llm_stub_server.py) instead of Snowflake.
+    """
+    with span("llm", "cortex.complete", **{"llm.provider": "cortex", "llm.model": model_name}):
+        if CORTEX_STUB_URL:
+            response = httpx.post(f"{CORTEX_STUB_URL}/cortex/complete", json={"model": model_name, "prompt": prompt_json}, timeout=300)
+            response.raise_for_status()
+            return response.json()["output"]
+        return _run_cortex_sql(model_name, prompt_json)
+
+
+def _run_cortex_sql(model_name: str, prompt_json: str):
+    # Model and prompt are bind parameters, so the prompt no longer needs hand-escaping into a SQL literal
+    sql_query = """
+        SELECT SNOWFLAKE.CORTEX.COMPLETE(
+            %s,
+            PARSE_JSON(%s)
+        ) AS recommendations;
+    """
 
+    conn = get_snowflake_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql_query, (model_name, prompt_json))
         result = cursor.fetchone()
-        if not result:
-            return {"error": "No response from Cortex"}
+        return result[0] if result else None
+    finally:
+        cursor.close()
+        conn.close()
 
-        raw_output = result[0]
-        print(f"🔹 Raw LLM Output: {raw_output}")
 
-        try:
-            return json.loads(raw_output)
-        except json.JSONDecodeError as e:
-            return {
-                "error": f"JSON parsing failed: {str(e)}",
-                "raw_output": raw_output
-            }
+def cortex_usage(response) -> dict:
+    """
+    Token counts from the usage block COMPLETE returns with its options form; empty if absent.
+    """
+    if not isinstance(response, dict) or not isinstance(response.get("usage"), dict):
+        return {}
+    return {key: response["usage"][key] for key in ("prompt_tokens", "completion_tokens") if key in response["usage"]}
+
+
+def parse_cortex_output(raw_output):
+    try:
+        return json.loads(raw_output)
+    except json.JSONDecodeError as e:
+        return {
+            "error": f"JSON parsing failed: {str(e)}",
+            "raw_output": raw_output
+        }
 
+
+def execute_cortex_batch(requests: list, model_name: str, stats: dict = None) -> dict:
+    """
+    Scores many patients with one Cortex COMPLETE statement.
+
+    The candidate plans of all requests are fetched in one query, each patient's prompt is built as in
+    execute_cortex_query, and the prompts are loaded into a temporary table with bound parameters.
+    A single SELECT then runs COMPLETE over every row.
+
+    Parameters:
+    - requests: List of {"key", "patient_data", "plan_ids"} dictionaries; key identifies the patient in the result.
+    - model_name: Cortex model used for every row.
+    - stats: Optional dictionary that receives row counts and timings.
+
+    Returns:
+    - Dictionary mapping each key to the parsed recommendation or an error dictionary, like execute_cortex_query.
+    """
+    if not requests:
+        return {}
+
+    all_plan_ids = list(dict.fromkeys(plan_id for request in requests for plan_id in request["plan_ids"]))
+    plans_by_id = {str(plan.get("PLANID", plan.get("PlanId"))): plan for plan in fetch_selected_insurance_plans(all_plan_ids)}
+
+    results = {}
+    rows = []
+    for request in requests:
+        plans = [plans_by_id[str(plan_id)] for plan_id in request["plan_ids"] if str(plan_id) in plans_by_id]
+        if not plans:
+            results[request["key"]] = {"error": "No plans retrieved from Snowflake"}
+            continue
+        prompt_payload = build_llm_prompt(request["patient_data"], plans, model_name)
+        rows.append((str(request["key"]), json.dumps(prompt_payload, ensure_ascii=False)))
+
+    if not rows:
+        return results
+
+    start = time.perf_counter()
+    if CORTEX_STUB_URL:
+        # The stand-in server has no SQL; send the rows concurrently to keep batch timings comparable
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            outputs = list(executor.map(lambda row: _stub_complete_row(model_name, row), rows))
+        for (key, _), (raw_output, error) in zip(rows, outputs):
+            if error is not None:
+                results[key] = {"error": f"Error executing Cortex: {error}"}
+                record_llm_call(model_name, "cortex", "batch", "error", time.perf_counter() - start, error=error)
+                continue
+            results[key] = parse_cortex_output(raw_output)
+            outcome = "parsed" if is_valid_recommendation(results[key]) else "invalid"
+            record_llm_call(model_name, "cortex", "batch", outcome, time.perf_counter() - start, cortex_usage(results[key]))
+        if stats is not None:
+            stats.update({"batch_rows": len(rows), "batch_ms": round((time.perf_counter() - start) * 1000, 1)})
+        return results
+
+    conn = get_snowflake_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("CREATE TEMPORARY TABLE IF NOT EXISTS CORTEX_BATCH_PROMPTS (PATIENT_KEY STRING, PROMPT STRING)")
+        cursor.execute("TRUNCATE TABLE CORTEX_BATCH_PROMPTS")
+        cursor.executemany("INSERT INTO CORTEX_BATCH_PROMPTS (PATIENT_KEY, PROMPT) VALUES (%s, %s)", rows)
+        print(f"🧠 Executing batched Cortex COMPLETE over {len(rows)} prompts...")
+        cursor.execute(
+            """
+            SELECT PATIENT_KEY, SNOWFLAKE.CORTEX.COMPLETE(%s, PARSE_JSON(PROMPT)) AS recommendations
+            FROM CORTEX_BATCH_PROMPTS
+            """,
+            (model_name,),
+        )
+        batch_rows = cursor.fetchall()
+        # Rows finish together, so each call is recorded with the statement's latency
+        latency = time.perf_counter() - start
+        for key, raw_output in batch_rows:
+            results[key] = parse_cortex_output(raw_output) if raw_output else {"error": "No response from Cortex"}
+            outcome = "parsed" if is_valid_recommendation(results[key]) else ("invalid" if raw_output else "error")
+            record_llm_call(model_name, "cortex", "batch", outcome, latency, cortex_usage(results[key]))
     except Exception as e:
-        return {"error": f"Error executing Cortex: {str(e)}"}
-    
+        for key, _ in rows:
+            if key not in results:
+                results[key] = {"error": f"Error executing Cortex: {str(e)}"}
+                record_llm_call(model_name, "cortex", "batch", "error", time.perf_counter() - start, error=str(e))
     finally:
         cursor.close()
         conn.close()
 
+    if stats is not None:
+        stats.update({"batch_rows": len(rows), "batch_ms": round((time.perf_counter() - start) * 1000, 1)})
+    print(f"⏱ Batched Cortex COMPLETE for {len(rows)} patients took {time.perf_counter() - start:.2f}s")
+    return results
 
-def build_llm_prompt(patient_data: dict, plans: list) -> dict:
+
+def _stub_complete_row(model_name, row):
+    try:
+        return run_cortex_complete(model_name, row[1]), None
+    except Exception as e:
+        return None, str(e)
+
+
+def build_llm_prompt(patient_data: dict, plans: list, model_name: str = None, stats: dict = None) -> dict:
     """
     Constructs a structured JSON prompt for Snowflake Cortex LLM.
+    Plans are sent as a compact table (see prompt_encoder.encode_plans); stats, if given, receives the token counts.
+    The static instructions form a byte-identical prefix across requests; the patient and plans come last.
     """
 
     if not patient_data or not plans:
         raise ValueError("Patient data and plans cannot be empty.")
 
+    plans_text, encoding_stats = encode_plans(plans, patient_data, model_name)
+    if stats is not None:
+        stats.update(encoding_stats)
+
     prompt = {
         "messages": [
             {
@@ -71,11 +220,7 @@ def build_llm_prompt(patient_data: dict, plans: list) -> dict:
             },
             {
                 "role": "user",
-                "content": "Here are the details of the patient seeking an insurance plan. Consider their occupation, medical conditions, lifestyle, and any special requirements they may have."
-            },
-            {
-                "role": "user",
-                "content": f"Patient Details: {patient_data}"
+                "content": "The details of the patient seeking an insurance plan follow the instructions below. Consider their occupation, medical conditions, lifestyle, and any special requirements they may have."
             },
             {
                 "role": "user",
@@ -102,13 +247,20 @@ def build_llm_prompt(patient_data: dict, plans: list) -> dict:
                 "content":
                     "At the end, include a comparison paragraph explaining why the top-ranked plan outperformed the others. Highlight which attributes made the difference. Use plain structured format with no special characters or extra commentary."
             },
+            {
+                "role": "user",
+                "content": f"Patient Details: {patient_data}"
+            },
             {
                 "role": "user",
                 "content": "Here are the available insurance plans. Please assess these options carefully based on the patient's profile."
             },
             {
                 "role": "user",
-                "content": f"Plans: {plans}"
+                "content": (
+                    "Plans (one '|' separated row per plan under the header row; attributes shared by all plans are listed once):\n"
+                    f"{plans_text}"
+                )
             }
         ],
         "max_tokens": 4000,
@@ -146,20 +298,14 @@ def fetch_selected_insurance_plans(plan_ids: list) -> list:
         cursor.execute("USE DATABASE HEALTHCARE_INSURANCE_DB;")
         cursor.execute("USE SCHEMA PLAN_SCHEMA;")
 
-        plan_ids_str = ", ".join([f"'{plan_id}'" for plan_id in plan_ids])
-
-        # ✅ Print Plan IDs before query execution
-        print(f"🔍 Plan IDs to query: {plan_ids_str}")  
+        plan_ids = [str(plan_id) for plan_id in plan_ids]
 
         sql_query = f"""
         SELECT * FROM PLAN_SCHEMA.INSURANCE_PLANS
-        WHERE PLANID IN ({plan_ids_str});
+        WHERE PLANID IN ({", ".join(["%s"] * len(plan_ids))});
         """
 
-        # ✅ Print SQL Query before execution
-        print(f"📌 Executing SQL query: {sql_query}")
-
-        cursor.execute(sql_query)
+        cursor.execute(sql_query, plan_ids)
         columns = [desc[0] for desc in cursor.description]  # Get column names
         raw_plans = [dict(zip(columns, row)) for row in cursor.fetchall()]  # Convert to list of dicts
 
@@ -172,9 +318,7 @@ def fetch_selected_insurance_plans(plan_ids: list) -> list:
         return raw_plans
 
     except Exception as e:
-        print(f"⚠️ Error fetching plans: {str(e)}")
-        print(traceback.format_exc())  # ✅ Print full traceback to debug
-
+        logger.exception("Error fetching %d selected plans: %s", len(plan_ids), e)
         return []
     
     finally:
@@ -0,0 +1,202 @@
+import os
+import json
+from rules import select_rules
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to a character-based estimate
+    tiktoken = None
+
+# Token budget for the plan table in a single prompt, per model
+MODEL_PLAN_TOKEN_BUDGETS = {
+    "gpt-4o": 60000,
+    "gpt-4o-mini": 60000,
+    "o1-mini-2024-09-12": 40000,
+    "o3-mini-2025-01-31": 60000,
+    "claude-3-5-sonnet": 12000,
+    "llama3.1-405b": 60000,
+    "mistral-large2": 60000,
+}
+DEFAULT_PLAN_TOKEN_BUDGET = int(os.getenv("DEFAULT_PLAN_TOKEN_BUDGET", "30000"))
+
+# Attributes every ranking needs: identity, the output schema fields and general cost/benefit signals
+CORE_PLAN_ATTRIBUTES = [
+    "PlanId",
+    "PlanMarketingName",
+    "IssuerMarketPlaceMarketingName",
+    "MetalLevel",
+    "PlanType",
+    "TEHBDedInnTier1Individual",
+    "TEHBInnTier1IndividualMOOP",
+    "TEHBDedInnTier1Coinsurance",
+    "IsHSAEligible",
+    "WellnessProgramOffered",
+    "DiseaseManagementProgramsOffered",
+    "IsReferralRequiredForSpecialist",
+    "NationalNetwork",
+]
+TRAVEL_PLAN_ATTRIBUTES = [
+    "OutOfCountryCoverage",
+    "OutOfCountryCoverageDescription",
+    "OutOfServiceAreaCoverage",
+    "OutOfServiceAreaCoverageDescription",
+]
+INJURY_PLAN_ATTRIBUTES = [
+    "SBCHavingSimplefractureDeductible",
+    "SBCHavingSimplefractureCopayment",
+    "SBCHavingSimplefractureCoinsurance",
+    "SBCHavingSimplefractureLimit",
+]
+PREGNANCY_PLAN_ATTRIBUTES = ["IsNoticeRequiredForPregnancy"]
+
+# Occupations the scoring instructions treat as injury-prone
+HIGH_RISK_OCCUPATION_KEYWORDS = [
+    "construction", "driver", "racing", "roofer", "miner", "mining", "logger", "firefighter",
+    "police", "military", "soldier", "pilot", "fisher", "electrician", "welder", "athlete", "stunt",
+]
+
+_encodings = {}
+
+
+def count_tokens(text: str, model_name: str = None) -> int:
+    """
+    Counts prompt tokens locally with tiktoken when installed, otherwise estimates ~4 characters per token.
+    """
+    if tiktoken is None:
+        return (len(text) + 3) // 4
+
+    if model_name not in _encodings:
+        try:
+            _encodings[model_name] = tiktoken.encoding_for_model(model_name)
+        except (KeyError, TypeError):
+            _encodings[model_name] = tiktoken.get_encoding("cl100k_base")
+    return len(_encodings[model_name].encode(text, disallowed_special=()))
+
+
+def occupation_risk_class(occupation) -> str:
+    """
+    "high" for injury-prone occupations, "standard" otherwise.
+    """
+    occupation = (occupation or "").lower()
+    return "high" if any(keyword in occupation for keyword in HIGH_RISK_OCCUPATION_KEYWORDS) else "standard"
+
+
+def relevant_plan_attributes(patient_data: dict) -> list:
+    """
+    Plan attributes worth sending to the LLM for this patient: the core set, the attributes of the
+    patient's rules and the ones the scoring instructions tie to their profile.
+    """
+    attributes = list(CORE_PLAN_ATTRIBUTES)
+    for rule in select_rules(patient_data):
+        attributes.extend(rule["attribute_list"])
+    if patient_data.get("travel_coverage_needed"):
+        attributes.extend(TRAVEL_PLAN_ATTRIBUTES)
+    activity_level = getattr(patient_data.get("physical_activity_level"), "value", patient_data.get("physical_activity_level"))
+    if occupation_risk_class(patient_data.get("occupation")) == "high" or activity_level == "active":
+        attributes.extend(INJURY_PLAN_ATTRIBUTES)
+    if (patient_data.get("gender") or "").lower() == "female" or "Pregnancy" in (patient_data.get("medical_conditions") or []):
+        attributes.extend(PREGNANCY_PLAN_ATTRIBUTES)
+    return list(dict.fromkeys(attributes))
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).replace("|", "/").replace("\n", " ").strip()
+
+
+def _plan_table(plans: list, patient_data: dict):
+    # Header lines (shared values, column names) and one row line per plan, in the order given
+    relevant = relevant_plan_attributes(patient_data)
+    rows = []
+    for plan in plans:
+        # Snowflake rows come back with upper-case column names, Neo4j nodes with the schema's casing
+        by_lower = {str(key).lower(): value for key, value in dict(plan).items()}
+        rows.append({attr: by_lower.get(attr.lower()) for attr in relevant})
+
+    attributes = [attr for attr in relevant if any(row[attr] is not None for row in rows)]
+    shared = {}
+    if len(rows) > 1:
+        shared = {
+            attr: rows[0][attr] for attr in attributes
+            if attr != "PlanId" and all(row[attr] == rows[0][attr] for row in rows)
+        }
+    columns = [attr for attr in attributes if attr not in shared]
+
+    header = []
+    if shared:
+        header.append("Shared by all plans: " + "; ".join(f"{attr}={_format_value(value)}" for attr, value in shared.items()))
+    header.append("|".join(columns))
+    lines = ["|".join(_format_value(row[attr]) for attr in columns) for row in rows]
+    return header, lines, columns, shared
+
+
+def _rows_within_budget(header: list, lines: list, model_name: str = None) -> int:
+    # Number of leading rows that fit the model's plan token budget; the first row is always kept
+    budget = MODEL_PLAN_TOKEN_BUDGETS.get(model_name, DEFAULT_PLAN_TOKEN_BUDGET)
+    used_tokens = count_tokens("\n".join(header), model_name)
+    included = 0
+    for line in lines:
+        used_tokens += count_tokens(line, model_name) + 1
+        if included and used_tokens > budget:
+            break
+        included += 1
+    return included
+
+
+def fit_plans_to_budget(plans: list, patient_data: dict, model_name: str = None):
+    """
+    Keeps the leading plans whose encoded rows fit the model's plan token budget. Call it on the ranked
+    shortlist before building the prompt, so plan_ids, cache keys and output validation cover exactly the
+    plans the model is shown (the prompt tells it not to omit any).
+
+    Returns:
+    - Tuple of (plans that fit, number of plans left out).
+    """
+    header, lines, _, _ = _plan_table(plans, patient_data)
+    included = _rows_within_budget(header, lines, model_name)
+    if included < len(plans):
+        print(f"✂️ {len(plans) - included} of {len(plans)} plans do not fit the {model_name} prompt budget; ranking the top {included}")
+    return list(plans[:included]), len(plans) - included
+
+
+def encode_plans(plans: list, patient_data: dict, model_name: str = None):
+    """
+    Encodes candidate plans as a compact table for an LLM prompt.
+
+    Keeps only the attributes relevant to the patient, lists values shared by every plan once and
+    emits one '|' separated row per plan. Callers fit the plans to the token budget first
+    (fit_plans_to_budget); trailing plans that still do not fit are dropped and listed in the stats.
+
+    Returns:
+    - Tuple of (encoded text, stats dictionary with token counts and tokens saved).
+    """
+    plans = [dict(plan) for plan in plans]
+    raw_tokens = count_tokens(json.dumps(plans, default=str), model_name)
+
+    header, lines, columns, shared = _plan_table(plans, patient_data)
+    included = _rows_within_budget(header, lines, model_name)
+
+    text = "\n".join(header + lines[:included])
+    encoded_tokens = count_tokens(text, model_name)
+    dropped_plan_ids = [
+        str(next((value for key, value in plan.items() if str(key).lower() == "planid"), None))
+        for plan in plans[included:]
+    ]
+    stats = {
+        "raw_plan_tokens": raw_tokens,
+        "encoded_plan_tokens": encoded_tokens,
+        "tokens_saved": raw_tokens - encoded_tokens,
+        "token_budget": MODEL_PLAN_TOKEN_BUDGETS.get(model_name, DEFAULT_PLAN_TOKEN_BUDGET),
+        "plans_included": included,
+        "plans_dropped": len(lines) - included,
+        "attributes_sent": len(columns),
+        "shared_attributes": len(shared),
+    }
+    if dropped_plan_ids:
+        stats["dropped_plan_ids"] = dropped_plan_ids
+        print(f"⚠️ Plan table for {model_name} over budget after fitting; dropped {', '.join(dropped_plan_ids)}")
+    print(f"🧮 Plan encoding for {model_name}: {raw_tokens} → {encoded_tokens} tokens ({stats['plans_dropped']} plans dropped)")
+    return text, stats
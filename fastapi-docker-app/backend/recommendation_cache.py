@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from local_store import get_sqlite_connection
+
+RECOMMENDATION_CACHE_ENABLED = os.getenv("RECOMMENDATION_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RECOMMENDATION_CACHE_TTL_SECONDS = int(os.getenv("RECOMMENDATION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+RECOMMENDATION_CACHE_MAX_ENTRIES = int(os.getenv("RECOMMENDATION_CACHE_MAX_ENTRIES", "5000"))
+
+
+def canonical_patient_profile(patient_data: dict) -> dict:
+    """
+    Patient profile without its row id, with enums unwrapped and conditions sorted, so equal profiles hash equally.
+    """
+    profile = {}
+    for key, value in patient_data.items():
+        if key == "id":
+            continue
+        value = getattr(value, "value", value)
+        if key == "medical_conditions":
+            value = sorted(value or [])
+        profile[key] = value
+    return profile
+
+
+def recommendation_cache_key(patient_data: dict, plan_ids: list, model_name: str, template_version: str) -> str:
+    payload = json.dumps(
+        {
+            "patient": canonical_patient_profile(patient_data),
+            "plan_ids": sorted(str(plan_id) for plan_id in plan_ids),
+            "model": model_name,
+            "template_version": template_version,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RecommendationCache:
+    """
+    SQLite-backed cache of LLM recommendations with a TTL and least-recently-used eviction.
+    """
+
+    def __init__(self, ttl_seconds=RECOMMENDATION_CACHE_TTL_SECONDS, max_entries=RECOMMENDATION_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = get_sqlite_connection("recommendation_cache")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS recommendations (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS recommendations_last_access ON recommendations (last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM recommendations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM recommendations WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE recommendations SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key, model_name, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO recommendations (key, model, value, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, json.dumps(value, default=str), now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM recommendations WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._conn.execute(
+            """
+            DELETE FROM recommendations WHERE key IN (
+                SELECT key FROM recommendations ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        )
+
+
+recommendation_cache = RecommendationCache() if RECOMMENDATION_CACHE_ENABLED else None
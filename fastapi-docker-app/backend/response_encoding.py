@@ -0,0 +1,227 @@
+import os
+import json
+import gzip
+import time
+import threading
+from datetime import date, datetime, time as time_of_day
+from decimal import Decimal
+from collections import defaultdict, deque
+from pydantic import BaseModel
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from percentiles import percentile
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to the standard library encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional: MessagePack requests are answered with JSON
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # optional: zstd is only offered when installed, gzip otherwise
+    zstandard = None
+
+# Responses smaller than this are sent uncompressed; compressing them costs more than it saves
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "5"))
+RESPONSE_ZSTD_LEVEL = int(os.getenv("RESPONSE_ZSTD_LEVEL", "3"))
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+PLAN_ID_FIELD = "PlanId"
+
+
+def _default(obj):
+    """
+    Encodes the values the fast encoders do not handle natively: Pydantic models, Neo4j nodes, dates, decimals.
+    """
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, (date, datetime, time_of_day)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "items") and hasattr(obj, "keys"):  # neo4j.graph.Node and other mappings
+        return dict(obj.items())
+    if hasattr(obj, "iso_format"):  # neo4j.time types
+        return obj.iso_format()
+    if hasattr(obj, "item"):  # numpy scalars
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+def dumps_json(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with orjson (standard library json when orjson is not installed).
+    """
+
+    def render(self, content) -> bytes:
+        return dumps_json(content)
+
+
+def parse_fields(fields):
+    """
+    Set of plan attributes requested with ?fields=PlanId,PlanType,..., or None for every attribute.
+    PlanId is always kept so clients can match plans across responses.
+    """
+    if not fields:
+        return None
+    selected = {field.strip() for field in fields.split(",") if field.strip()}
+    return selected | {PLAN_ID_FIELD} if selected else None
+
+
+def shape_content(content, fields=None, exclude_none=True):
+    """
+    Converts content to plain dicts and lists. Plans (mappings with a PlanId) lose their None attributes
+    and every attribute not in fields; other mappings keep their keys, so e.g. `summary: null` survives.
+    """
+    if isinstance(content, BaseModel):
+        content = content.model_dump()
+    if isinstance(content, (list, tuple)):
+        return [shape_content(item, fields, exclude_none) for item in content]
+    if isinstance(content, dict) or (hasattr(content, "items") and hasattr(content, "keys")):
+        items = content.items()
+        is_plan = PLAN_ID_FIELD in content
+        strip_none = exclude_none and is_plan
+        project = fields is not None and is_plan
+        return {
+            key: shape_content(value, fields, exclude_none)
+            for key, value in items
+            if not (strip_none and value is None) and not (project and key not in fields)
+        }
+    return content
+
+
+def _accepted(header):
+    # Media types or encodings from an Accept / Accept-Encoding header, without the ones refused with q=0
+    accepted = set()
+    for part in (header or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if name and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            accepted.add(name.strip())
+    return accepted
+
+
+def negotiate_format(accept):
+    if msgpack is not None and _accepted(accept) & set(MSGPACK_MEDIA_TYPES):
+        return "msgpack"
+    return "json"
+
+
+def negotiate_encoding(accept_encoding, size):
+    if size < RESPONSE_COMPRESSION_MIN_BYTES:
+        return "identity"
+    accepted = _accepted(accept_encoding)
+    if zstandard is not None and "zstd" in accepted:
+        return "zstd"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return "identity"
+
+
+def compress(body, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=RESPONSE_ZSTD_LEVEL).compress(body)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL)
+    return body
+
+
+class EncodingStats:
+    """
+    Per-endpoint payload sizes and encode times (shaping, serialization and compression).
+    """
+
+    def __init__(self, history=1000):
+        self._lock = threading.Lock()
+        self._history = history
+        self._endpoints = defaultdict(self._new_endpoint)
+
+    def _new_endpoint(self):
+        return {
+            "responses": 0,
+            "formats": defaultdict(int),
+            "encodings": defaultdict(int),
+            "payload_bytes": deque(maxlen=self._history),
+            "sent_bytes": deque(maxlen=self._history),
+            "encode_ms": deque(maxlen=self._history),
+        }
+
+    def record(self, endpoint, response_format, encoding, payload_bytes, sent_bytes, encode_ms):
+        with self._lock:
+            stats = self._endpoints[endpoint]
+            stats["responses"] += 1
+            stats["formats"][response_format] += 1
+            stats["encodings"][encoding] += 1
+            stats["payload_bytes"].append(payload_bytes)
+            stats["sent_bytes"].append(sent_bytes)
+            stats["encode_ms"].append(encode_ms)
+
+    def report(self):
+        with self._lock:
+            report = {}
+            for endpoint, stats in self._endpoints.items():
+                payload, sent, encode_ms = list(stats["payload_bytes"]), list(stats["sent_bytes"]), list(stats["encode_ms"])
+                report[endpoint] = {
+                    "responses": stats["responses"],
+                    "formats": dict(stats["formats"]),
+                    "encodings": dict(stats["encodings"]),
+                    "payload_bytes": {"p50": percentile(payload, 0.5), "p95": percentile(payload, 0.95)},
+                    "sent_bytes": {"p50": percentile(sent, 0.5), "p95": percentile(sent, 0.95)},
+                    "compression_ratio": round(sum(sent) / sum(payload), 3) if sum(payload) else None,
+                    "encode_ms": {"p50": percentile(encode_ms, 0.5), "p95": percentile(encode_ms, 0.95)},
+                }
+            return {
+                "orjson": orjson is not None,
+                "msgpack": msgpack is not None,
+                "zstd": zstandard is not None,
+                "compression_min_bytes": RESPONSE_COMPRESSION_MIN_BYTES,
+                "endpoints": report,
+            }
+
+
+encoding_stats = EncodingStats()
+
+
+def encoded_response(request, content, endpoint, fields=None, exclude_none=True, status_code=200):
+    """
+    Builds the response for a plan endpoint.
+
+    Parameters:
+    - request: the incoming request; its Accept and Accept-Encoding headers pick MessagePack vs JSON and zstd/gzip
+    - content: the endpoint's result (dicts, lists, Pydantic models or Neo4j nodes)
+    - endpoint: name under which payload size and encode time are recorded
+    - fields: comma-separated plan attributes to keep (None keeps all)
+    - exclude_none: drop null plan attributes
+
+    Returns:
+    - Response with the encoded, possibly compressed body
+    """
+    start = time.perf_counter()
+    content = shape_content(content, parse_fields(fields), exclude_none)
+    response_format = negotiate_format(request.headers.get("accept"))
+    if response_format == "msgpack":
+        body, media_type = msgpack.packb(content, default=_default), MSGPACK_MEDIA_TYPES[0]
+    else:
+        body, media_type = dumps_json(content), "application/json"
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"), len(body))
+    sent = compress(body, encoding)
+    encode_ms = round((time.perf_counter() - start) * 1000, 2)
+    encoding_stats.record(endpoint, response_format, encoding, len(body), len(sent), encode_ms)
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=sent, status_code=status_code, media_type=media_type, headers=headers)
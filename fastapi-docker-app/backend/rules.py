@@ -1,6 +1,55 @@
 import os
-from neo4j_utils import neo4j_driver 
+import json
+import time
+import hashlib
+import threading
+from neo4j_utils import neo4j_driver, graph_write_buffer, GRAPH_MODEL, PLAN_CATALOG_VERSION, COHORT_TTL_SECONDS, NEO4J_GROUP_COMMIT_TIMEOUT_S
+from memory_graph import InMemoryGraph
+from graph_encoding import RULE_EDGE_ENCODING, considers_clause, rule_edge_clause, rule_names_from_mask, plan_content_hash, plan_merge_clause
 from collections import defaultdict
+from concurrent.futures import wait
+from cleanup import NUMERIC_PLAN_ATTRIBUTES
+
+# Plan types and per-type rule medians are catalog-level statistics; they are reused for this long
+# instead of being recomputed by every rule application (0 recomputes them every time). Entries are also
+# keyed on the graph's plan version, so plans added or changed by any worker invalidate them immediately.
+RULE_STATS_TTL_SECONDS = int(os.getenv("RULE_STATS_TTL_SECONDS", "300"))
+
+# Plan attributes each rule filters on; select_rules decides which rules apply to a patient
+RULE_ATTRIBUTES = {
+    "Diabetes": [
+        "SBCHavingDiabetesCoinsurance",
+        "SBCHavingDiabetesDeductible",
+        "SBCHavingDiabetesLimit",
+        "SBCHavingDiabetesCopayment"
+    ],
+    "Maternity": [
+        "SBCHavingaBabyDeductible",
+        "SBCHavingaBabyCoinsurance",
+        "SBCHavingaBabyLimit",
+        "SBCHavingaBabyCopayment"
+    ],
+    "Older_Adults": [
+        "TEHBInnTier1IndividualMOOP",
+        "TEHBDedInnTier1Individual",
+        "TEHBDedInnTier1Coinsurance"
+    ],
+    "Family_Coverage": [
+        "TEHBDedInnTier1FamilyPerPerson",
+        "TEHBDedOutOfNetFamilyPerPerson",
+        "TEHBInnTier1FamilyPerPersonMOOP",
+        "TEHBDedInnTier1FamilyPerGroup",
+        "TEHBInnTier1FamilyPerGroupMOOP"
+    ],
+    "Default": [
+        "TEHBDedInnTier1Individual",
+        "TEHBDedInnTier1Coinsurance",
+        "TEHBInnTier1IndividualMOOP"
+    ],
+}
+
+_rule_stats = {}
+_rule_stats_lock = threading.Lock()
 
 def clean_value(value):
     if isinstance(value, str):  # Only clean strings
@@ -9,23 +58,403 @@ def clean_value(value):
         return float(value)  # Convert to float if possible
     except ValueError:
         return None  # Return None for invalid values
-    
-def apply_dynamic_rule(driver, rule_name, patient_filter, attribute_list):
+
+
+def ensure_graph_indexes(driver):
+    """
+    Creates the lookup indexes the rule and distribution queries rely on.
+    """
+    if isinstance(driver, InMemoryGraph):
+        return
+
+    statements = [
+        "CREATE INDEX patient_id IF NOT EXISTS FOR (p:Patient) ON (p.id)",
+        "CREATE INDEX plan_id IF NOT EXISTS FOR (plan:Plan) ON (plan.PlanId)",
+        "CREATE INDEX cohort_id IF NOT EXISTS FOR (c:Cohort) ON (c.id)",
+        "CREATE INDEX plan_catalog_id IF NOT EXISTS FOR (catalog:PlanCatalog) ON (catalog.id)",
+        "CREATE INDEX plan_type IF NOT EXISTS FOR (plan:Plan) ON (plan.PlanType)",
+    ]
+    # Rule attributes are stored as native floats, so per-type median and threshold filters can seek these
+    statements.extend(
+        f"CREATE RANGE INDEX plan_type_{attr} IF NOT EXISTS FOR (plan:Plan) ON (plan.PlanType, plan.{attr})"
+        for attr in NUMERIC_PLAN_ATTRIBUTES
+    )
+    if RULE_EDGE_ENCODING == "bitmask":
+        statements.append("CREATE INDEX considers_rule_count IF NOT EXISTS FOR ()-[c:CONSIDERS]-() ON (c.rule_count)")
+
+    with driver.session() as session:
+        for statement in statements:
+            session.run(statement)
+
+
+def upsert_patient(driver, patient_data):
+    """
+    Creates or updates the Patient node with the patient's profile.
+    """
+    if isinstance(driver, InMemoryGraph):
+        driver.upsert_patient(patient_data)
+        return
+
+    if graph_write_buffer is not None:
+        wait_for_writes([graph_write_buffer.submit_patient(patient_data)])
+        return
+
+    with driver.session() as session:
+        session.run(
+            """
+            MERGE (p:Patient {id: $id})
+            SET p.name = $name,
+                p.age = $age,
+                p.gender = $gender,
+                p.state = $state,
+                p.occupation = $occupation,
+                p.smoking_status = $smoking_status,
+                p.physical_activity_level = $physical_activity_level,
+                p.medical_conditions = $medical_conditions,
+                p.travel_coverage_needed = $travel_coverage_needed,
+                p.family_coverage = $family_coverage,
+                p.budget_category = $budget_category,
+                p.has_offspring = $has_offspring,
+                p.is_married = $is_married
+            """,
+            id=patient_data["id"],
+            name=patient_data["name"],
+            age=patient_data["age"],
+            gender=patient_data["gender"],
+            state=patient_data["state"],
+            occupation=patient_data["occupation"],
+            smoking_status=patient_data["smoking_status"],
+            physical_activity_level=patient_data["physical_activity_level"],
+            medical_conditions=patient_data["medical_conditions"],
+            travel_coverage_needed=patient_data["travel_coverage_needed"],
+            family_coverage=patient_data["family_coverage"],
+            budget_category=patient_data["budget_category"],
+            has_offspring=patient_data["has_offspring"],
+            is_married=patient_data["is_married"],
+        )
+
+
+def link_considered_plans(driver, subject_id, plans_data, label="Patient"):
+    """
+    Merges each plan node and links it to the patient (or cohort) with a CONSIDERS edge.
+
+    Parameters:
+    - driver: Neo4j driver instance or InMemoryGraph.
+    - subject_id: Id of the Patient or Cohort node considering the plans.
+    - plans_data: List of (plan_id, plan_data) tuples with cleaned plan properties.
+    - label: Label of the subject node ("Patient" or "Cohort").
+    """
+    if isinstance(driver, InMemoryGraph):
+        for plan_id, plan_data in plans_data:
+            driver.link_considered_plan(subject_id, plan_id, plan_data, label=label)
+        return
+
+    if graph_write_buffer is not None:
+        wait_for_writes([
+            graph_write_buffer.submit_considers(subject_id, plan_id, plan_data, label=label)
+            for plan_id, plan_data in plans_data
+        ])
+        return
+
+    with driver.session() as session:
+        for plan_id, plan_data in plans_data:
+            session.run(
+                f"""
+                {plan_merge_clause()}
+                MERGE (p:{label} {{id: $subject_id}})
+                {considers_clause()}
+                """,
+                id=plan_id,
+                plan_data=plan_data,
+                content_hash=plan_content_hash(plan_data),
+                subject_id=subject_id
+            )
+
+
+def plan_graph_version(driver):
+    """
+    graph_plan_version for either backend: the catalog version and the graph's plan content version.
+    """
+    if isinstance(driver, InMemoryGraph):
+        return PLAN_CATALOG_VERSION, driver.plan_version()
+    with driver.session() as session:
+        return graph_plan_version(session)
+
+
+def cohort_key(patient_data, graph_version=None, now=None):
+    """
+    Builds the cohort a patient belongs to: rule outcomes depend on the Snowflake filter criteria, the
+    selected rules and the plans in the graph, because medians are taken over, and rule edges drawn to,
+    every Plan of a type, including plans other patients brought in. Patients sharing the criteria and the
+    graph version (plan_graph_version) share rule edges.
+
+    The version is read before the patient's plans are merged, so the first cohort for new plans is keyed on
+    the smaller graph and the next patient with the same criteria computes it once more; from then on the
+    version is stable and patients reuse that cohort. When other patients add plans, the version moves on
+    and a new cohort is computed over the larger graph, exactly as the per-patient model would. The graph
+    version also moves when a plan's properties are updated in place.
+
+    Plans added in Snowflake never reach the graph while patients hit an existing cohort, so the key also
+    carries a COHORT_TTL_SECONDS time bucket: once it rolls over, the next patient runs the filter again.
+
+    Returns:
+    - Tuple of (cohort_id, cohort properties).
+    """
+    criteria = {
+        "state": patient_data["state"],
+        "budget_category": getattr(patient_data["budget_category"], "value", patient_data["budget_category"]),
+        "travel_coverage_needed": bool(patient_data["travel_coverage_needed"]),
+        "family_coverage": bool(patient_data["family_coverage"]),
+        "has_offspring": bool(patient_data.get("has_offspring", False)),
+        "medical_conditions": sorted(patient_data["medical_conditions"] or []),
+        "rules": [rule["rule_name"] for rule in select_rules(patient_data)],
+    }
+    ttl_bucket = int((time.time() if now is None else now) // COHORT_TTL_SECONDS) if COHORT_TTL_SECONDS > 0 else None
+    payload = json.dumps(
+        {**criteria, "catalog_version": PLAN_CATALOG_VERSION, "graph_version": graph_version, "ttl_bucket": ttl_bucket},
+        sort_keys=True,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16], criteria
+
+
+def link_patient_to_cohort(driver, patient_id, cohort_id, criteria):
+    """
+    Moves the patient into its cohort, creating the Cohort node on first use.
+
+    Returns:
+    - True if the cohort's CONSIDERS and rule edges already exist, False if they still need to be written.
+    """
+    if isinstance(driver, InMemoryGraph):
+        return bool(driver.link_patient_to_cohort(patient_id, cohort_id, criteria, PLAN_CATALOG_VERSION))
+
+    with driver.session() as session:
+        record = session.run(
+            """
+            MATCH (p:Patient {id: $patient_id})
+            OPTIONAL MATCH (p)-[old:IN_COHORT]->(:Cohort)
+            DELETE old
+            WITH DISTINCT p
+            MERGE (c:Cohort {id: $cohort_id})
+            ON CREATE SET c += $criteria, c.catalog_version = $catalog_version, c.materialized = false
+            MERGE (p)-[:IN_COHORT]->(c)
+            RETURN c.materialized AS materialized
+            """,
+            patient_id=patient_id,
+            cohort_id=cohort_id,
+            criteria=criteria,
+            catalog_version=PLAN_CATALOG_VERSION,
+        ).single()
+        return bool(record and record["materialized"])
+
+
+def mark_cohort_materialized(driver, cohort_id):
+    """
+    Flags the cohort as complete so later patients reuse its edges instead of re-running the rules.
+    """
+    if isinstance(driver, InMemoryGraph):
+        driver.mark_cohort_materialized(cohort_id)
+        return
+
+    with driver.session() as session:
+        session.run("MATCH (c:Cohort {id: $cohort_id}) SET c.materialized = true", cohort_id=cohort_id)
+
+
+def get_cohort_rule_results(driver, cohort_id):
+    """
+    Reads a materialized cohort's rule edges back in the shape returned by apply_selected_rules.
+    """
+    if isinstance(driver, InMemoryGraph):
+        rows = driver.subject_rule_plans(cohort_id, label="Cohort")
+    elif RULE_EDGE_ENCODING == "bitmask":
+        with driver.session() as session:
+            result = session.run(
+                """
+                MATCH (c:Cohort {id: $cohort_id})-[e:CONSIDERS]->(plan:Plan)
+                WHERE e.rule_count > 0
+                RETURN e.rule_mask AS rule_mask, plan
+                """,
+                cohort_id=cohort_id,
+            )
+            rows = [
+                (rule_name, dict(record["plan"]))
+                for record in result
+                for rule_name in rule_names_from_mask(record["rule_mask"])
+            ]
+    else:
+        with driver.session() as session:
+            result = session.run(
+                """
+                MATCH (c:Cohort {id: $cohort_id})-[r]->(plan:Plan)
+                WHERE type(r) <> 'CONSIDERS'
+                RETURN type(r) AS rule_name, plan
+                """,
+                cohort_id=cohort_id,
+            )
+            rows = [(record["rule_name"], dict(record["plan"])) for record in result]
+
+    results = {}
+    for rule_name, plan in rows:
+        results.setdefault(rule_name, {"patient": None, "plans": []})["plans"].append(plan)
+    return results if results else None
+
+
+def subject_match():
+    """
+    Cypher pattern binding `p` to the node whose edges describe the patient's plans.
+    """
+    if GRAPH_MODEL == "cohort":
+        return "(:Patient {id: $patient_id})-[:IN_COHORT]->(p:Cohort)"
+    return "(p:Patient {id: $patient_id})"
+
+
+def memory_subject(graph, patient_id):
+    """
+    (subject_id, label) of the node holding the patient's plan edges in the embedded graph.
+    """
+    if GRAPH_MODEL == "cohort":
+        return graph.cohort_of(patient_id), "Cohort"
+    return patient_id, "Patient"
+
+
+def wait_for_writes(futures):
+    """
+    Blocks until every buffered write has committed, re-raising the first failure.
+    Raises TimeoutError after NEO4J_GROUP_COMMIT_TIMEOUT_S; the writes may still commit later.
+    """
+    _, not_done = wait(futures, timeout=NEO4J_GROUP_COMMIT_TIMEOUT_S)
+    if not_done:
+        raise TimeoutError(f"{len(not_done)} of {len(futures)} buffered graph writes did not commit within {NEO4J_GROUP_COMMIT_TIMEOUT_S}s")
+    for future in futures:
+        future.result()
+
+
+def apply_dynamic_rule_in_memory(graph, rule_name, subject_id, attribute_list, label="Patient"):
+    """
+    In-memory equivalent of apply_dynamic_rule for the embedded graph backend.
+    """
+    plan_types = graph.plan_types()
+    if not plan_types:
+        print("⚠ No plan types found. Skipping rule.")
+        return None
+
+    all_results = {"patient": graph.get_node(subject_id, label), "plans": []}
+    for plan_type in plan_types:
+        medians = graph.rule_medians(plan_type, attribute_list)
+        print(f"Computed medians for {plan_type}: {medians}")
+        if not medians:
+            print(f"⚠ No median values computed for plan type {plan_type} in {rule_name}. Skipping this type.")
+            continue
+
+        all_results["plans"].extend(graph.apply_rule(rule_name, subject_id, plan_type, medians, label=label))
+
+    return all_results if all_results["plans"] else None
+
+
+def graph_plan_version(session):
+    """
+    Version of the Plan nodes the rule statistics are computed over: the catalog version and the PlanCatalog
+    node's counter, which plan_merge_clause bumps whenever a merged plan is new or its properties changed.
+    Reading it is a single-node lookup, and re-merging unchanged plans leaves it alone.
+    """
+    record = session.run("OPTIONAL MATCH (catalog:PlanCatalog {id: 'plans'}) RETURN catalog.version AS version").single()
+    return PLAN_CATALOG_VERSION, (record["version"] or 0) if record else 0
+
+
+def cached_rule_stat(key, version, compute):
+    """
+    Returns compute() through the RULE_STATS_TTL_SECONDS cache. An entry is only reused while the graph
+    is at the version it was computed for; empty results are not cached, so an empty graph at startup does
+    not hide plans loaded later.
+    """
+    if RULE_STATS_TTL_SECONDS <= 0:
+        return compute()
+    now = time.time()
+    with _rule_stats_lock:
+        entry = _rule_stats.get(key)
+    if entry is not None and entry[1] == version and now - entry[0] < RULE_STATS_TTL_SECONDS:
+        return entry[2]
+    value = compute()
+    if value:
+        with _rule_stats_lock:
+            _rule_stats[key] = (now, version, value)
+    return value
+
+
+def graph_plan_types(session, version):
+    """
+    Distinct plan types in the graph at version (see graph_plan_version).
+    """
+    def compute():
+        result = session.run("MATCH (plan:Plan) RETURN DISTINCT plan.PlanType AS plan_type")
+        return [record["plan_type"] for record in result if record["plan_type"]]
+
+    return cached_rule_stat(("plan_types",), version, compute)
+
+
+def graph_rule_medians(session, version, plan_type, attribute_list):
+    """
+    Medians of the rule attributes over plans of the type that have all of them, or None without such plans.
+    """
+    def compute():
+        attribute_conditions = " AND ".join(
+            [f"plan.{attr} IS NOT NULL" for attr in attribute_list]
+        )
+        stats_query = f"""
+        MATCH (plan:Plan)
+        WHERE plan.PlanType = $plan_type
+        AND {attribute_conditions}
+        RETURN 
+            {", ".join([f"percentileCont(plan.{attr}, 0.5) AS median_{attr}" for attr in attribute_list])}
+        """
+        stats_result = session.run(stats_query, plan_type=plan_type).single()
+        if not stats_result:
+            return None
+        return {attr: stats_result[f"median_{attr}"] for attr in attribute_list if stats_result[f"median_{attr}"] is not None}
+
+    return cached_rule_stat(("medians", plan_type, tuple(attribute_list)), version, compute)
+
+
+def preload_rule_statistics(driver):
+    """
+    Computes the plan types and every rule's medians ahead of the first patient.
+
+    Returns:
+    - Dictionary with the number of plan types and of (rule, plan type) median sets loaded.
+    """
+    if isinstance(driver, InMemoryGraph):
+        plan_types = driver.plan_types()
+        return {"plan_types": len(plan_types), "median_sets": 0}
+
+    with driver.session() as session:
+        version = graph_plan_version(session)
+        plan_types = graph_plan_types(session, version)
+        median_sets = sum(
+            1
+            for attribute_list in RULE_ATTRIBUTES.values()
+            for plan_type in plan_types
+            if graph_rule_medians(session, version, plan_type, attribute_list)
+        )
+    return {"plan_types": len(plan_types), "median_sets": median_sets}
+
+
+def apply_dynamic_rule(driver, rule_name, subject_id, attribute_list, label="Patient"):
     """
     Applies a dynamic rule for filtering insurance plans in Neo4j, ensuring balanced filtering across plan types.
 
     Parameters:
-    - driver: Neo4j driver instance.
+    - driver: Neo4j driver instance or InMemoryGraph.
     - rule_name: Name of the rule (e.g., "Diabetes", "Maternity").
-    - patient_filter: Condition to match patients (e.g., age > 50, has diabetes).
+    - subject_id: Id of the Patient (or Cohort) node the rule edges start from.
     - attribute_list: List of plan attributes to filter on (e.g., deductible, coinsurance).
+    - label: Label of the subject node ("Patient" or "Cohort").
     """
+    if isinstance(driver, InMemoryGraph):
+        return apply_dynamic_rule_in_memory(driver, rule_name, subject_id, attribute_list, label=label)
 
     with driver.session() as session:
-        # Step 1: Get distinct plan types
-        plan_types_query = "MATCH (plan:Plan) RETURN DISTINCT plan.PlanType AS plan_type"
-        plan_types_result = session.run(plan_types_query)
-        plan_types = [record["plan_type"] for record in plan_types_result if record["plan_type"]]
+        # Step 1: Get distinct plan types (after this request's plans were merged, so the version covers them)
+        version = graph_plan_version(session)
+        plan_types = graph_plan_types(session, version)
 
         if not plan_types:
             print("⚠ No plan types found. Skipping rule.")
@@ -33,137 +462,102 @@ def apply_dynamic_rule(driver, rule_name, patient_filter, attribute_list):
 
         # Step 2: Process each plan type independently
         all_results = {"patient": None, "plans": []}
+        pending_writes = []
         for plan_type in plan_types:
-            # Build dynamic query for stats
-            attribute_conditions = " AND ".join(
-                [f"plan.{attr} IS NOT NULL" for attr in attribute_list]
-            )
-            stats_query = f"""
-            MATCH (plan:Plan)
-            WHERE plan.PlanType = '{plan_type}'
-            AND {attribute_conditions}
-            RETURN 
-                {", ".join([f"percentileCont(toFloat(plan.{attr}), 0.5) AS median_{attr}" for attr in attribute_list])}
-            """
-
-            stats_result = session.run(stats_query).single()
-            if not stats_result:
+            medians = graph_rule_medians(session, version, plan_type, attribute_list)
+            if medians is None:
                 print(f"⚠ No valid stats found for plan type {plan_type} in {rule_name}. Skipping this type.")
                 continue
 
-            # Extract computed statistics
-            medians = {attr: stats_result[f"median_{attr}"] for attr in attribute_list if stats_result[f"median_{attr}"] is not None}
             print(f"Computed medians for {plan_type}: {medians}")
             if not medians:
                 print(f"⚠ No median values computed for plan type {plan_type} in {rule_name}. Skipping this type.")
                 continue
 
             filter_conditions = " AND ".join(
-                [f"toFloat(plan.{attr}) <= ${attr}" for attr in medians]
+                [f"plan.{attr} <= ${attr}" for attr in medians]
             )
             print(f"Filter conditions for {plan_type}: {filter_conditions}")
+            relationship = rule_name.replace(" ", "_").upper()
+            # With group commit the edges are written by the buffer, so the query only reads the matches
+            merge_clause = "" if graph_write_buffer is not None else rule_edge_clause(relationship)
             query = f"""
-            MATCH (p:Patient), (plan:Plan)
-            WHERE plan.PlanType = '{plan_type}'
-            AND {patient_filter}
+            MATCH (p:{label}), (plan:Plan)
+            WHERE plan.PlanType = $plan_type
+            AND p.id = $subject_id
             AND {filter_conditions}
-            MERGE (p)-[:{rule_name.replace(" ", "_").upper()}]->(plan)
+            {merge_clause}
             RETURN p AS patient, plan
             """
 
             # Run query for this plan type
-            result = session.run(query, **medians)
+            result = session.run(query, subject_id=subject_id, plan_type=plan_type, **medians)
 
             # Collect results
             for record in result:
                 if all_results["patient"] is None:
                     all_results["patient"] = {key: record["patient"][key] for key in record["patient"].keys()}
                 all_results["plans"].append({key: record["plan"][key] for key in record["plan"].keys()})
+                if graph_write_buffer is not None:
+                    pending_writes.append(graph_write_buffer.submit_rule_edge(relationship, subject_id, record["plan"]["PlanId"], label=label))
 
+        wait_for_writes(pending_writes)
         return all_results if all_results["plans"] else None
 
 
-def apply_selected_rules(driver, patient):
+def select_rules(patient):
     """
-    Applies Neo4j filtering rules dynamically based on patient demographics.
-    
-    Parameters:
-    - driver: Neo4j driver instance.
-    - patient: Patient dictionary containing demographic details.
-    
+    Picks the rules that apply to the patient based on demographics.
+
     Returns:
-    - Dictionary containing applied rules and their matched plans.
+    - List of dictionaries with the rule name and the plan attributes it filters on.
     """
     selected_rules = []
 
     # Rule 1: Diabetes-Specific Plans
     if "Diabetes" in patient["medical_conditions"]:
-        selected_rules.append({
-            "rule_name": "Diabetes",
-            "patient_filter": f"p.id = {patient['id']}",
-            "attribute_list": [
-                "SBCHavingDiabetesCoinsurance",
-                "SBCHavingDiabetesDeductible",
-                "SBCHavingDiabetesLimit",
-                "SBCHavingDiabetesCopayment"
-            ]
-        })
+        selected_rules.append({"rule_name": "Diabetes", "attribute_list": list(RULE_ATTRIBUTES["Diabetes"])})
 
     # Rule 2: Maternity Plans
     if patient["gender"].lower() == "female" and 18 <= patient["age"] <= 45:
-        selected_rules.append({
-            "rule_name": "Maternity",
-            "patient_filter": f"p.id = {patient['id']}",
-            "attribute_list": [
-                "SBCHavingaBabyDeductible",
-                "SBCHavingaBabyCoinsurance",
-                "SBCHavingaBabyLimit",
-                "SBCHavingaBabyCopayment"
-            ]
-        })
+        selected_rules.append({"rule_name": "Maternity", "attribute_list": list(RULE_ATTRIBUTES["Maternity"])})
 
     # Rule 3: Older Adults
     if patient["age"] >= 50:
-        selected_rules.append({
-            "rule_name": "Older_Adults",
-            "patient_filter": f"p.id = {patient['id']}",
-            "attribute_list": [
-                "TEHBInnTier1IndividualMOOP",
-                "TEHBDedInnTier1Individual",
-                "TEHBDedInnTier1Coinsurance"
-            ]
-        })
+        selected_rules.append({"rule_name": "Older_Adults", "attribute_list": list(RULE_ATTRIBUTES["Older_Adults"])})
 
     # Rule 4: Family Coverage
     if patient["family_coverage"]:
-        selected_rules.append({
-            "rule_name": "Family_Coverage",
-            "patient_filter": f"p.id = {patient['id']}",
-            "attribute_list": [
-                "TEHBDedInnTier1FamilyPerPerson",
-                "TEHBDedOutOfNetFamilyPerPerson",
-                "TEHBInnTier1FamilyPerPersonMOOP",
-                "TEHBDedInnTier1FamilyPerGroup",
-                "TEHBInnTier1FamilyPerGroupMOOP"
-            ]
-        })
+        selected_rules.append({"rule_name": "Family_Coverage", "attribute_list": list(RULE_ATTRIBUTES["Family_Coverage"])})
 
     # Rule 5: Default (General Filtering)
     if not selected_rules:
-        selected_rules.append({
-            "rule_name": "Default",
-            "patient_filter": f"p.id = {patient['id']}",
-            "attribute_list": [
-                "TEHBDedInnTier1Individual",
-                "TEHBDedInnTier1Coinsurance",
-                "TEHBInnTier1IndividualMOOP"
-            ]
-        })
+        selected_rules.append({"rule_name": "Default", "attribute_list": list(RULE_ATTRIBUTES["Default"])})
+
+    return selected_rules
+
+
+def apply_selected_rules(driver, patient, subject_id=None, label="Patient"):
+    """
+    Applies Neo4j filtering rules dynamically based on patient demographics.
+    
+    Parameters:
+    - driver: Neo4j driver instance or InMemoryGraph.
+    - patient: Patient dictionary containing demographic details.
+    - subject_id: Node the rule edges start from; defaults to the patient's own node.
+    - label: Label of the subject node ("Patient" or "Cohort").
+    
+    Returns:
+    - Dictionary containing applied rules and their matched plans.
+    """
+    selected_rules = select_rules(patient)
+    if subject_id is None:
+        subject_id = patient["id"]
 
     print(f"Selected rules: {selected_rules}")
     results = {}
     for rule in selected_rules:
-        rule_result = apply_dynamic_rule(driver, **rule)
+        rule_result = apply_dynamic_rule(driver, subject_id=subject_id, label=label, **rule)
         if rule_result:
             results[rule["rule_name"]] = rule_result
 
@@ -174,73 +568,137 @@ def get_plan_distribution(driver, patient_id):
     Get the distribution of how many rules are satisfied by each plan for a given patient.
     For each rule count, also return summary of which rule combinations exist.
     """
+    if isinstance(driver, InMemoryGraph):
+        records = [
+            {"plan_id": plan_id, "plan_type": plan_type, "rule_name": rule_name}
+            for plan_id, plan_type, rule_name in driver.subject_plan_edges(*memory_subject(driver, patient_id))
+        ]
+        return summarize_plan_distribution(records)
+
+    if RULE_EDGE_ENCODING == "bitmask":
+        with driver.session() as session:
+            result = session.run(
+                f"""
+                MATCH {subject_match()}-[c:CONSIDERS]->(plan:Plan)
+                RETURN plan.PlanType AS plan_type, c.rule_mask AS rule_mask
+                """,
+                patient_id=patient_id,
+            )
+            return summarize_rule_masks(result)
+
     with driver.session() as session:
-        query = """
-        MATCH (p:Patient)-[r]->(plan:Plan)
-        WHERE p.id = $patient_id
+        query = f"""
+        MATCH {subject_match()}-[r]->(plan:Plan)
         RETURN plan.PlanId AS plan_id, 
                plan.PlanType AS plan_type, 
                type(r) AS rule_name
         """
 
         result = session.run(query, patient_id=patient_id)
+        return summarize_plan_distribution(result)
+
+
+def summarize_rule_masks(result):
+    """
+    Bitmask counterpart of summarize_plan_distribution: groups (plan_type, rule_mask) rows, one per plan,
+    by mask so each distinct rule set is decoded and popcounted once.
+    """
+    mask_counts = defaultdict(int)
+    mask_type_counts = defaultdict(lambda: defaultdict(int))
+    for record in result:
+        rule_mask = record["rule_mask"] or 0
+        mask_counts[rule_mask] += 1
+        mask_type_counts[rule_mask][record.get("plan_type", "Unknown")] += 1
+
+    if not mask_counts:
+        return {}, {}, 0
+
+    plan_distribution = {}
+    for rule_mask, count in mask_counts.items():
+        rules = sorted(rule_names_from_mask(rule_mask))
+        entry = plan_distribution.setdefault(len(rules), {"count": 0, "rule_sets_summary": []})
+        entry["count"] += count
+        entry["rule_sets_summary"].append({"rules": rules, "count": count})
+
+    highest_rule_count = max(plan_distribution.keys())
+
+    plan_type_distribution = {}
+    for rule_mask, type_counts in mask_type_counts.items():
+        if bin(rule_mask).count("1") == highest_rule_count:
+            for plan_type, count in type_counts.items():
+                plan_type_distribution[plan_type] = plan_type_distribution.get(plan_type, 0) + count
 
-        # Step 1: Collect rule names per plan
-        plan_details = {}
-        for record in result:
-            try:
-                plan_id = record["plan_id"]
-                plan_type = record.get("plan_type", "Unknown")
-                rule_name = record["rule_name"]
-                if plan_id not in plan_details:
-                    plan_details[plan_id] = {
-                        "plan_type": plan_type,
-                        "rule_names": set()
-                    }
-                if rule_name != "CONSIDERS":
-                    plan_details[plan_id]["rule_names"].add(rule_name)
-
-            except KeyError as e:
-                print(f"⚠️ Skipping record due to missing field: {e}")
-
-        if not plan_details:
-            return {}, {}, 0
-
-        # Step 2: Group plans by rule count and rule set
-        rule_count_to_rule_sets = defaultdict(list)
-        for details in plan_details.values():
-            rules = tuple(sorted(details["rule_names"]))
-            rule_count = len(rules)
-            rule_count_to_rule_sets[rule_count].append(rules)
-
-        # Step 3: Aggregate into summarized format
-        plan_distribution = {}
-        for rule_count, rule_sets in rule_count_to_rule_sets.items():
-            summary = defaultdict(int)
-            for rule_set in rule_sets:
-                summary[rule_set] += 1
-
-            plan_distribution[rule_count] = {
-                "count": len(rule_sets),  # total plans with this rule count
-                "rule_sets_summary": [
-                    {
-                        "rules": list(rule_set),
-                        "count": count
-                    } for rule_set, count in summary.items()
-                ]
-            }
-
-        # Step 4: Find highest rule count
-        highest_rule_count = max(plan_distribution.keys())
-
-        # Step 5: Compute plan type distribution for highest rule count
-        plan_type_distribution = {}
-        for plan_id, details in plan_details.items():
-            if len(details["rule_names"]) == highest_rule_count:
-                plan_type = details["plan_type"]
-                plan_type_distribution[plan_type] = plan_type_distribution.get(plan_type, 0) + 1
-
-        return plan_distribution, plan_type_distribution, highest_rule_count
+    return plan_distribution, plan_type_distribution, highest_rule_count
+
+
+def summarize_plan_distribution(result):
+    """
+    Groups (plan_id, plan_type, rule_name) rows into the rule-count distribution returned by get_plan_distribution.
+    """
+    # Step 1: Collect rule names per plan
+    plan_details = {}
+    for record in result:
+        try:
+            plan_id = record["plan_id"]
+            plan_type = record.get("plan_type", "Unknown")
+            rule_name = record["rule_name"]
+            if plan_id not in plan_details:
+                plan_details[plan_id] = {
+                    "plan_type": plan_type,
+                    "rule_names": set()
+                }
+            if rule_name != "CONSIDERS":
+                plan_details[plan_id]["rule_names"].add(rule_name)
+
+        except KeyError as e:
+            print(f"⚠️ Skipping record due to missing field: {e}")
+
+    if not plan_details:
+        return {}, {}, 0
+
+    # Step 2: Group plans by rule count and rule set
+    rule_count_to_rule_sets = defaultdict(list)
+    for details in plan_details.values():
+        rules = tuple(sorted(details["rule_names"]))
+        rule_count = len(rules)
+        rule_count_to_rule_sets[rule_count].append(rules)
+
+    # Step 3: Aggregate into summarized format
+    plan_distribution = {}
+    for rule_count, rule_sets in rule_count_to_rule_sets.items():
+        summary = defaultdict(int)
+        for rule_set in rule_sets:
+            summary[rule_set] += 1
+
+        plan_distribution[rule_count] = {
+            "count": len(rule_sets),  # total plans with this rule count
+            "rule_sets_summary": [
+                {
+                    "rules": list(rule_set),
+                    "count": count
+                } for rule_set, count in summary.items()
+            ]
+        }
+
+    # Step 4: Find highest rule count
+    highest_rule_count = max(plan_distribution.keys())
+
+    # Step 5: Compute plan type distribution for highest rule count
+    plan_type_distribution = {}
+    for plan_id, details in plan_details.items():
+        if len(details["rule_names"]) == highest_rule_count:
+            plan_type = details["plan_type"]
+            plan_type_distribution[plan_type] = plan_type_distribution.get(plan_type, 0) + 1
+
+    return plan_distribution, plan_type_distribution, highest_rule_count
+
+
+# The typed queries count every relationship, CONSIDERS included, so a considered plan's edge count
+# is its rule count plus one; the bitmask filter keeps that meaning on the indexed rule_count
+BITMASK_RELATIONSHIP_COUNT_FILTER = """(
+                    (c.considered AND c.rule_count = $highest_rule_count - 1)
+                    OR (NOT c.considered AND c.rule_count = $highest_rule_count)
+                )"""
 
 
 def get_plans_by_type_from_neo4j(driver, patient_id, plan_type, highest_rule_count):
@@ -248,12 +706,28 @@ def get_plans_by_type_from_neo4j(driver, patient_id, plan_type, highest_rule_cou
     Queries Neo4j to get all plans of the specified plan type for the given patient, but only those plans
     that satisfy the highest number of rules.
     """
+    if isinstance(driver, InMemoryGraph):
+        subject_id, label = memory_subject(driver, patient_id)
+        return driver.plans_with_relationship_count(subject_id, plan_type, highest_rule_count, label=label)
+
+    if RULE_EDGE_ENCODING == "bitmask":
+        with driver.session() as session:
+            result = session.run(
+                f"""
+                MATCH {subject_match()}-[c:CONSIDERS]->(plan:Plan)
+                WHERE plan.PlanType = $plan_type
+                AND {BITMASK_RELATIONSHIP_COUNT_FILTER}
+                RETURN plan
+                """,
+                patient_id=patient_id, plan_type=plan_type, highest_rule_count=highest_rule_count
+            )
+            return [record["plan"] for record in result]
+
     with driver.session() as session:
         # Fetch plans of the selected plan type for the given patient and rule count
-        query = """
-            MATCH (p:Patient)-[r]->(plan:Plan)
-            WHERE p.id = $patient_id
-            AND plan.PlanType = $plan_type
+        query = f"""
+            MATCH {subject_match()}-[r]->(plan:Plan)
+            WHERE plan.PlanType = $plan_type
             WITH plan, COUNT(r) AS rule_count
             WHERE rule_count = $highest_rule_count
             RETURN plan
@@ -271,11 +745,30 @@ def get_plan_ids_from_neo4j(driver, patient_id, plan_type, highest_rule_count):
     """
     Queries Neo4j to get the list of PlanIds that match the highest rule count for the given patient and plan type.
     """
+    if isinstance(driver, InMemoryGraph):
+        subject_id, label = memory_subject(driver, patient_id)
+        return [
+            plan["PlanId"]
+            for plan in driver.plans_with_relationship_count(subject_id, plan_type, highest_rule_count, label=label)
+        ]
+
+    if RULE_EDGE_ENCODING == "bitmask":
+        with driver.session() as session:
+            result = session.run(
+                f"""
+                MATCH {subject_match()}-[c:CONSIDERS]->(plan:Plan)
+                WHERE plan.PlanType = $plan_type
+                AND {BITMASK_RELATIONSHIP_COUNT_FILTER}
+                RETURN plan.PlanId AS PlanId
+                """,
+                patient_id=patient_id, plan_type=plan_type, highest_rule_count=highest_rule_count
+            )
+            return [record["PlanId"] for record in result]
+
     with driver.session() as session:
-        query = """
-            MATCH (p:Patient)-[r]->(plan:Plan)
-            WHERE p.id = $patient_id
-            AND plan.PlanType = $plan_type
+        query = f"""
+            MATCH {subject_match()}-[r]->(plan:Plan)
+            WHERE plan.PlanType = $plan_type
             WITH plan.PlanId AS PlanId, COUNT(r) AS rule_count
             WHERE rule_count = $highest_rule_count
             RETURN PlanId
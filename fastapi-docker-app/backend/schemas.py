@@ -1,10 +1,7 @@
 # schemas.py
-from pydantic import BaseModel, Field
-from typing import Optional, Any, List
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import Optional, Any, List, Union, Literal
 from enum import Enum
-import pandas as pd
-
-df = pd.read_csv("cleaned_plans_data.csv")  # Replace with your cleaned file path
 
 # Enums for controlled values
 class PhysicalActivityLevel(str, Enum):
@@ -160,4 +157,57 @@ class InsurancePlan(BaseModel):
         from_attributes = True
 
 class PatientID(BaseModel):
-    patient_id: int
\ No newline at end of file
+    patient_id: int
+
+class BatchRecommendationRequest(BaseModel):
+    patient_ids: List[int]
+    model_name: str
+    plan_type: Optional[str] = None  # defaults to each patient's plan type with the most qualifying plans
+    bypass_cache: bool = False
+
+# "single" ranks the shortlist in one prompt, "map_reduce" ranks every candidate in chunks (OpenAI models only),
+# "auto" picks map-reduce for large candidate sets
+RankingMode = Literal["single", "map_reduce", "auto"]
+
+class AdviseRequest(BaseModel):
+    profile: Optional[PatientCreate] = None  # creates the patient once plans are known to exist for it
+    patient_id: Optional[int] = None  # or reuses an existing patient, e.g. when retrying with another plan type
+    plan_type: Optional[str] = None  # defaults to the plan type with the most qualifying plans
+    model_name: Optional[str] = None  # without a model the pipeline stops after selecting the plans
+    bypass_cache: bool = False
+    ranking_mode: RankingMode = "single"
+
+    @model_validator(mode="after")
+    def one_patient(self):
+        if (self.profile is None) == (self.patient_id is None):
+            raise ValueError("Give either profile or patient_id")
+        return self
+
+# Validated LLM output, shared by the OpenAI and Cortex paths
+class RecommendedPlan(BaseModel):
+    rank: int
+    PlanId: str
+    PlanMarketingName: Optional[str] = None
+    IssuerName: Optional[str] = None
+    MetalLevel: Optional[str] = None
+    Deductible: Optional[str] = None
+    MaxOutOfPocket: Optional[str] = None
+    TotalScore: Optional[Union[int, float]] = None
+    ScoreExplanation: Optional[str] = None
+    Justification: Optional[str] = None
+
+    class Config:
+        extra = "allow"  # keep extra model fields such as ScoreBreakdown
+
+    # Models sometimes emit numbers for the string fields (e.g. a numeric deductible)
+    @field_validator("PlanId", "PlanMarketingName", "IssuerName", "MetalLevel", "Deductible", "MaxOutOfPocket",
+                     "ScoreExplanation", "Justification", mode="before")
+    @classmethod
+    def as_text(cls, value):
+        if value is None or isinstance(value, str):
+            return value
+        return str(value)
+
+class RecommendationResult(BaseModel):
+    recommended_plans: List[RecommendedPlan] = []
+    summary: Optional[str] = None
@@ -0,0 +1,210 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from local_store import get_sqlite_connection
+from neo4j_utils import PLAN_CATALOG_VERSION
+from prompt_encoder import occupation_risk_class
+from rules import select_rules
+from llm_output import extract_recommended_plans
+
+SEGMENT_CACHE_ENABLED = os.getenv("SEGMENT_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+SEGMENT_CACHE_TTL_SECONDS = int(os.getenv("SEGMENT_CACHE_TTL_SECONDS", str(24 * 3600)))
+SEGMENT_CACHE_AGE_BAND_YEARS = int(os.getenv("SEGMENT_CACHE_AGE_BAND_YEARS", "10"))
+# A segment's ranking is recomputed after serving this many patients, so it does not drift too far from fresh answers
+SEGMENT_CACHE_MAX_USES = int(os.getenv("SEGMENT_CACHE_MAX_USES", "200"))
+
+
+def segment_profile(patient_data: dict) -> dict:
+    """
+    The coarse profile patients in one segment share: age band, gender, state, metal level, conditions,
+    coverage flags, occupation risk class and the rules those select.
+    """
+    age = patient_data.get("age") or 0
+    band_start = age - age % SEGMENT_CACHE_AGE_BAND_YEARS
+    return {
+        "age_band": f"{band_start}-{band_start + SEGMENT_CACHE_AGE_BAND_YEARS - 1}",
+        "gender": (patient_data.get("gender") or "").lower(),
+        "state": patient_data.get("state"),
+        "budget_category": getattr(patient_data.get("budget_category"), "value", patient_data.get("budget_category")),
+        "medical_conditions": sorted(patient_data.get("medical_conditions") or []),
+        "travel_coverage_needed": bool(patient_data.get("travel_coverage_needed")),
+        "family_coverage": bool(patient_data.get("family_coverage")),
+        "has_offspring": bool(patient_data.get("has_offspring")),
+        "occupation_risk": occupation_risk_class(patient_data.get("occupation")),
+        # Age bands can straddle a rule's age limit, so the selected rules are part of the segment too
+        "rules": [rule["rule_name"] for rule in select_rules(patient_data)],
+    }
+
+
+def segment_cache_key(patient_data: dict, plan_type: str, model_name: str, template_version: str) -> str:
+    payload = json.dumps(
+        {
+            "segment": segment_profile(patient_data),
+            "plan_type": plan_type,
+            "model": model_name,
+            "catalog_version": PLAN_CATALOG_VERSION,
+            "template_version": template_version,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _personal_fields(patient_data: dict) -> dict:
+    return {key: patient_data.get(key) for key in ("name", "age", "occupation")}
+
+
+# Free-text fields written about the patient; ids, plan names and numbers are never rewritten
+NARRATIVE_FIELDS = ("summary", "ScoreExplanation", "Justification")
+# Names or occupations shorter than this ("Al", "RN") are left alone: they match inside too many ordinary words
+MIN_REPLACEMENT_CHARS = 3
+
+
+def _whole_word(text: str):
+    return re.compile(rf"(?<!\w){re.escape(text)}(?!\w)", re.IGNORECASE)
+
+
+def render_for_patient(value, source: dict, patient_data: dict):
+    """
+    Rewrites the source patient's name, occupation and age in the ranking's narrative fields (NARRATIVE_FIELDS)
+    so they read as written for this patient. Only whole words are replaced.
+
+    Returns:
+    - The rendered ranking, or None when the source patient's name is too short to replace safely and appears
+      in the text, so another patient's name is never served.
+    """
+    replacements, unsafe = [], []
+    for key in ("name", "occupation"):
+        old, new = source.get(key), patient_data.get(key)
+        if not old or not new or old == new:
+            continue
+        if len(str(old).strip()) >= MIN_REPLACEMENT_CHARS:
+            replacements.append((_whole_word(str(old).strip()), str(new)))
+        elif key == "name":
+            unsafe.append(re.compile(rf"(?<!\w){re.escape(str(old).strip())}(?!\w)"))
+    old_age, new_age = source.get("age"), patient_data.get("age")
+    if old_age is not None and new_age is not None and old_age != new_age:
+        replacements.append((re.compile(rf"\b{old_age}(?=[- ](?:year|yr))"), str(new_age)))
+
+    def rewrite(text):
+        for pattern, new in replacements:
+            text = pattern.sub(lambda _: new, text)
+        return text
+
+    def leaks(item):
+        if isinstance(item, dict):
+            return any(
+                any(pattern.search(val) for pattern in unsafe) if key in NARRATIVE_FIELDS and isinstance(val, str) else leaks(val)
+                for key, val in item.items()
+            )
+        if isinstance(item, list):
+            return any(leaks(val) for val in item)
+        return False
+
+    def render(item):
+        if isinstance(item, dict):
+            return {
+                key: rewrite(val) if key in NARRATIVE_FIELDS and isinstance(val, str) else render(val)
+                for key, val in item.items()
+            }
+        if isinstance(item, list):
+            return [render(val) for val in item]
+        return item
+
+    if isinstance(value, str):
+        # OpenAI responses are JSON text; render the decoded document so replacements cannot break the JSON
+        try:
+            document = json.loads(value)
+        except json.JSONDecodeError:
+            return None if unsafe else value
+        return None if leaks(document) else json.dumps(render(document))
+    return None if leaks(value) else render(value)
+
+
+class SegmentCache:
+    """
+    SQLite-backed cache of LLM rankings per (segment, plan type, model, catalog version, prompt version).
+
+    A ranking computed for one patient is served to later patients of the same segment, with the patient-specific
+    text re-rendered, as long as it is younger than the TTL, has been served fewer than max_uses times and
+    every recommended plan is among the new patient's candidates.
+    """
+
+    def __init__(self, ttl_seconds=SEGMENT_CACHE_TTL_SECONDS, max_uses=SEGMENT_CACHE_MAX_USES):
+        self.ttl_seconds = ttl_seconds
+        self.max_uses = max_uses
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._conn = get_sqlite_connection("segment_cache")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS segment_rankings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                value TEXT NOT NULL,
+                source TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                uses INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, key, patient_data, candidate_plan_ids):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, source, created_at, uses FROM segment_rankings WHERE key = ?", (key,)
+            ).fetchone()
+            value = None
+            if row is not None and now - row[2] <= self.ttl_seconds and row[3] < self.max_uses:
+                value = json.loads(row[0])
+                recommended = extract_recommended_plans(value) or []
+                candidates = {str(plan_id) for plan_id in candidate_plan_ids}
+                if not recommended or any(str(plan.get("PlanId")) not in candidates for plan in recommended):
+                    value = None
+            if value is None:
+                self._misses += 1
+                return None
+            rendered = render_for_patient(value, json.loads(row[1]), patient_data)
+            if rendered is None:
+                self._misses += 1
+                return None
+            self._conn.execute("UPDATE segment_rankings SET uses = uses + 1 WHERE key = ?", (key,))
+            self._conn.commit()
+            self._hits += 1
+        return rendered
+
+    def set(self, key, model_name, value, patient_data):
+        if not extract_recommended_plans(value):
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO segment_rankings (key, model, value, source, created_at, uses) VALUES (?, ?, ?, ?, ?, 0)",
+                (key, model_name, json.dumps(value, default=str), json.dumps(_personal_fields(patient_data), default=str), now),
+            )
+            self._conn.execute("DELETE FROM segment_rankings WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            entries = self._conn.execute("SELECT COUNT(*) FROM segment_rankings").fetchone()[0]
+            return {
+                "enabled": True,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else None,
+                "entries": entries,
+                "ttl_seconds": self.ttl_seconds,
+                "max_uses": self.max_uses,
+                "age_band_years": SEGMENT_CACHE_AGE_BAND_YEARS,
+            }
+
+
+segment_cache = SegmentCache() if SEGMENT_CACHE_ENABLED else None
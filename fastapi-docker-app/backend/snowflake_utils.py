@@ -1,11 +1,18 @@
-import snowflake.connector
 import os
 import re
+import queue
+import threading
 from datetime import date
 from pydantic import BaseModel
 from typing import List, Dict
+from tracing import span, truncate_statement
+
+# Idle connections kept open between requests (0 opens a new connection per call, as before)
+SNOWFLAKE_POOL_SIZE = int(os.getenv("SNOWFLAKE_POOL_SIZE", "4"))
+
+def connect_snowflake():
+    import snowflake.connector  # imported on first connection, not at startup
 
-def get_snowflake_connection():
     conn = snowflake.connector.connect(
         user=os.getenv("SNOWFLAKE_USER"),
         password=os.getenv("SNOWFLAKE_PASSWORD"),
@@ -18,6 +25,133 @@ def get_snowflake_connection():
     return conn
 
 
+class TracedCursor:
+    """
+    Snowflake cursor whose execute / executemany calls are recorded as "snowflake" spans with their query id.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _traced(self, method, command, *args, **kwargs):
+        with span("snowflake", f"snowflake.{method}", **{"db.system": "snowflake", "db.statement": truncate_statement(command)}) as s:
+            result = getattr(self._cursor, method)(command, *args, **kwargs)
+            s.set("snowflake.query_id", getattr(self._cursor, "sfqid", None))
+            s.set("db.rows", self._cursor.rowcount)
+        return self if result is self._cursor else result
+
+    def execute(self, command, *args, **kwargs):
+        return self._traced("execute", command, *args, **kwargs)
+
+    def executemany(self, command, *args, **kwargs):
+        return self._traced("executemany", command, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TracedConnection:
+    """
+    Snowflake connection whose cursors are traced.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return TracedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class PooledConnection(TracedConnection):
+    """
+    Snowflake connection borrowed from the pool; close() hands it back instead of logging out,
+    so callers keep the usual connect / cursor / close pattern.
+    """
+
+    def __init__(self, pool, conn):
+        super().__init__(conn)
+        self._pool = pool
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+
+class SnowflakeConnectionPool:
+    """
+    Keeps up to max_idle authenticated Snowflake sessions open, so requests skip the login round trips.
+    Idle connections that were closed by the server are dropped and replaced on checkout.
+    """
+
+    def __init__(self, max_idle=SNOWFLAKE_POOL_SIZE):
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._counts = {"opened": 0, "reused": 0, "discarded": 0}
+
+    def acquire(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if not conn.is_closed():
+                with self._lock:
+                    self._counts["reused"] += 1
+                return conn
+            with self._lock:
+                self._counts["discarded"] += 1
+        conn = connect_snowflake()
+        with self._lock:
+            self._counts["opened"] += 1
+        return conn
+
+    def release(self, conn):
+        if conn.is_closed() or self._idle.qsize() >= self.max_idle:
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    def warm(self, size=None):
+        """
+        Opens connections until size are idle and checks each with SELECT 1.
+
+        Returns:
+        - Number of idle connections after warming.
+        """
+        size = self.max_idle if size is None else min(size, self.max_idle)
+        conns = [self.acquire() for _ in range(max(0, size - self._idle.qsize()))]
+        try:
+            for conn in conns:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute("SELECT 1")
+                    cursor.fetchone()
+                finally:
+                    cursor.close()
+        finally:
+            for conn in conns:
+                self.release(conn)
+        return self._idle.qsize()
+
+    def stats(self):
+        with self._lock:
+            return {"max_idle": self.max_idle, "idle": self._idle.qsize(), **self._counts}
+
+
+snowflake_pool = SnowflakeConnectionPool() if SNOWFLAKE_POOL_SIZE > 0 else None
+
+
+def get_snowflake_connection():
+    if snowflake_pool is None:
+        return TracedConnection(connect_snowflake())
+    return PooledConnection(snowflake_pool, snowflake_pool.acquire())
+
+
 def convert_to_pydantic_case(snake_str: str) -> str:
     """
     Converts UPPERCASE_SNAKE_CASE to PascalCase for Pydantic field matching.
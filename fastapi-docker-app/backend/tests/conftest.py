@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+
+# The backend is a flat set of modules run from its own directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tests run against the embedded graph and never reach Postgres, Snowflake, Neo4j or OpenAI
+_state_dir = tempfile.mkdtemp(prefix="intellihealth-tests-")
+os.environ["GRAPH_BACKEND"] = "memory"
+os.environ.setdefault("LOCAL_STATE_DIR", _state_dir)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_state_dir, 'test.db')}")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("WARMUP_ENABLED", "false")
+
+import pytest
+
+import local_store
+from memory_graph import InMemoryGraph
+
+
+@pytest.fixture
+def graph():
+    return InMemoryGraph()
+
+
+@pytest.fixture
+def state_dir(tmp_path, monkeypatch):
+    """
+    Fresh LOCAL_STATE_DIR, so SQLite-backed caches and queues created in a test start empty.
+    """
+    monkeypatch.setattr(local_store, "LOCAL_STATE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def make_patient(patient_id, **overrides):
+    patient = {
+        "id": patient_id,
+        "name": f"Patient {patient_id}",
+        "age": 30,
+        "gender": "Male",
+        "state": "TX",
+        "occupation": "Engineer",
+        "smoking_status": "Non-smoker",
+        "physical_activity_level": "Moderate",
+        "medical_conditions": [],
+        "travel_coverage_needed": False,
+        "family_coverage": False,
+        "budget_category": "Medium",
+        "has_offspring": False,
+        "is_married": False,
+    }
+    patient.update(overrides)
+    return patient
+
+
+def make_plan(plan_id, plan_type="HMO", **attributes):
+    return {"PlanId": plan_id, "PlanType": plan_type, **attributes}
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from starlette.requests import Request
+
+import admission
+import app
+import rules
+from admission import BoundedExecutor, Overloaded
+from conftest import make_patient
+from test_cohorts import fake_filter_plans
+
+
+def plain_request():
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": [], "query_string": b""})
+
+
+def test_full_lane_answers_503_with_retry_after():
+    lane = BoundedExecutor("test", workers=1, queue_limit=1)
+    release = threading.Event()
+    running = [lane.submit(release.wait), lane.submit(release.wait)]
+
+    with pytest.raises(Overloaded) as overloaded:
+        lane.submit(release.wait)
+    release.set()
+    for future in running:
+        future.result(timeout=5)
+
+    response = asyncio.run(app.overloaded_handler(plain_request(), overloaded.value))
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(admission.OVERLOAD_RETRY_AFTER_S)
+    assert json.loads(response.body)["lane"] == "test"
+    assert lane.stats()["rejected"] == 1
+
+
+def test_stream_is_bounded_and_stops_when_the_client_leaves(monkeypatch):
+    monkeypatch.setattr(admission, "STREAM_BUFFER_ITEMS", 4)
+    lane = BoundedExecutor("test", workers=1, queue_limit=0)
+    produced, closed = [], threading.Event()
+
+    def generate():
+        try:
+            for i in range(1000):
+                produced.append(i)
+                yield i
+        finally:
+            closed.set()
+
+    async def read_three():
+        items = lane.stream(generate)
+        received = [await items.__anext__() for _ in range(3)]
+        await asyncio.sleep(0.2)
+        await items.aclose()
+        return received
+
+    assert asyncio.run(read_three()) == [0, 1, 2]
+    assert closed.wait(timeout=5)
+    # Three items read, four buffered ahead and the one that was waiting for a slot
+    assert len(produced) <= 3 + 4 + 1
+    deadline = time.time() + 5
+    while lane.stats()["active"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert lane.stats()["active"] == 0
+
+
+class RecordingLane:
+    def __init__(self, name, calls):
+        self.name = name
+        self.calls = calls
+
+    async def run(self, fn, *args, **kwargs):
+        self.calls.append((self.name, fn.__name__))
+        return fn(*args, **kwargs)
+
+
+def test_cohort_hits_skip_the_snowflake_lane(monkeypatch, graph):
+    calls = []
+    monkeypatch.setattr(app, "neo4j_driver", graph)
+    monkeypatch.setattr(app, "GRAPH_MODEL", "cohort")
+    monkeypatch.setattr(rules, "GRAPH_MODEL", "cohort")
+    monkeypatch.setattr(rules, "COHORT_TTL_SECONDS", 0)
+    monkeypatch.setattr(app, "filter_plans", fake_filter_plans)
+    monkeypatch.setattr(app, "load_patient_data", lambda patient_id, db: make_patient(patient_id))
+    monkeypatch.setattr(app, "neo4j_lane", RecordingLane("neo4j", calls))
+    monkeypatch.setattr(app, "snowflake_lane", RecordingLane("snowflake", calls))
+
+    def process(patient_id):
+        calls.clear()
+        response = asyncio.run(app.process_plans(plain_request(), patient_id, db=None))
+        return json.loads(response.body), [name for name, _ in calls]
+
+    # The first two patients build the cohort (see test_cohorts); the third reuses it
+    for patient_id in (1, 2):
+        _, lanes = process(patient_id)
+        assert lanes == ["neo4j", "snowflake", "neo4j"]
+    result, lanes = process(3)
+    assert lanes == ["neo4j", "neo4j"]
+    assert result["preferred_plans"]
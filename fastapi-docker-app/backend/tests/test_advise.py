@@ -0,0 +1,88 @@
+import pytest
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+import app
+from conftest import make_patient
+from schemas import AdviseRequest
+from test_cohorts import fake_filter_plans
+
+PROFILE = {
+    "name": "Pat", "age": 30, "gender": "Male", "state": "TX", "physical_activity_level": "moderate",
+    "budget_category": "Silver", "has_offspring": False, "is_married": False,
+}
+
+
+class RecordingSession:
+    """
+    Stands in for the SQLAlchemy session advise_plans stores new patients with.
+    """
+
+    def __init__(self):
+        self.added = []
+
+    def add(self, patient):
+        self.added.append(patient)
+
+    def commit(self):
+        pass
+
+    def refresh(self, patient):
+        patient.id = len(self.added)
+
+
+@pytest.fixture
+def advise(monkeypatch, graph):
+    monkeypatch.setattr(app, "neo4j_driver", graph)
+    monkeypatch.setattr(app, "filter_plans", fake_filter_plans)
+    db = RecordingSession()
+    return db, lambda **request: app.advise_plans(AdviseRequest(**request), db)
+
+
+@pytest.mark.parametrize("request_fields, detail", [
+    ({"profile": {**PROFILE, "state": "NY"}}, "No plans found for the given criteria"),
+    ({"profile": PROFILE, "plan_type": "PPO"}, "No plans found for the given type"),
+])
+def test_no_patient_is_stored_without_plans(monkeypatch, advise, request_fields, detail):
+    db, run = advise
+    monkeypatch.setattr(app, "filter_plans", lambda patient_data: fake_filter_plans(patient_data) if patient_data["state"] == "TX" else {"plans": []})
+
+    with pytest.raises(HTTPException) as error:
+        run(**request_fields)
+
+    assert error.value.status_code == 404
+    assert error.value.detail == detail
+    assert db.added == []
+
+
+def test_new_patient_is_stored_and_processed(advise):
+    db, run = advise
+    advice = run(profile=PROFILE)
+
+    assert len(db.added) == 1
+    assert advice["patient"]["id"] == 1
+    assert advice["selected_plan_type"] == "HMO"
+    assert advice["processed_plans"]["preferred_plans"]
+
+
+def test_existing_patient_is_reused(monkeypatch, advise):
+    db, run = advise
+    monkeypatch.setattr(app, "load_patient_data", lambda patient_id, db: make_patient(patient_id))
+
+    advice = run(patient_id=7)
+
+    assert db.added == []
+    assert advice["patient"]["id"] == 7
+
+
+@pytest.mark.parametrize("request_fields", [{}, {"profile": PROFILE, "patient_id": 1}, {"patient_id": 1, "ranking_mode": "fast"}])
+def test_advise_request_validation(request_fields):
+    with pytest.raises(ValidationError):
+        AdviseRequest(**request_fields)
+
+
+def test_ranking_mode_is_an_enum_in_the_api():
+    schema = app.app.openapi()
+    for path in ("/recommend-insurance/", "/jobs/recommend-insurance/"):
+        parameters = {parameter["name"]: parameter["schema"] for parameter in schema["paths"][path]["post"]["parameters"]}
+        assert parameters["ranking_mode"]["enum"] == ["single", "map_reduce", "auto"]
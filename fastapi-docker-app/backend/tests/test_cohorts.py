@@ -0,0 +1,104 @@
+import pytest
+
+import app
+import rules
+from conftest import make_patient, make_plan
+from memory_graph import InMemoryGraph
+
+TX_PLANS = [
+    make_plan(f"TX{i}", TEHBDedInnTier1Individual=f"${deductible:,}", TEHBDedInnTier1Coinsurance=f"{coinsurance}%",
+              TEHBInnTier1IndividualMOOP=f"${moop:,}")
+    for i, (deductible, coinsurance, moop) in enumerate([(1000, 10, 4000), (2000, 20, 5000), (3000, 30, 6000),
+                                                         (4000, 40, 7000), (5000, 50, 8000)])
+]
+# Cheaper plans of the same type, brought in by a patient from another state; they move the HMO medians
+CA_PLANS = [
+    make_plan(f"CA{i}", TEHBDedInnTier1Individual=str(100 * (i + 1)), TEHBDedInnTier1Coinsurance="5%",
+              TEHBInnTier1IndividualMOOP=str(1000 * (i + 1)))
+    for i in range(4)
+]
+
+
+def fake_filter_plans(patient_data):
+    return {"plans": [dict(plan) for plan in (TX_PLANS if patient_data["state"] == "TX" else CA_PLANS)]}
+
+
+def run_patients(monkeypatch, graph_model, patients):
+    graph = InMemoryGraph()
+    monkeypatch.setattr(app, "neo4j_driver", graph)
+    monkeypatch.setattr(app, "GRAPH_MODEL", graph_model)
+    monkeypatch.setattr(rules, "GRAPH_MODEL", graph_model)
+    monkeypatch.setattr(rules, "COHORT_TTL_SECONDS", 0)
+    monkeypatch.setattr(app, "filter_plans", fake_filter_plans)
+    results = {}
+    for patient in patients:
+        result = app.process_patient_plans(dict(patient))
+        results[patient["id"]] = (
+            result["preferred_plans_count"],
+            sorted(plan["PlanId"] for plan in result["preferred_plans"]),
+            rules.get_plan_distribution(graph, patient["id"]),
+        )
+    return graph, results
+
+
+def test_cohort_key_changes_with_graph_version():
+    patient = make_patient(1)
+    assert rules.cohort_key(patient, ("v1", 5)) == rules.cohort_key(make_patient(2), ("v1", 5))
+    assert rules.cohort_key(patient, ("v1", 5))[0] != rules.cohort_key(patient, ("v1", 9))[0]
+
+
+def test_cohort_key_expires_after_ttl(monkeypatch):
+    patient = make_patient(1)
+    monkeypatch.setattr(rules, "COHORT_TTL_SECONDS", 3600)
+    assert rules.cohort_key(patient, ("v1", 5), now=10) == rules.cohort_key(patient, ("v1", 5), now=3500)
+    assert rules.cohort_key(patient, ("v1", 5), now=10) != rules.cohort_key(patient, ("v1", 5), now=3700)
+    monkeypatch.setattr(rules, "COHORT_TTL_SECONDS", 0)
+    assert rules.cohort_key(patient, ("v1", 5), now=10) == rules.cohort_key(patient, ("v1", 5), now=10 ** 9)
+
+
+@pytest.mark.parametrize("order", [["tx1", "ca", "tx2"], ["tx1", "tx2", "ca", "tx3", "tx4"]])
+def test_cohort_model_matches_per_patient_model(monkeypatch, order):
+    patients = {
+        "tx1": make_patient(1), "tx2": make_patient(2), "tx3": make_patient(3), "tx4": make_patient(4),
+        "ca": make_patient(10, state="CA"),
+    }
+    sequence = [patients[name] for name in order]
+
+    _, per_patient = run_patients(monkeypatch, "patient", sequence)
+    graph, per_cohort = run_patients(monkeypatch, "cohort", sequence)
+
+    assert per_cohort == per_patient
+    # Patients that joined after the CA plans changed the medians must not reuse the cohort built before them
+    late_tx = [p["id"] for p in sequence[order.index("ca") + 1:]]
+    assert all(graph.cohort_of(patient_id) != graph.cohort_of(1) for patient_id in late_tx)
+
+
+def test_cohort_reused_while_graph_unchanged(monkeypatch):
+    graph, results = run_patients(monkeypatch, "cohort", [make_patient(i) for i in (1, 2, 3, 4)])
+
+    # The first patient's cohort is keyed on the graph before its plans were merged; after that the version is stable
+    assert graph.cohort_of(1) != graph.cohort_of(2)
+    assert graph.cohort_of(2) == graph.cohort_of(3) == graph.cohort_of(4)
+    assert results[2] == results[3] == results[4]
+
+
+def test_cohort_rebuilt_when_plan_updated_in_place(monkeypatch):
+    graph, results = run_patients(monkeypatch, "cohort", [make_patient(i) for i in (1, 2)])
+    plan_count, version = len(graph.plans), rules.plan_graph_version(graph)
+    assert "TX4" not in results[2][1]
+
+    # Re-merging unchanged plans keeps the version, so cohorts stay reusable
+    app.process_patient_plans(make_patient(3, travel_coverage_needed=True))
+    assert rules.plan_graph_version(graph) == version
+
+    # Snowflake now has the most expensive plan as the cheapest; a patient in another cohort merges it
+    repriced = [dict(plan) for plan in TX_PLANS]
+    repriced[4].update(TEHBDedInnTier1Individual="$500", TEHBDedInnTier1Coinsurance="5%", TEHBInnTier1IndividualMOOP="$2,000")
+    monkeypatch.setattr(app, "filter_plans", lambda patient_data: {"plans": [dict(plan) for plan in repriced]})
+    app.process_patient_plans(make_patient(4, state="NY"))
+    assert len(graph.plans) == plan_count
+    assert rules.plan_graph_version(graph) != version
+
+    result = app.process_patient_plans(make_patient(5))
+    assert graph.cohort_of(5) != graph.cohort_of(2)
+    assert "TX4" in [plan["PlanId"] for plan in result["preferred_plans"]]
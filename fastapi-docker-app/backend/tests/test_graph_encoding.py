@@ -0,0 +1,70 @@
+from itertools import combinations
+
+import rules
+from conftest import make_patient, make_plan
+from graph_encoding import RULE_BITS, rule_names_from_mask
+
+# Diabetes and Older_Adults each pass three of the five plans, and the two sets only partly overlap
+PLANS = [
+    make_plan(f"H{i}", **{attr: float(cost) for attr in rules.RULE_ATTRIBUTES["Default"]},
+              **{attr: float(diabetes) for attr in rules.RULE_ATTRIBUTES["Diabetes"]})
+    for i, (cost, diabetes) in enumerate([(1, 5), (2, 1), (3, 2), (4, 3), (5, 4)])
+]
+
+
+def normalized(distribution):
+    plan_distribution, plan_type_distribution, highest_rule_count = distribution
+    return (
+        {
+            count: (entry["count"], sorted((tuple(s["rules"]), s["count"]) for s in entry["rule_sets_summary"]))
+            for count, entry in plan_distribution.items()
+        },
+        plan_type_distribution,
+        highest_rule_count,
+    )
+
+
+def test_summarize_rule_masks_matches_typed_distribution(graph):
+    patient = make_patient(1, medical_conditions=["Diabetes"], age=55)
+    rules.upsert_patient(graph, patient)
+    rules.link_considered_plans(graph, 1, [(plan["PlanId"], dict(plan)) for plan in PLANS])
+    rules.apply_selected_rules(graph, patient)
+    masks = {}
+    for plan_id, plan_type, relationship in graph.subject_plan_edges(1):
+        mask = masks.setdefault(plan_id, {"plan_type": plan_type, "rule_mask": 0})
+        mask["rule_mask"] |= RULE_BITS.get(relationship, 0)
+
+    assert rules.get_plan_distribution(graph, 1)[2] == 2
+    assert normalized(rules.summarize_rule_masks(masks.values())) == normalized(rules.get_plan_distribution(graph, 1))
+
+
+def test_summarize_rule_masks():
+    rows = [
+        {"plan_type": "HMO", "rule_mask": RULE_BITS["DIABETES"] | RULE_BITS["OLDER_ADULTS"]},
+        {"plan_type": "PPO", "rule_mask": RULE_BITS["OLDER_ADULTS"] | RULE_BITS["DIABETES"]},
+        {"plan_type": "HMO", "rule_mask": RULE_BITS["DEFAULT"]},
+        {"plan_type": "EPO", "rule_mask": None},
+    ]
+    plan_distribution, plan_type_distribution, highest_rule_count = normalized(rules.summarize_rule_masks(rows))
+
+    assert highest_rule_count == 2
+    assert plan_distribution == {
+        2: (2, [(("DIABETES", "OLDER_ADULTS"), 2)]),
+        1: (1, [(("DEFAULT",), 1)]),
+        0: (1, [((), 1)]),
+    }
+    assert plan_type_distribution == {"HMO": 1, "PPO": 1}
+    assert rules.summarize_rule_masks([]) == ({}, {}, 0)
+
+
+def test_rule_masks_round_trip():
+    assert sorted(RULE_BITS.values()) == [1 << i for i in range(len(RULE_BITS))]
+    assert {rule.replace(" ", "_").upper() for rule in rules.RULE_ATTRIBUTES} <= set(RULE_BITS)
+
+    for size in range(len(RULE_BITS) + 1):
+        for names in combinations(RULE_BITS, size):
+            mask = sum(RULE_BITS[name] for name in names)
+            assert rule_names_from_mask(mask) == list(names)
+            for name, bit in RULE_BITS.items():
+                # The has_rule test rule_edge_clause runs in Cypher, which has no bitwise operators
+                assert (mask % (bit * 2) >= bit) == (name in names)
@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+import rules
+from graph_writer import GraphWriteBuffer
+from percentiles import percentile
+
+
+class BlockingDriver:
+    """
+    Driver whose write transactions wait until release is set, so tests control when flushes finish.
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.flushing = threading.Event()
+        self.batches = []
+
+    def session(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute_write(self, fn, grouped):
+        self.flushing.set()
+        self.release.wait(5)
+        self.batches.append(grouped)
+
+
+def test_close_flushes_queued_writes():
+    driver = BlockingDriver()
+    driver.release.set()
+    buffer = GraphWriteBuffer(driver, max_delay=0.01)
+    futures = [buffer.submit_patient({"id": i}) for i in range(3)]
+    buffer.close()
+    assert all(future.result(timeout=1) is None for future in futures)
+
+
+def test_writes_after_close_or_stuck_flush_fail_instead_of_hanging():
+    driver = BlockingDriver()
+    buffer = GraphWriteBuffer(driver, max_delay=0.01)
+    in_flight = buffer.submit_patient({"id": 1})
+    assert driver.flushing.wait(1)
+    queued = buffer.submit_patient({"id": 2})
+
+    buffer.close(timeout=0.05)
+    late = buffer.submit_patient({"id": 3})
+
+    assert isinstance(queued.exception(timeout=1), RuntimeError)
+    assert isinstance(late.exception(timeout=1), RuntimeError)
+    driver.release.set()
+    assert in_flight.result(timeout=1) is None
+
+
+def test_wait_for_writes_times_out(monkeypatch):
+    driver = BlockingDriver()
+    buffer = GraphWriteBuffer(driver, max_delay=0.01)
+    monkeypatch.setattr(rules, "NEO4J_GROUP_COMMIT_TIMEOUT_S", 0.05)
+    with pytest.raises(TimeoutError):
+        rules.wait_for_writes([buffer.submit_patient({"id": 1})])
+    driver.release.set()
+    buffer.close()
+
+
+def test_percentile():
+    assert percentile([], 0.5) is None
+    assert percentile([3, 1, 2], 0.5) == 2
+    assert percentile(list(range(1, 101)), 0.95) == 95
+    assert percentile([5], 0.99) == 5
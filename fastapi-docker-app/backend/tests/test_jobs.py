@@ -0,0 +1,106 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+import app
+import jobs
+
+
+@pytest.fixture
+def queue(state_dir):
+    job_queue = jobs.JobQueue(workers=2)
+    job_queue.register("echo", lambda params, job: params)
+    yield job_queue
+    job_queue.close()
+
+
+def dead_owner():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return f"{socket.gethostname()}:{process.pid}"
+
+
+def live_owner():
+    return f"{socket.gethostname()}:{os.getppid()}"
+
+
+def insert_job(queue, job_id, status, owner):
+    queue._conn.execute(
+        "INSERT INTO jobs (id, kind, params, status, stages, owner, created_at) VALUES (?, 'echo', '{}', ?, '[]', ?, ?)",
+        (job_id, status, owner, time.time()),
+    )
+    queue._conn.commit()
+
+
+def wait_finished(queue, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in jobs.FINISHED_STATUSES:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_submitted_job_runs_and_is_owned_by_this_process(queue):
+    job_id = queue.submit("echo", {"x": 1})
+    assert wait_finished(queue, job_id)["result"] == {"x": 1}
+    owner = queue._conn.execute("SELECT owner FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    assert owner == jobs.process_id()
+
+
+def test_resume_only_touches_jobs_of_dead_processes(queue):
+    dead, live = dead_owner(), live_owner()
+    insert_job(queue, "running-dead", "running", dead)
+    insert_job(queue, "running-live", "running", live)
+    insert_job(queue, "running-legacy", "running", None)
+    insert_job(queue, "queued-dead", "queued", dead)
+    insert_job(queue, "queued-live", "queued", live)
+
+    queue.resume()
+
+    assert queue.get("running-dead")["status"] == "failed"
+    assert queue.get("running-legacy")["status"] == "failed"
+    assert queue.get("running-live")["status"] == "running"
+    assert wait_finished(queue, "queued-dead")["status"] == "succeeded"
+    assert queue.get("queued-live")["status"] == "queued"
+
+
+def test_job_adopted_by_another_process_is_not_run(queue):
+    insert_job(queue, "adopted", "queued", live_owner())
+    # e.g. submitted here, then adopted by another worker that saw this process as dead
+    queue._run("adopted")
+    assert queue.get("adopted")["status"] == "queued"
+
+
+
+def test_job_events_stream_without_blocking_the_event_loop(queue, monkeypatch):
+    queue.register("slow", lambda params, job: time.sleep(0.8) or params)
+    monkeypatch.setattr(app, "job_queue", queue)
+    job_id = queue.submit("slow", {"x": 1})
+
+    async def stream_and_tick():
+        response = await app.job_events(job_id)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.05)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        events = [event async for event in response.body_iterator]
+        task.cancel()
+        return events, ticks
+
+    events, ticks = asyncio.run(stream_and_tick())
+
+    assert '"status": "succeeded"' in events[-1]
+    # The loop kept serving other coroutines while the stream waited on the job
+    assert ticks >= 5
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from llm_output import (
+    INVALID_OUTPUT_ERROR,
+    normalize_recommendation,
+    repair_truncated_json,
+)
+
+PLANS = [
+    {"rank": 1, "PlanId": "11111TX0010001", "PlanMarketingName": "Gold {Plus}", "TotalScore": 91,
+     "Justification": "Low deductible, \"great\" for diabetes care"},
+    {"rank": 2, "PlanId": "22222TX0020002", "PlanMarketingName": "Silver", "TotalScore": 84},
+    {"rank": 3, "PlanId": "33333TX0030003", "PlanMarketingName": "Bronze", "TotalScore": 70},
+]
+PLAN_IDS = [plan["PlanId"] for plan in PLANS]
+DOCUMENT = json.dumps({"recommended_plans": PLANS, "summary": "Three plans fit the budget."})
+
+
+def test_repair_keeps_complete_documents_followed_by_prose():
+    assert repair_truncated_json(DOCUMENT + "\nLet me know if you need more.") == json.loads(DOCUMENT)
+    assert repair_truncated_json("no json here") is None
+
+
+def test_repair_closes_brackets_after_the_last_complete_plan():
+    cut = DOCUMENT.index('{"rank": 3')
+    repaired = repair_truncated_json(DOCUMENT[:cut])
+    assert repaired == {"recommended_plans": PLANS[:2]}
+
+
+def test_repair_drops_strings_cut_before_their_closing_quote():
+    cut = DOCUMENT.index("22222TX") + 7
+    repaired = repair_truncated_json(DOCUMENT[:cut])
+    plan_ids = [plan.get("PlanId") for plan in repaired["recommended_plans"]]
+    assert "22222TX" not in plan_ids
+    assert plan_ids[0] == PLANS[0]["PlanId"]
+
+
+def test_repair_never_invents_plan_ids_at_any_cut():
+    for cut in range(1, len(DOCUMENT)):
+        repaired = repair_truncated_json(DOCUMENT[:cut])
+        for plan in (repaired or {}).get("recommended_plans") or []:
+            if isinstance(plan, dict) and "PlanId" in plan:
+                assert plan["PlanId"] in PLAN_IDS, DOCUMENT[:cut]
+
+
+def test_normalize_recommendation_validates_and_orders_by_rank():
+    response = json.dumps({"recommended_plans": [PLANS[2], PLANS[0], {"PlanId": "no rank"}], "summary": "ok"})
+    result = normalize_recommendation(response)
+
+    assert [plan["PlanId"] for plan in result["recommended_plans"]] == [PLANS[0]["PlanId"], PLANS[2]["PlanId"]]
+    assert result["summary"] == "ok"
+    assert result["dropped_plans"] == 1
+    assert result["repaired"] is False
+    assert "error" not in result
+
+
+def test_normalize_recommendation_maps_cortex_field_names():
+    response = {"structured_output": [{"raw_message": {"recommended_plans": [
+        {"Rank": 1, "plan_id": 12345, "Issuer": "Acme", "Score": "88.5", "MOOP": 6000},
+    ]}}]}
+    plan = normalize_recommendation(response)["recommended_plans"][0]
+
+    assert plan == {"rank": 1, "PlanId": "12345", "IssuerName": "Acme", "TotalScore": 88.5, "MaxOutOfPocket": "6000"}
+
+
+def test_normalize_recommendation_rejects_plans_outside_the_candidates():
+    response = json.dumps({"recommended_plans": PLANS + [{"rank": 4, "PlanId": "99999TX0000000"}]})
+    result = normalize_recommendation(response, plan_ids=PLAN_IDS)
+
+    assert [plan["PlanId"] for plan in result["recommended_plans"]] == PLAN_IDS
+    assert result["dropped_plans"] == 1
+
+
+def test_normalize_recommendation_repairs_truncated_output():
+    result = normalize_recommendation({"raw_output": DOCUMENT[:DOCUMENT.index('{"rank": 3')]}, plan_ids=PLAN_IDS)
+
+    assert [plan["PlanId"] for plan in result["recommended_plans"]] == PLAN_IDS[:2]
+    assert result["repaired"] is True
+
+
+def test_normalize_recommendation_reports_unusable_output():
+    result = normalize_recommendation("I cannot help with that.")
+    assert result["recommended_plans"] == []
+    assert result["error"] == INVALID_OUTPUT_ERROR
+    assert result["raw_output"] == "I cannot help with that."
+
+    provider_error = {"error": "rate limited"}
+    assert normalize_recommendation(provider_error) is provider_error
+
+
+def test_normalize_recommendation_is_idempotent():
+    once = normalize_recommendation(DOCUMENT, plan_ids=PLAN_IDS)
+    assert normalize_recommendation(once, plan_ids=PLAN_IDS) == once
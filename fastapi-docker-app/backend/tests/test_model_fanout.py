@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+import model_fanout
+from model_fanout import fanout_recommendations
+
+PLAN_IDS = ["P1", "P2"]
+VALID = {"recommended_plans": [{"rank": 1, "PlanId": "P1"}], "summary": "P1 fits."}
+
+
+@pytest.fixture
+def models(monkeypatch):
+    """
+    Scripted models: name -> (seconds until the answer, answer). gpt-* names go through the OpenAI path.
+    """
+    script = {}
+    calls = []
+
+    def answer(model_name):
+        calls.append(model_name)
+        delay, response = script[model_name]
+        time.sleep(delay)
+        return response
+
+    monkeypatch.setattr(model_fanout, "call_chatgpt_structured", lambda patient, plans, model_name, stats: answer(model_name))
+    monkeypatch.setattr(model_fanout, "execute_cortex_query", lambda patient, plan_ids, model_name, stats: answer(model_name))
+    monkeypatch.setattr(model_fanout, "FANOUT_HEDGE_DELAY_MS", 100)
+    return script, calls
+
+
+def run(primary, others, mode="first"):
+    return fanout_recommendations({"id": 1}, [], PLAN_IDS, primary, models=others, mode=mode)
+
+
+def test_fast_primary_wins_without_calling_the_others(models):
+    script, calls = models
+    script.update({"gpt-4o": (0, VALID), "mistral-large2": (0, VALID)})
+
+    result = run("gpt-4o", ["mistral-large2"])
+
+    assert result["winner"] == "gpt-4o"
+    assert result["recommendations"]["recommended_plans"][0]["PlanId"] == "P1"
+    assert result["models"]["mistral-large2"] == {"outcome": "not_started"}
+    assert calls == ["gpt-4o"]
+
+
+def test_slow_primary_is_hedged_and_the_loser_is_not_awaited(models):
+    script, _ = models
+    script.update({"gpt-4o": (1.0, VALID), "mistral-large2": (0, VALID)})
+
+    start = time.perf_counter()
+    result = run("gpt-4o", ["mistral-large2"])
+
+    assert time.perf_counter() - start < 0.9
+    assert result["winner"] == "mistral-large2"
+    assert result["models"]["gpt-4o"] == {"outcome": "pending"}
+    assert result["models"]["mistral-large2"]["outcome"] == "valid"
+
+
+def test_unusable_primary_answer_launches_the_others_before_the_hedge_delay(models, monkeypatch):
+    script, calls = models
+    monkeypatch.setattr(model_fanout, "FANOUT_HEDGE_DELAY_MS", 5000)
+    script.update({"gpt-4o": (0, "I cannot rank these plans."), "claude-3-5-sonnet": (0, VALID)})
+
+    start = time.perf_counter()
+    result = run("gpt-4o", ["claude-3-5-sonnet"])
+
+    assert time.perf_counter() - start < 1
+    assert result["winner"] == "claude-3-5-sonnet"
+    assert result["models"]["gpt-4o"]["outcome"] == "invalid"
+    assert calls == ["gpt-4o", "claude-3-5-sonnet"]
+
+
+def test_all_mode_waits_for_every_model(models):
+    script, _ = models
+    script.update({"gpt-4o": (0.2, VALID), "mistral-large2": (0, {"error": "Cortex unavailable"})})
+
+    result = run("gpt-4o", ["mistral-large2", "gpt-4o"], mode="all")
+
+    assert list(result["models"]) == ["gpt-4o", "mistral-large2"]
+    assert result["winner"] == "gpt-4o"
+    assert result["models"]["mistral-large2"]["outcome"] == "errors"
+    assert result["responses"]["mistral-large2"] == {"error": "Cortex unavailable"}
@@ -0,0 +1,60 @@
+import plan_ranker
+from conftest import make_patient, make_plan
+from plan_ranker import cost_attributes, shortlist_plans
+
+
+def plan(plan_id, deductible, moop, coinsurance="10%", **attributes):
+    return make_plan(plan_id, TEHBDedInnTier1Individual=f"${deductible:,}", TEHBInnTier1IndividualMOOP=f"${moop:,}",
+                     TEHBDedInnTier1Coinsurance=coinsurance, **attributes)
+
+
+def test_small_candidate_lists_are_kept_whole_and_sorted():
+    plans = [plan(f"P{i}", 1000 * (3 - i), 5000) for i in range(3)]
+    shortlisted, stats = shortlist_plans(plans, make_patient(1), "gpt-4o")
+
+    assert [p["PlanId"] for p in shortlisted] == ["P2", "P1", "P0"]
+    assert stats["candidates"] == stats["shortlisted"] == 3
+    assert stats["shortlist_size"] == plan_ranker.MODEL_SHORTLIST_SIZES["gpt-4o"]
+
+
+def test_shortlist_keeps_the_cheapest_plans_per_model_size(monkeypatch):
+    monkeypatch.setitem(plan_ranker.MODEL_SHORTLIST_SIZES, "test-model", 3)
+    plans = [plan(f"P{i}", 1000 * (10 - i), 2000 * (10 - i)) for i in range(10)]
+
+    shortlisted, stats = shortlist_plans(plans, make_patient(1), "test-model")
+
+    assert [p["PlanId"] for p in shortlisted] == ["P9", "P8", "P7"]
+    assert (stats["candidates"], stats["shortlisted"], stats["shortlist_size"]) == (10, 3, 3)
+
+
+def test_shortlist_uses_default_size_for_unknown_models(monkeypatch):
+    monkeypatch.setattr(plan_ranker, "DEFAULT_SHORTLIST_SIZE", 2)
+    plans = [plan(f"P{i}", 1000 * i, 5000) for i in range(5)]
+    shortlisted, _ = shortlist_plans(plans, make_patient(1), "some-new-model")
+    assert [p["PlanId"] for p in shortlisted] == ["P0", "P1"]
+
+
+def test_missing_values_are_neutral_and_ties_break_on_plan_id(monkeypatch):
+    monkeypatch.setitem(plan_ranker.MODEL_SHORTLIST_SIZES, "test-model", 2)
+    plans = [
+        make_plan("empty-2"),
+        plan("expensive", 9000, 9000, "50%"),
+        make_plan("empty-1"),
+        plan("cheap", 100, 1000, "0%"),
+    ]
+    shortlisted, _ = shortlist_plans(plans, make_patient(1), "test-model")
+    assert [p["PlanId"] for p in shortlisted] == ["cheap", "empty-1"]
+    assert shortlist_plans(plans[::-1], make_patient(1), "test-model")[0] == shortlisted
+
+
+def test_cost_attributes_follow_rules_and_occupation():
+    base = cost_attributes(make_patient(1))
+    assert base == plan_ranker.BASE_COST_ATTRIBUTES
+
+    diabetic = cost_attributes(make_patient(1, medical_conditions=["Diabetes"]))
+    assert "SBCHavingDiabetesDeductible" in diabetic
+    assert len(diabetic) == len(set(diabetic))
+
+    builder = cost_attributes(make_patient(1, occupation="construction worker"))
+    assert "SBCHavingSimplefractureDeductible" in builder
+    assert "SBCHavingSimplefractureLimit" not in builder
@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+import prompt
+from conftest import make_patient, make_plan
+from prompt import execute_cortex_batch
+
+PLANS = [make_plan(f"P{i}", TEHBDedInnTier1Individual=f"${1000 * i:,}") for i in range(1, 4)]
+
+
+def recommendation(plan_id):
+    return json.dumps({"recommended_plans": [{"rank": 1, "PlanId": plan_id}], "summary": None})
+
+
+class FakeCursor:
+    """
+    Records the statements execute_cortex_batch sends and answers the COMPLETE select from `outputs`.
+    """
+
+    def __init__(self, outputs, fail_on=None):
+        self.outputs = outputs
+        self.fail_on = fail_on
+        self.statements = []
+        self.inserted = []
+
+    def execute(self, statement, params=None):
+        self.statements.append(" ".join(statement.split()))
+        if self.fail_on and self.fail_on in statement:
+            raise RuntimeError("warehouse suspended")
+
+    def executemany(self, statement, rows):
+        self.inserted.extend(rows)
+
+    def fetchall(self):
+        return [(key, self.outputs.get(key)) for key, _ in self.inserted]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.closed = False
+
+    def cursor(self):
+        return self._cursor
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def snowflake(monkeypatch):
+    calls = []
+    monkeypatch.setattr(prompt, "CORTEX_STUB_URL", "")
+    monkeypatch.setattr(prompt, "record_llm_call", lambda model, provider, operation, outcome, *args, **kwargs: calls.append(outcome))
+    monkeypatch.setattr(prompt, "fetch_selected_insurance_plans", lambda plan_ids: [p for p in PLANS if p["PlanId"] in plan_ids])
+
+    def connect(outputs, fail_on=None):
+        connection = FakeConnection(FakeCursor(outputs, fail_on))
+        monkeypatch.setattr(prompt, "get_snowflake_connection", lambda: connection)
+        return connection
+
+    return connect, calls
+
+
+REQUESTS = [
+    {"key": "1", "patient_data": make_patient(1), "plan_ids": ["P1", "P2"]},
+    {"key": "2", "patient_data": make_patient(2), "plan_ids": ["P3"]},
+    {"key": "3", "patient_data": make_patient(3), "plan_ids": ["P9"]},
+    {"key": "4", "patient_data": make_patient(4), "plan_ids": ["P2"]},
+]
+
+
+def test_batch_runs_one_complete_over_every_prompt(snowflake):
+    connect, calls = snowflake
+    connection = connect({"1": recommendation("P1"), "2": "not json", "4": None})
+    stats = {}
+
+    results = execute_cortex_batch(REQUESTS, "mistral-large2", stats=stats)
+
+    cursor = connection._cursor
+    assert [key for key, _ in cursor.inserted] == ["1", "2", "4"]
+    assert json.loads(cursor.inserted[0][1])["messages"]
+    assert sum("CORTEX.COMPLETE" in statement for statement in cursor.statements) == 1
+    assert connection.closed
+
+    assert results["1"]["recommended_plans"][0]["PlanId"] == "P1"
+    assert results["2"]["raw_output"] == "not json"
+    assert results["3"] == {"error": "No plans retrieved from Snowflake"}
+    assert results["4"] == {"error": "No response from Cortex"}
+    assert sorted(calls) == ["error", "invalid", "parsed"]
+    assert stats["batch_rows"] == 3
+
+
+def test_failed_batch_reports_the_error_for_every_patient(snowflake):
+    connect, calls = snowflake
+    connect({}, fail_on="CORTEX.COMPLETE")
+
+    results = execute_cortex_batch(REQUESTS[:2], "mistral-large2")
+
+    assert results == {key: {"error": "Error executing Cortex: warehouse suspended"} for key in ("1", "2")}
+    assert calls == ["error", "error"]
+
+
+def test_batch_without_requests_does_not_connect(snowflake, monkeypatch):
+    monkeypatch.setattr(prompt, "get_snowflake_connection", lambda: pytest.fail("connected"))
+    assert execute_cortex_batch([], "mistral-large2") == {}
+    assert execute_cortex_batch(REQUESTS[2:3], "mistral-large2") == {"3": {"error": "No plans retrieved from Snowflake"}}
@@ -0,0 +1,52 @@
+import app
+import prompt_encoder
+from conftest import make_patient, make_plan
+from prompt_encoder import encode_plans, fit_plans_to_budget
+from recommendation_cache import recommendation_cache_key
+
+PLANS = [
+    make_plan(f"{i:05d}TX00{i:02d}0001", PlanMarketingName=f"Plan number {i} with a long marketing name",
+              TEHBDedInnTier1Individual=f"${1000 + 250 * i:,}", TEHBInnTier1IndividualMOOP=f"${5000 + 100 * i:,}")
+    for i in range(20)
+]
+
+
+def test_encode_plans_lists_shared_values_once():
+    text, stats = encode_plans(PLANS, make_patient(1), "gpt-4o")
+
+    assert text.startswith("Shared by all plans: PlanType=HMO")
+    assert len(text.splitlines()) == 2 + len(PLANS)
+    assert stats["plans_included"] == len(PLANS)
+    assert stats["plans_dropped"] == 0
+    assert "dropped_plan_ids" not in stats
+
+
+def test_fitted_plans_are_encoded_without_dropping_any(monkeypatch):
+    monkeypatch.setitem(prompt_encoder.MODEL_PLAN_TOKEN_BUDGETS, "gpt-4o", 200)
+    patient = make_patient(1)
+
+    fitted, left_out = fit_plans_to_budget(PLANS, patient, "gpt-4o")
+    assert 0 < len(fitted) < len(PLANS)
+    assert left_out == len(PLANS) - len(fitted)
+    assert fitted == PLANS[:len(fitted)]
+
+    _, stats = encode_plans(fitted, patient, "gpt-4o")
+    assert stats["plans_dropped"] == 0
+
+    # Without fitting first the encoder still drops the tail, but says which plans
+    _, stats = encode_plans(PLANS, patient, "gpt-4o")
+    assert stats["dropped_plan_ids"] == [plan["PlanId"] for plan in PLANS[stats["plans_included"]:]]
+
+
+def test_recommendation_request_only_keys_on_plans_the_model_sees(monkeypatch):
+    monkeypatch.setitem(prompt_encoder.MODEL_PLAN_TOKEN_BUDGETS, "gpt-4o", 200)
+    patient = make_patient(1)
+
+    request = app.build_recommendation_request(patient, PLANS, "HMO", "gpt-4o")
+    text, _ = encode_plans(request["plans"], patient, "gpt-4o")
+
+    assert len(request["plan_ids"]) < len(PLANS)
+    assert all(plan_id in text for plan_id in request["plan_ids"])
+    assert request["prompt_stats"]["shortlisted"] == len(request["plan_ids"])
+    assert request["prompt_stats"]["over_token_budget"] > 0
+    assert request["cache_key"] == recommendation_cache_key(patient, request["plan_ids"], "gpt-4o", app.OPENAI_PROMPT_VERSION)
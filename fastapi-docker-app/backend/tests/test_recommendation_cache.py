@@ -0,0 +1,46 @@
+import pytest
+
+from conftest import make_patient
+from recommendation_cache import RecommendationCache, recommendation_cache_key
+
+
+@pytest.fixture
+def recommendations(state_dir):
+    return RecommendationCache(ttl_seconds=60, max_entries=2)
+
+
+def test_recommendation_key_ignores_row_id_and_ordering():
+    patient = make_patient(1, medical_conditions=["Asthma", "Diabetes"])
+    same = make_patient(2, name=patient["name"], medical_conditions=["Diabetes", "Asthma"])
+
+    key = recommendation_cache_key(patient, ["B", "A"], "gpt-4o", "v1")
+    assert recommendation_cache_key(same, ["A", "B"], "gpt-4o", "v1") == key
+    assert recommendation_cache_key(patient, ["A", "B", "C"], "gpt-4o", "v1") != key
+    assert recommendation_cache_key(patient, ["A", "B"], "gpt-4o-mini", "v1") != key
+    assert recommendation_cache_key(patient, ["A", "B"], "gpt-4o", "v2") != key
+    assert recommendation_cache_key(make_patient(1, age=31), ["A", "B"], "gpt-4o", "v1") != key
+
+
+def test_recommendation_cache_round_trip(recommendations):
+    assert recommendations.get("k") is None
+    recommendations.set("k", "gpt-4o", {"recommended_plans": [{"rank": 1, "PlanId": "A"}]})
+    assert recommendations.get("k") == {"recommended_plans": [{"rank": 1, "PlanId": "A"}]}
+
+
+def test_recommendation_cache_expires_entries(recommendations):
+    recommendations.set("k", "gpt-4o", {"recommended_plans": [{"rank": 1, "PlanId": "A"}]})
+    recommendations.ttl_seconds = -1
+    assert recommendations.get("k") is None
+
+
+def test_recommendation_cache_evicts_least_recently_used(recommendations, monkeypatch):
+    clock = iter(range(100, 200))
+    monkeypatch.setattr("recommendation_cache.time.time", lambda: next(clock))
+    recommendations.set("a", "gpt-4o", {"n": 1})
+    recommendations.set("b", "gpt-4o", {"n": 2})
+    recommendations.get("a")
+    recommendations.set("c", "gpt-4o", {"n": 3})
+
+    assert recommendations.get("b") is None
+    assert recommendations.get("a") == {"n": 1}
+    assert recommendations.get("c") == {"n": 3}
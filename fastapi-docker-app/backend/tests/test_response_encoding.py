@@ -0,0 +1,77 @@
+import gzip
+import json
+
+import pytest
+from starlette.requests import Request
+
+import response_encoding
+from conftest import make_plan
+from response_encoding import encoded_response, negotiate_encoding, negotiate_format, parse_fields, shape_content
+
+
+def request_with(**headers):
+    raw = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw, "query_string": b""})
+
+
+def test_fields_and_null_stripping_apply_to_plans_only():
+    content = {
+        "patient_id": {"id": 1, "occupation": None},
+        "summary": None,
+        "preferred_plans": [make_plan("P1", IssuerName="Acme", MetalLevel=None), make_plan("P2", IssuerName=None)],
+    }
+
+    shaped = shape_content(content, parse_fields("PlanType, IssuerName"), exclude_none=True)
+
+    assert shaped["summary"] is None
+    assert shaped["patient_id"] == {"id": 1, "occupation": None}
+    assert shaped["preferred_plans"] == [
+        {"PlanId": "P1", "PlanType": "HMO", "IssuerName": "Acme"},
+        {"PlanId": "P2", "PlanType": "HMO"},
+    ]
+    assert shape_content(content, None, exclude_none=False)["preferred_plans"][1]["IssuerName"] is None
+
+
+def test_parse_fields_always_keeps_the_plan_id():
+    assert parse_fields("PlanType,,") == {"PlanId", "PlanType"}
+    assert parse_fields("") is None
+
+
+def test_format_negotiation(monkeypatch):
+    monkeypatch.setattr(response_encoding, "msgpack", object())
+    assert negotiate_format("application/msgpack") == "msgpack"
+    assert negotiate_format("application/json, application/x-msgpack;q=0") == "json"
+    monkeypatch.setattr(response_encoding, "msgpack", None)
+    assert negotiate_format("application/msgpack") == "json"
+
+
+def test_encoding_negotiation(monkeypatch):
+    size = response_encoding.RESPONSE_COMPRESSION_MIN_BYTES
+    monkeypatch.setattr(response_encoding, "zstandard", None)
+    assert negotiate_encoding("gzip", size - 1) == "identity"
+    assert negotiate_encoding("gzip, zstd", size) == "gzip"
+    assert negotiate_encoding("gzip;q=0", size) == "identity"
+    assert negotiate_encoding("*", size) == "gzip"
+    monkeypatch.setattr(response_encoding, "zstandard", object())
+    assert negotiate_encoding("gzip, zstd", size) == "zstd"
+
+
+def test_large_responses_are_compressed_and_small_ones_are_not():
+    plans = [make_plan(f"P{i}", IssuerName="Acme Health", MetalLevel=None) for i in range(100)]
+
+    response = encoded_response(request_with(accept_encoding="gzip"), plans, "test", fields="IssuerName")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept, Accept-Encoding"
+    assert json.loads(gzip.decompress(response.body)) == [{"PlanId": f"P{i}", "IssuerName": "Acme Health"} for i in range(100)]
+
+    small = encoded_response(request_with(accept_encoding="gzip"), plans[:1], "test")
+    assert "Content-Encoding" not in small.headers
+    assert json.loads(small.body) == [{"PlanId": "P0", "PlanType": "HMO", "IssuerName": "Acme Health"}]
+    assert response_encoding.encoding_stats.report()["endpoints"]["test"]["encodings"] == {"gzip": 1, "identity": 1}
+
+
+def test_msgpack_round_trip():
+    msgpack = pytest.importorskip("msgpack")
+    response = encoded_response(request_with(accept="application/msgpack"), [make_plan("P1")], "test-msgpack")
+    assert response.media_type == "application/msgpack"
+    assert msgpack.unpackb(response.body) == [{"PlanId": "P1", "PlanType": "HMO"}]
@@ -0,0 +1,141 @@
+import pytest
+
+import rules
+from conftest import make_patient, make_plan
+from memory_graph import percentile_cont_median
+
+
+def cost(deductible, coinsurance, moop):
+    return {"TEHBDedInnTier1Individual": float(deductible), "TEHBDedInnTier1Coinsurance": float(coinsurance),
+            "TEHBInnTier1IndividualMOOP": float(moop)}
+
+
+def diabetes(value):
+    return {attr: float(value) for attr in rules.RULE_ATTRIBUTES["Diabetes"]}
+
+
+# HMO medians are the third plan's values, so H1-H3 pass the cost rules; the diabetes values are ordered
+# differently, so H2-H4 pass the Diabetes rule. PPO plans have no diabetes attributes.
+PLANS = [
+    make_plan("H1", **cost(1000, 10, 3000), **diabetes(50)),
+    make_plan("H2", **cost(2000, 20, 4000), **diabetes(10)),
+    make_plan("H3", **cost(3000, 30, 5000), **diabetes(20)),
+    make_plan("H4", **cost(4000, 40, 6000), **diabetes(30)),
+    make_plan("H5", **cost(5000, 50, 7000), **diabetes(40)),
+    make_plan("P1", "PPO", **cost(500, 5, 2000)),
+    make_plan("P2", "PPO", **cost(9000, 50, 9000)),
+]
+
+
+def load_patient(graph, patient, plans=PLANS):
+    rules.upsert_patient(graph, patient)
+    rules.link_considered_plans(graph, patient["id"], [(plan["PlanId"], dict(plan)) for plan in plans])
+    return rules.apply_selected_rules(graph, patient)
+
+
+def normalized(distribution):
+    plan_distribution, plan_type_distribution, highest_rule_count = distribution
+    return (
+        {
+            count: (entry["count"], sorted((tuple(s["rules"]), s["count"]) for s in entry["rule_sets_summary"]))
+            for count, entry in plan_distribution.items()
+        },
+        plan_type_distribution,
+        highest_rule_count,
+    )
+
+
+def test_percentile_cont_median_interpolates():
+    assert percentile_cont_median([4, 1, 3, 2]) == 2.5
+    assert percentile_cont_median([3, None, 1, 2]) == 2
+    assert percentile_cont_median([]) is None
+
+
+@pytest.mark.parametrize("overrides, expected", [
+    ({}, ["Default"]),
+    ({"medical_conditions": ["Diabetes"], "age": 55}, ["Diabetes", "Older_Adults"]),
+    ({"gender": "Female", "age": 30, "family_coverage": True}, ["Maternity", "Family_Coverage"]),
+])
+def test_select_rules(overrides, expected):
+    assert [rule["rule_name"] for rule in rules.select_rules(make_patient(1, **overrides))] == expected
+
+
+def test_default_rule_matches_plans_at_or_below_the_medians(graph):
+    results = load_patient(graph, make_patient(1))
+
+    assert sorted(plan["PlanId"] for plan in results["Default"]["plans"]) == ["H1", "H2", "H3", "P1"]
+    assert results["Default"]["patient"]["id"] == 1
+
+
+def test_plan_distribution_counts_rules_per_plan(graph):
+    load_patient(graph, make_patient(1, medical_conditions=["Diabetes"], age=55))
+
+    plan_distribution, plan_type_distribution, highest_rule_count = normalized(rules.get_plan_distribution(graph, 1))
+
+    assert highest_rule_count == 2
+    assert plan_distribution == {
+        2: (2, [(("DIABETES", "OLDER_ADULTS"), 2)]),
+        1: (3, [(("DIABETES",), 1), (("OLDER_ADULTS",), 2)]),
+        0: (2, [((), 2)]),
+    }
+    assert plan_type_distribution == {"HMO": 2}
+
+
+def test_plans_by_type_count_considers_like_the_cypher_query(graph):
+    load_patient(graph, make_patient(1, medical_conditions=["Diabetes"], age=55))
+
+    # Two rule edges plus CONSIDERS
+    plans = rules.get_plans_by_type_from_neo4j(graph, 1, "HMO", 3)
+    assert sorted(plan["PlanId"] for plan in plans) == ["H2", "H3"]
+    assert sorted(rules.get_plan_ids_from_neo4j(graph, 1, "HMO", 3)) == ["H2", "H3"]
+    assert rules.get_plan_ids_from_neo4j(graph, 1, "PPO", 3) == []
+
+
+def test_rules_link_every_plan_of_the_type_in_the_graph(graph):
+    load_patient(graph, make_patient(1))
+    # The second patient only considered H1, but the medians and rule edges cover every HMO plan in the graph
+    results = load_patient(graph, make_patient(2), plans=[PLANS[0]])
+
+    assert sorted(plan["PlanId"] for plan in results["Default"]["plans"]) == ["H1", "H2", "H3", "P1"]
+    plan_distribution, _, _ = normalized(rules.get_plan_distribution(graph, 2))
+    assert plan_distribution == {1: (4, [(("DEFAULT",), 4)])}
+
+
+def test_patient_without_plans_has_empty_distribution(graph):
+    rules.upsert_patient(graph, make_patient(1))
+    assert rules.get_plan_distribution(graph, 1) == ({}, {}, 0)
+
+
+class FakeSession:
+    """
+    Answers the catalog version and rule median queries the Neo4j path runs.
+    """
+
+    def __init__(self):
+        self.catalog_version = 1
+        self.median = 100.0
+        self.queries = []
+
+    def run(self, query, **params):
+        self.queries.append(query)
+        if "PlanCatalog" in query:
+            record = {"version": self.catalog_version}
+        else:
+            record = {f"median_{attr}": self.median for attr in rules.RULE_ATTRIBUTES["Older_Adults"]}
+        return type("Result", (), {"single": lambda _: record})()
+
+
+def test_rule_medians_follow_in_place_plan_updates(monkeypatch):
+    monkeypatch.setattr(rules, "_rule_stats", {})
+    session = FakeSession()
+    attributes = rules.RULE_ATTRIBUTES["Older_Adults"]
+
+    version = rules.graph_plan_version(session)
+    assert rules.graph_rule_medians(session, version, "HMO", attributes) == {attr: 100.0 for attr in attributes}
+    session.median = 50.0
+    assert rules.graph_rule_medians(session, rules.graph_plan_version(session), "HMO", attributes)[attributes[0]] == 100.0
+
+    # A plan's properties changed without adding plans: the writer bumped the catalog version
+    session.catalog_version = 2
+    assert rules.graph_rule_medians(session, rules.graph_plan_version(session), "HMO", attributes)[attributes[0]] == 50.0
+    assert not any("count(" in query for query in session.queries)
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from conftest import make_patient
+from segment_cache import SegmentCache, render_for_patient, segment_cache_key
+
+RANKING = {
+    "recommended_plans": [
+        {"rank": 1, "PlanId": "A", "PlanMarketingName": "Alice Springs Gold",
+         "Justification": "Alice, a 34-year-old teacher, keeps costs low."},
+        {"rank": 2, "PlanId": "B", "ScoreExplanation": "Good for a teacher."},
+    ],
+    "summary": "Alice should pick plan A.",
+}
+
+
+@pytest.fixture
+def segments(state_dir):
+    return SegmentCache(ttl_seconds=60, max_uses=2)
+
+
+def test_segment_key_groups_similar_patients():
+    patient = make_patient(1, name="Alice", age=34, occupation="teacher")
+    key = segment_cache_key(patient, "HMO", "gpt-4o", "v1")
+
+    assert segment_cache_key(make_patient(2, name="Bob", age=38, occupation="nurse"), "HMO", "gpt-4o", "v1") == key
+    assert segment_cache_key(make_patient(3, age=41), "HMO", "gpt-4o", "v1") != key
+    assert segment_cache_key(make_patient(4, occupation="roofer"), "HMO", "gpt-4o", "v1") != key
+    assert segment_cache_key(patient, "PPO", "gpt-4o", "v1") != key
+
+
+def test_render_rewrites_whole_words_in_narrative_fields_only():
+    source = {"name": "Alice", "age": 34, "occupation": "teacher"}
+    rendered = render_for_patient(RANKING, source, {"name": "Bob", "age": 38, "occupation": "nurse"})
+
+    first, second = rendered["recommended_plans"]
+    assert first["Justification"] == "Bob, a 38-year-old nurse, keeps costs low."
+    assert first["PlanMarketingName"] == "Alice Springs Gold"
+    assert second["ScoreExplanation"] == "Good for a nurse."
+    assert rendered["summary"] == "Bob should pick plan A."
+
+
+def test_render_rewrites_json_text_and_refuses_short_names_it_cannot_replace():
+    source = {"name": "Al", "age": 34, "occupation": "teacher"}
+    text = json.dumps({"recommended_plans": [{"rank": 1, "PlanId": "A", "Justification": "Al, also a teacher."}]})
+
+    assert render_for_patient(text, source, {"name": "Bob", "age": 34, "occupation": "nurse"}) is None
+    safe = json.dumps({"recommended_plans": [{"rank": 1, "PlanId": "A", "Justification": "Also a teacher."}]})
+    rendered = json.loads(render_for_patient(safe, source, {"name": "Bob", "age": 34, "occupation": "nurse"}))
+    assert rendered["recommended_plans"][0]["Justification"] == "Also a nurse."
+
+
+def test_segment_cache_serves_rendered_rankings_until_max_uses(segments):
+    alice = make_patient(1, name="Alice", age=34, occupation="teacher")
+    bob = make_patient(2, name="Bob", age=38, occupation="nurse")
+    segments.set("k", "gpt-4o", RANKING, alice)
+
+    assert segments.get("k", bob, ["A", "B", "C"])["summary"] == "Bob should pick plan A."
+    assert segments.get("k", alice, ["A", "B"]) == RANKING
+    assert segments.get("k", bob, ["A", "B"]) is None
+
+    stats = segments.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 1, 1)
+
+
+def test_segment_cache_misses_when_a_plan_is_not_a_candidate(segments):
+    segments.set("k", "gpt-4o", RANKING, make_patient(1, name="Alice"))
+    assert segments.get("k", make_patient(2, name="Bob"), ["A"]) is None
+
+
+def test_segment_cache_skips_rankings_without_plans(segments):
+    segments.set("k", "gpt-4o", {"recommended_plans": [], "error": "bad output"}, make_patient(1))
+    assert segments.stats()["entries"] == 0
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from llm_output import RecommendedPlanStreamParser
+
+PLANS = [
+    {"rank": 1, "PlanId": "11111TX0010001", "PlanMarketingName": "Gold {Plus}", "TotalScore": 91,
+     "Justification": "Low deductible, \"great\" for diabetes care"},
+    {"rank": 2, "PlanId": "22222TX0020002", "PlanMarketingName": "Silver", "TotalScore": 84},
+    {"rank": 3, "PlanId": "33333TX0030003", "PlanMarketingName": "Bronze", "TotalScore": 70},
+]
+PLAN_IDS = [plan["PlanId"] for plan in PLANS]
+DOCUMENT = json.dumps({"recommended_plans": PLANS, "summary": "Three plans fit the budget."})
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, len(DOCUMENT)])
+def test_stream_parser_yields_each_plan_once_complete(chunk_size):
+    parser = RecommendedPlanStreamParser()
+    completed = []
+    for start in range(0, len(DOCUMENT), chunk_size):
+        completed.extend(parser.feed(DOCUMENT[start:start + chunk_size]))
+
+    assert completed == PLANS
+    assert parser.text == DOCUMENT
+
+
+def test_stream_parser_emits_plan_before_the_rest_arrives():
+    parser = RecommendedPlanStreamParser()
+    first_end = DOCUMENT.index("}", DOCUMENT.index('"Justification"')) + 1
+
+    assert parser.feed(DOCUMENT[:first_end - 1]) == []
+    assert parser.feed(DOCUMENT[first_end - 1:first_end]) == [PLANS[0]]
+
+
+def test_stream_parser_ignores_objects_after_the_array():
+    parser = RecommendedPlanStreamParser()
+    text = 'Sure! ```json\n{"recommended_plans": [{"rank": 1, "PlanId": "A"}], "meta": {"PlanId": "B"}}```'
+    assert parser.feed(text) == [{"rank": 1, "PlanId": "A"}]
+    assert parser.feed('{"rank": 2}') == []
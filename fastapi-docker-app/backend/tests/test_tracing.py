@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tracing
+from tracing import NO_SPAN, bind_context, request_trace, span, start_span, to_otlp
+
+TRACEPARENT = "00-" + "a" * 32 + "-" + "b" * 16 + "-01"
+
+
+@pytest.fixture
+def exported(monkeypatch):
+    batches = []
+    monkeypatch.setattr(tracing.exporter, "export", batches.append)
+    return batches
+
+
+def by_name(spans):
+    return {s.name: s for s in spans}
+
+
+def filter_plans():
+    with span("snowflake", "filter"):
+        pass
+
+
+def test_spans_nest_under_the_request_and_across_bound_threads(exported):
+    with request_trace("GET /plans", traceparent=TRACEPARENT) as (trace, root):
+        with span("neo4j", "cypher") as query:
+            with span("neo4j", "cypher.page"):
+                pass
+        with ThreadPoolExecutor(1) as pool:
+            pool.submit(bind_context(filter_plans)).result()
+
+    spans = by_name(exported[0])
+    assert trace.trace_id == "a" * 32
+    assert root.parent_id == "b" * 16
+    assert spans["cypher"].parent_id == root.span_id
+    assert spans["cypher.page"].parent_id == query.span_id
+    assert spans["filter"].parent_id == root.span_id
+    assert {s.trace.trace_id for s in exported[0]} == {"a" * 32}
+
+
+def test_malformed_traceparent_starts_a_new_trace(exported):
+    with request_trace("GET /", traceparent="00-" + "0" * 32 + "-" + "b" * 16 + "-01") as (trace, root):
+        pass
+    assert trace.trace_id != "0" * 32 and root.parent_id is None
+
+
+def test_server_timing_sums_spans_per_category(exported):
+    with request_trace("POST /advise/") as (trace, _):
+        for name in ("first", "second"):
+            with span("snowflake", name):
+                pass
+        with span("llm", "complete"):
+            pass
+        header = trace.server_timing(12.34)
+
+    entries = [entry.split(";")[0] for entry in header.split(", ")]
+    assert entries == ["snowflake", "llm", "total", "trace"]
+    assert 'desc="2 calls"' in header and 'desc="1 call"' in header
+    assert "total;dur=12.3" in header
+    assert f'trace;desc="{trace.trace_id}"' in header
+
+
+def test_failed_spans_carry_the_error_and_late_spans_export_on_their_own(exported):
+    with request_trace("POST /stream") as _:
+        with pytest.raises(ValueError):
+            with span("llm", "complete"):
+                raise ValueError("boom")
+        late = start_span("llm", "stream.tail")
+
+    late.end()
+    assert [s.name for s in exported[1]] == ["stream.tail"]
+    failed = by_name(exported[0])["complete"]
+    otlp = to_otlp([failed])["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert otlp["status"] == {"code": 2, "message": "ValueError: boom"}
+    assert otlp["parentSpanId"] == failed.parent_id
+
+
+def test_spans_outside_a_request_are_no_ops(exported):
+    assert start_span("neo4j", "cypher") is NO_SPAN
+    with span("neo4j", "cypher") as current:
+        current.set("db.rows", 1)
+    assert exported == []
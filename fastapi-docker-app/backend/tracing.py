@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import queue
+import secrets
+import threading
+import contextvars
+from contextlib import contextmanager
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() in ("1", "true", "yes")
+# Finished traces are written as OTLP/JSON, one export request per line, and/or POSTed to an OTLP/HTTP collector
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")  # e.g. http://otel-collector:4318/v1/traces
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "intellihealth-backend")
+TRACE_STATEMENT_MAX_CHARS = int(os.getenv("TRACE_STATEMENT_MAX_CHARS", "2000"))
+
+# Span categories summed into the Server-Timing header, in header order
+SERVER_TIMING_CATEGORIES = ("postgres", "snowflake", "neo4j", "llm")
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed operation. category groups spans for Server-Timing ("postgres", "snowflake", "neo4j", "llm").
+    """
+
+    def __init__(self, trace, parent_id, category, name, kind, attributes):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.category = category
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes)
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def end(self, error=None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.trace.add(self)
+
+    @property
+    def duration_ms(self):
+        return (self.end_ns - self.start_ns) / 1e6 if self.end_ns is not None else None
+
+
+class _NoSpan:
+    # Returned outside a traced request so call sites never need to check
+    def set(self, key, value):
+        pass
+
+    def end(self, error=None):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+class Trace:
+    """
+    Spans of one request. Spans that end after the response was sent (streams, fan-out losers) are exported on their own.
+    """
+
+    def __init__(self, trace_id=None, remote_parent_id=None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.remote_parent_id = remote_parent_id
+        self.spans = []
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            if not self.finished:
+                self.spans.append(span)
+                return
+        exporter.export([span])
+
+    def finish(self):
+        with self._lock:
+            self.finished = True
+            spans = list(self.spans)
+        exporter.export(spans)
+        return spans
+
+    def server_timing(self, total_ms=None):
+        """
+        Server-Timing header value: summed time and count per category, plus the whole request.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        entries = []
+        for category in SERVER_TIMING_CATEGORIES:
+            durations = [span.duration_ms for span in spans if span.category == category]
+            if durations:
+                calls = f"{len(durations)} call" + ("s" if len(durations) != 1 else "")
+                entries.append(f'{category};dur={sum(durations):.1f};desc="{calls}"')
+        if total_ms is not None:
+            entries.append(f"total;dur={total_ms:.1f}")
+        entries.append(f'trace;desc="{self.trace_id}"')
+        return ", ".join(entries)
+
+
+def parse_traceparent(header):
+    """
+    (trace_id, parent_span_id) from a W3C traceparent header, or (None, None) if absent or malformed.
+    """
+    parts = (header or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == "0" * 32:
+        return None, None
+    return parts[1], parts[2]
+
+
+def start_span(category, name, kind="client", **attributes):
+    """
+    Starts a leaf span under the current span without making it current; the caller ends it.
+    Returns NO_SPAN outside a traced request.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return NO_SPAN
+    parent = _current_span.get()
+    return Span(trace, parent.span_id if parent else trace.remote_parent_id, category, name, kind, attributes)
+
+
+@contextmanager
+def span(category, name, kind="client", **attributes):
+    """
+    Times the enclosed block as a span; spans started inside it (on this thread or bound threads) are its children.
+    """
+    current = start_span(category, name, kind, **attributes)
+    if current is NO_SPAN:
+        yield current
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+@contextmanager
+def request_trace(name, traceparent=None, **attributes):
+    """
+    Starts a trace for one request with a server span as its root, and exports it when the block exits.
+    """
+    trace_id, remote_parent_id = parse_traceparent(traceparent)
+    trace = Trace(trace_id, remote_parent_id)
+    trace_token = _current_trace.set(trace)
+    try:
+        with span("http", name, kind="server", **attributes) as root:
+            yield trace, root
+    finally:
+        _current_trace.reset(trace_token)
+        trace.finish()
+
+
+def bind_context(fn):
+    """
+    Wraps fn so it runs with the caller's trace and current span when a thread pool executes it.
+    Each call gets its own copy of the context, so the wrapper can be used with executor.map.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+def truncate_statement(statement):
+    statement = " ".join(str(statement).split())
+    return statement if len(statement) <= TRACE_STATEMENT_MAX_CHARS else statement[:TRACE_STATEMENT_MAX_CHARS] + "…"
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def to_otlp(spans):
+    """
+    OTLP/JSON ExportTraceServiceRequest for spans.
+    """
+    otlp_spans = []
+    for s in spans:
+        otlp_span = {
+            "traceId": s.trace.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": SPAN_KINDS.get(s.kind, 1),
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [_attribute("category", s.category)] + [_attribute(k, v) for k, v in s.attributes.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_id:
+            otlp_span["parentSpanId"] = s.parent_id
+        otlp_spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", TRACE_SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "intellihealth.tracing"}, "spans": otlp_spans}],
+        }]
+    }
+
+
+class SpanExporter:
+    """
+    Writes finished spans on a background thread, so requests never wait on the file or the collector.
+    """
+
+    def __init__(self, path=TRACE_EXPORT_PATH, endpoint=TRACE_OTLP_ENDPOINT, max_queue=10000):
+        self.path = path
+        self.endpoint = endpoint
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path or self.endpoint)
+
+    def export(self, spans):
+        if not spans or not self.enabled:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += len(spans)
+
+    def _run(self):
+        import httpx
+
+        client = httpx.Client(timeout=10) if self.endpoint else None
+        while True:
+            spans = self._queue.get()
+            # Drain whatever else is waiting into the same export request
+            while len(spans) < 1000:
+                try:
+                    spans = spans + self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            payload = to_otlp(spans)
+            try:
+                if self.path:
+                    with open(self.path, "a") as f:
+                        f.write(json.dumps(payload) + "\n")
+                if client is not None:
+                    client.post(self.endpoint, json=payload).raise_for_status()
+            except Exception as e:
+                print(f"⚠️ Could not export {len(spans)} spans: {e}")
+
+
+exporter = SpanExporter()
+
+
+def instrument_sqlalchemy(engine):
+    """
+    Adds a "postgres" span around every statement the engine runs.
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("trace_spans", []).append(start_span(
+            "postgres", "postgres.query", **{"db.system": engine.dialect.name, "db.statement": truncate_statement(statement)}
+        ))
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("trace_spans")
+        if spans:
+            current = spans.pop()
+            current.set("db.rows", cursor.rowcount if cursor.rowcount >= 0 else None)
+            current.end()
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        spans = exception_context.connection.info.get("trace_spans") if exception_context.connection is not None else None
+        if spans:
+            spans.pop().end(error=exception_context.original_exception)
@@ -0,0 +1,80 @@
+import os
+import time
+import threading
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() in ("1", "true", "yes")
+# Report ready even when a warm-up step failed (e.g. local runs without Snowflake credentials)
+WARMUP_FAIL_OPEN = os.getenv("WARMUP_FAIL_OPEN", "false").lower() in ("1", "true", "yes")
+
+
+class WarmUp:
+    """
+    Startup warm-up: named steps run once, in registration order, on a background thread.
+
+    The server accepts connections meanwhile, but readiness stays false until every step has run,
+    so a load balancer only routes patients to an instance whose pools, clients and caches are warm.
+    Each step's duration and return value (or error) is kept for the readiness report.
+    """
+
+    def __init__(self, enabled=WARMUP_ENABLED, fail_open=WARMUP_FAIL_OPEN):
+        self.enabled = enabled
+        self.fail_open = fail_open
+        self._steps = []
+        self._lock = threading.Lock()
+        self._status = "pending" if enabled else "ready"
+        self._results = {}
+        self._total_ms = None
+
+    def register(self, name, fn):
+        self._steps.append((name, fn))
+
+    def start(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._status != "pending":
+                return
+            self._status = "running"
+        threading.Thread(target=self.run, name="warmup", daemon=True).start()
+
+    def run(self):
+        start = time.perf_counter()
+        failed = False
+        for name, fn in self._steps:
+            step_start = time.perf_counter()
+            try:
+                detail = fn()
+                result = {"ok": True, "ms": round((time.perf_counter() - step_start) * 1000, 1)}
+                if detail is not None:
+                    result["detail"] = detail
+            except Exception as e:
+                failed = True
+                result = {"ok": False, "ms": round((time.perf_counter() - step_start) * 1000, 1), "error": str(e)}
+                print(f"⚠️ Warm-up step {name} failed: {e}")
+            with self._lock:
+                self._results[name] = result
+
+        with self._lock:
+            self._total_ms = round((time.perf_counter() - start) * 1000, 1)
+            self._status = "failed" if failed else "ready"
+        print(f"🔥 Warm-up {self._status} in {self._total_ms / 1000:.2f}s: "
+              + ", ".join(f"{name} {result['ms']:.0f}ms" for name, result in self._results.items()))
+
+    def _ready(self):
+        return self._status == "ready" or (self._status == "failed" and self.fail_open)
+
+    def is_ready(self):
+        with self._lock:
+            return self._ready()
+
+    def report(self):
+        with self._lock:
+            return {
+                "status": self._status,
+                "ready": self._ready(),
+                "total_ms": self._total_ms,
+                "steps": dict(self._results),
+            }
+
+
+warmup = WarmUp()
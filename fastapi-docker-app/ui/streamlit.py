@@ -17,7 +17,79 @@ disease_options = ["None", "Asthma", "Heart Disease", "Diabetes", "Depression",
 
 # LLM Model options
 llm_models = ["claude-3-5-sonnet", "llama3.1-405b", "mistral-large2", "gpt-4o-mini", "o3-mini-2025-01-31"]
-openai_models = ["gpt-4o-mini", "o3-mini-2025-01-31"]
+
+def read_sse_events(response):
+    """
+    Yields (event, data) pairs from a server-sent-events response.
+    """
+    event, data_lines = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+
+def server_timing_caption(response):
+    """
+    "snowflake 812 ms (3 calls) · neo4j 95 ms (12 calls) · total 940 ms" from the Server-Timing header, or None.
+    """
+    parts = []
+    for entry in response.headers.get("Server-Timing", "").split(","):
+        name, *params = [p.strip() for p in entry.split(";")]
+        values = dict(p.split("=", 1) for p in params if "=" in p)
+        if "dur" in values:
+            desc = values.get("desc", "").strip('"')
+            parts.append(f"{name} {float(values['dur']):.0f} ms" + (f" ({desc})" if desc else ""))
+    return " · ".join(parts) or None
+
+def render_plan(plan, idx):
+    """
+    Renders one recommended plan as an expander.
+    """
+    plan_name = plan.get('PlanMarketingName') or f'Plan {idx}'
+    rank = plan.get('rank', idx)
+
+    with st.expander(f"🏥 **Rank {rank}: {plan_name}**"):
+        key_attributes = ["IssuerName", "MetalLevel", "Deductible", "MaxOutOfPocket"]
+        existing_keys = [k for k in key_attributes if k in plan]
+        if existing_keys:
+            cols = st.columns(len(existing_keys))
+            for i, key in enumerate(existing_keys):
+                with cols[i]:
+                    st.markdown(f"**{key.replace('_', ' ').title()}:**  \n{plan[key]}")
+
+        if "Justification" in plan:
+            st.markdown("### Justification")
+            st.markdown(plan["Justification"])
+
+        if "ScoreBreakdown" in plan:
+            st.markdown("### Score Breakdown")
+            for attr, breakdown in plan["ScoreBreakdown"].items():
+                st.markdown(f"**{attr}**")
+                st.markdown(f"- Score: {breakdown.get('score')}")
+                st.markdown(f"- Relevance: {breakdown.get('relevance')}")
+                st.markdown(f"- Explanation: {breakdown.get('explanation')}")
+
+        st.markdown("### All Plan Details")
+        for key, value in plan.items():
+            if key in ["Justification", "ScoreBreakdown"]:
+                continue
+            formatted_key = key.replace('_', ' ').title()
+            if isinstance(value, dict):
+                st.markdown(f"**{formatted_key}:**")
+                st.json(value)
+            elif isinstance(value, list):
+                st.markdown(f"**{formatted_key}:**")
+                for item in value:
+                    st.markdown(f"- {item}")
+            else:
+                st.markdown(f"**{formatted_key}:** {value}")
+
 
 # Session defaults
 st.session_state.setdefault("patient_id", None)
@@ -93,6 +165,9 @@ with st.form("patient_form"):
 
             if process_response.status_code == 200:
                 st.success("✅ Plans processed successfully.")
+                timing = server_timing_caption(process_response)
+                if timing:
+                    st.caption(f"⏱ {timing}")
                 st.session_state.show_distribution = True
             else:
                 st.error(f"❌ Failed to process plans: {process_response.text}")
@@ -168,27 +243,39 @@ if "plans" in st.session_state and st.session_state.plans:
         st.session_state.llm_recommendation = None
 
     debug_container = st.empty()
+    bypass_cache = st.checkbox("Ignore cached recommendation")
 
     if st.button("🤖 Get AI Recommendation"):
+        # Plans are rendered as the backend streams them, then the page reruns with the full response
+        streamed_container = st.container()
+        streamed_count = 0
+        done = None
         with st.spinner("Calling AI model..."):
-            response = requests.post(f"{BACKEND_URL}/recommend-insurance/", params={
+            response = requests.post(f"{BACKEND_URL}/recommend-insurance/stream", params={
                 "patient_id": st.session_state.patient_id,
                 "plan_type": st.session_state.selected_plan_type.strip(),
                 "model_name": st.session_state.selected_llm_model.strip(),
-            })
-
-        st.session_state.raw_response = response.text
-
-        if response.status_code == 200:
-            try:
-                st.session_state.llm_recommendation = response.json()
-                st.rerun()
-            except Exception as e:
-                st.error(f"❌ Failed to parse JSON response: {str(e)}")
-                st.code(response.text, language="json")
-        else:
+                "bypass_cache": bypass_cache,
+            }, stream=True)
+
+            if response.status_code == 200:
+                for event, data in read_sse_events(response):
+                    if event == "plan":
+                        streamed_count += 1
+                        with streamed_container:
+                            render_plan(data, streamed_count)
+                    elif event == "error":
+                        st.error(f"❌ Error retrieving AI recommendation: {data.get('error')}")
+                    elif event == "done":
+                        done = data
+
+        if response.status_code != 200:
             st.error(f"❌ Error retrieving AI recommendation: {response.status_code}")
             st.code(response.text)
+        elif done is not None:
+            st.session_state.raw_response = json.dumps(done)
+            st.session_state.llm_recommendation = done
+            st.rerun()
 
     show_raw = st.checkbox("Show raw response")
     if show_raw and hasattr(st.session_state, "raw_response"):
@@ -196,93 +283,27 @@ if "plans" in st.session_state and st.session_state.plans:
 
     if st.session_state.llm_recommendation is not None:
         recommendation = st.session_state.llm_recommendation
-        model = st.session_state.selected_llm_model.strip()
+        # The backend returns parsed, validated output for every model
+        content = recommendation.get("recommendations") or {}
 
-        recommended_plans = None
+        if content.get("summary"):
+            st.markdown("### Summary")
+            st.markdown(content["summary"])
 
-        # 🔀 Handle OpenAI-style output (nested JSON string sometimes)
-        if model in openai_models:
-            content = recommendation.get("recommendations", recommendation)
+        if content.get("error"):
+            st.error(f"❌ The AI model did not return a usable recommendation: {content['error']}")
+            if content.get("raw_output"):
+                st.code(content["raw_output"])
+        elif content.get("repaired"):
+            st.info("ℹ️ The AI response was cut short; showing the plans that were complete.")
 
-            if isinstance(content, str):
-                try:
-                    content = json.loads(content)
-                except Exception:
-                    st.markdown("### Raw AI Response")
-                    st.markdown(content)
-                    content = None
-
-            if content:
-                if "summary" in content:
-                    st.markdown("### Summary")
-                    st.markdown(content["summary"])
-
-                recommended_plans = content.get("recommended_plans", [])
-
-        # 🔀 Handle non-OpenAI output (Cortex-style or consistent JSON dicts)
-        else:
-            raw = recommendation.get("recommendations", {}).get("raw_output", "")
-            json_start = raw.find("{")
-            json_end = raw.rfind("}") + 1
-
-            try:
-                json_part = raw[json_start:json_end]
-                parsed = json.loads(json_part)
-                recommended_plans = parsed.get("recommended_plans", [])
-            except Exception as e:
-                st.error(f"❌ Cortex parsing failed: {str(e)}")
-                st.code(raw)
+        recommended_plans = content.get("recommended_plans", [])
 
         # ✅ Display recommended plans
         if recommended_plans and len(recommended_plans) > 0:
             st.success(f"✅ Found {len(recommended_plans)} AI-recommended plans!")
 
             for idx, plan in enumerate(recommended_plans, start=1):
-                plan_name = (
-                    plan.get('PlanMarketingName') or
-                    plan.get('plan_marketing_name') or
-                    f'Plan {idx}'
-                )
-                rank = plan.get('rank', idx)
-
-                with st.expander(f"🏥 **Rank {rank}: {plan_name}**"):
-                    key_attributes = ["IssuerName", "MetalLevel", "Deductible", "MaxOutOfPocket"]
-                    existing_keys = [k for k in key_attributes if k in plan]
-                    if existing_keys:
-                        cols = st.columns(len(existing_keys))
-                        for i, key in enumerate(existing_keys):
-                            with cols[i]:
-                                st.markdown(f"**{key.replace('_', ' ').title()}:**  \n{plan[key]}")
-
-                    if "Justification" in plan:
-                        st.markdown("### Justification")
-                        st.markdown(plan["Justification"])
-
-                    if "ScoreBreakdown" in plan:
-                        st.markdown("### Score Breakdown")
-                        for attr, breakdown in plan["ScoreBreakdown"].items():
-                            st.markdown(f"**{attr}**")
-                            st.markdown(f"- Score: {breakdown.get('score')}")
-                            st.markdown(f"- Relevance: {breakdown.get('relevance')}")
-                            st.markdown(f"- Explanation: {breakdown.get('explanation')}")
-
-                    st.markdown("### All Plan Details")
-                    for key, value in plan.items():
-                        if key in ["Justification", "ScoreBreakdown"]:
-                            continue
-                        formatted_key = key.replace('_', ' ').title()
-                        if isinstance(value, dict):
-                            st.markdown(f"**{formatted_key}:**")
-                            st.json(value)
-                        elif isinstance(value, list):
-                            st.markdown(f"**{formatted_key}:**")
-                            for item in value:
-                                st.markdown(f"- {item}")
-                        else:
-                            st.markdown(f"**{formatted_key}:** {value}")
+                render_plan(plan, idx)
         else:
             st.warning("⚠️ No recommended plans found in the response.")
-            st.write("Available keys in response:", list(recommendation.keys()) if isinstance(recommendation, dict) else "Not a dictionary")
-
-            if "recommendations" in recommendation:
-                st.write("Keys in 'recommendations':", list(recommendation["recommendations"].keys()) if isinstance(recommendation["recommendations"], dict) else "Not a dictionary")